@@ -0,0 +1,217 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from graphql import parse
+
+# Chain head block number of every fake network
+CHAIN_HEAD_BLOCK_NUMBER = 10000000
+
+
+class FakeServer:
+    def __init__(self, latency: float = 0, error_rate: float = 0):
+        """
+        Local HTTP server that answers POST requests in a background thread
+        :param latency: float. Seconds to wait before answering each request
+        :param error_rate: float. Fraction of requests answered with HTTP 500
+        """
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+        fake_server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            # Keep-alive connections, like real servers
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request_json = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                status_code, response_json = fake_server.handle(request_json)
+
+                response_body = json.dumps(response_json).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response_body)))
+                self.end_headers()
+                self.wfile.write(response_body)
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.http_server.daemon_threads = True
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.http_server.server_port}/'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def handle(self, request_json) -> tuple:
+        """
+        Count the request, apply latency and errors and build the response
+        :return: tuple. (status code, response JSON)
+        """
+
+        with self.lock:
+            self.requests += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return 500, {'error': 'Fake error'}
+
+        return 200, self.build_response(request_json)
+
+    def build_response(self, request_json):
+        raise NotImplementedError
+
+
+class FakeIndexNodeServer(FakeServer):
+    def __init__(self, unhealthy_ratio: float = 0.05, pending_ratio: float = 0.1, **kwargs):
+        """
+        Graphql status endpoint with the `indexingStatusForCurrentVersion`, `indexingStatusForPendingVersion`,
+        `indexingStatuses` and `indexingStatusesForSubgraphName` fields of `subgraph_status_schema`.
+        Statuses are deterministic for each subgraph name
+        :param unhealthy_ratio: float. Fraction of subgraph versions that are failed and out of sync
+        :param pending_ratio: float. Fraction of subgraphs that have a pending version
+        """
+
+        super().__init__(**kwargs)
+        self.unhealthy_ratio = unhealthy_ratio
+        self.pending_ratio = pending_ratio
+
+    def _get_ratio(self, value: str) -> float:
+        """
+        Deterministic number between 0 and 1 for a value
+        """
+
+        return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:8], 16) / 0xffffffff
+
+    def build_subgraph_status(self, deployment: str, version: str) -> dict:
+        is_healthy = self._get_ratio(f'{version}-{deployment}') >= self.unhealthy_ratio
+        latest_block_number = CHAIN_HEAD_BLOCK_NUMBER - (2 if is_healthy else 1000)
+
+        return {
+            'subgraph': deployment,
+            'synced': True,
+            'health': 'healthy' if is_healthy else 'failed',
+            'fatalError': None if is_healthy else {'message': 'Fake error', 'block': None, 'handler': None},
+            'nonFatalErrors': [],
+            'node': 'fake-node',
+            'chains': [{
+                '__typename': 'EthereumIndexingStatus',
+                'network': 'mainnet',
+                'chainHeadBlock': {'number': str(CHAIN_HEAD_BLOCK_NUMBER), 'hash': '0x01'},
+                'earliestBlock': {'number': '0', 'hash': '0x00'},
+                'latestBlock': {'number': str(latest_block_number), 'hash': '0x02'},
+                'lastHealthyBlock': None
+            }]
+        }
+
+    def resolve_field(self, field_name: str, arguments: dict):
+        subgraph_name = arguments.get('subgraphName')
+
+        if field_name == 'indexingStatusForCurrentVersion':
+            return self.build_subgraph_status(f'Qm{subgraph_name}', 'current')
+        elif field_name == 'indexingStatusForPendingVersion':
+            if self._get_ratio(subgraph_name) < self.pending_ratio:
+                return self.build_subgraph_status(f'Qm{subgraph_name}-pending', 'pending')
+            return None
+        elif field_name == 'indexingStatusesForSubgraphName':
+            return [self.resolve_field('indexingStatusForCurrentVersion', arguments)]
+        elif field_name == 'indexingStatuses':
+            deployments = arguments.get('subgraphs') or [f'Qmfake{index}' for index in range(10)]
+            return [self.build_subgraph_status(deployment, 'current') for deployment in deployments]
+        elif field_name == 'proofOfIndexing':
+            return '0x' + '00' * 32
+
+        return None
+
+    def build_response(self, request_json):
+        document = parse(request_json['query'])
+        variables = request_json.get('variables') or {}
+        fragments = {definition.name.value: definition for definition in document.definitions
+                     if definition.kind == 'fragment_definition'}
+
+        def get_fields(selection_set):
+            for selection in selection_set.selections:
+                if selection.kind == 'fragment_spread':
+                    yield from get_fields(fragments[selection.name.value].selection_set)
+                elif selection.kind == 'inline_fragment':
+                    yield from get_fields(selection.selection_set)
+                else:
+                    yield selection
+
+        def get_value(value_node):
+            if value_node.kind == 'variable':
+                return variables.get(value_node.name.value)
+            elif value_node.kind == 'list_value':
+                return [get_value(value) for value in value_node.values]
+            return value_node.value
+
+        def select(selection_set, value):
+            if value is None or selection_set is None:
+                return value
+            if isinstance(value, list):
+                return [select(selection_set, item) for item in value]
+            return {(field.alias or field.name).value: select(field.selection_set, value.get(field.name.value))
+                    for field in get_fields(selection_set)}
+
+        data = {}
+        for definition in document.definitions:
+            if definition.kind != 'operation_definition':
+                continue
+            for field in get_fields(definition.selection_set):
+                arguments = {argument.name.value: get_value(argument.value) for argument in field.arguments}
+                data[(field.alias or field.name).value] = select(field.selection_set,
+                                                                  self.resolve_field(field.name.value, arguments))
+
+        return {'data': data}
+
+
+class FakeJsonRpcServer(FakeServer):
+    """
+    JSON-RPC node that answers `eth_blockNumber` (single and batch requests)
+    """
+
+    def build_response(self, request_json):
+        def build_rpc_response(rpc_request):
+            return {'jsonrpc': '2.0', 'id': rpc_request['id'], 'result': hex(CHAIN_HEAD_BLOCK_NUMBER)}
+
+        if isinstance(request_json, list):
+            return [build_rpc_response(rpc_request) for rpc_request in request_json]
+        return build_rpc_response(request_json)
+
+
+class FakeSlackServer(FakeServer):
+    """
+    Slack incoming webhook that accepts every message
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages = 0
+
+    def build_response(self, request_json):
+        with self.lock:
+            self.messages += 1
+
+        return {'ok': True}
@@ -0,0 +1,162 @@
+"""
+Benchmark of the monitor against local fake servers (status endpoint, JSON-RPC node and Slack webhook).
+Each sweep checks N synthetic subgraphs using the same code path as `main.py` in a new process and reports
+wall time, requests issued, per-stage latency percentiles and peak RSS.
+
+Usage: python -m benchmarks.run_benchmark --subgraphs 10 100 1000 10000
+"""
+import argparse
+import functools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_servers import FakeIndexNodeServer, FakeJsonRpcServer, FakeSlackServer
+from services.history_service import get_percentile
+
+STAGES = ['status_fetch', 'chain_head_fetch', 'slack_delivery']
+
+
+def time_stage(stage_latencies: list, function):
+    """
+    Wrap a function so that the duration of each call is appended to `stage_latencies`
+    """
+
+    @functools.wraps(function)
+    def timed_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stage_latencies.append(time.perf_counter() - start)
+
+    return timed_function
+
+
+def run_sweep(number_of_subgraphs: int, slack_url: str, webhooks: int) -> dict:
+    """
+    Check synthetic subgraphs like `main.py` does. Servers urls are read from environment variables,
+    so it must be executed in a new process
+    :return: dict. Sweep results
+    """
+
+    # Imported here so that environment variables defined by the benchmark are used
+    import main
+    from services import thegraph_service
+    from services.infura_service import InfuraService
+    from services.slack_service import SlackNotifierService
+    from concurrent.futures import ThreadPoolExecutor
+
+    stages_latencies = {stage: [] for stage in STAGES}
+    thegraph_service._request_status_endpoint = time_stage(stages_latencies['status_fetch'],
+                                                           thegraph_service._request_status_endpoint)
+    InfuraService._request_latest_block_numbers = time_stage(stages_latencies['chain_head_fetch'],
+                                                             InfuraService._request_latest_block_numbers)
+    SlackNotifierService._send = time_stage(stages_latencies['slack_delivery'], SlackNotifierService._send)
+
+    subgraphs = [{
+        'name': f'benchmark/subgraph-{index}',
+        'notifications': {
+            'slack': {
+                'incoming_webhook': f'{slack_url}webhook-{index % webhooks}'
+            }
+        }
+    } for index in range(number_of_subgraphs)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=main.MAX_WORKERS) as executor:
+        main.check_subgraphs(subgraphs, executor)
+    main.flush_notifications()
+    wall_time = time.perf_counter() - start
+
+    return {
+        'wall_time': wall_time,
+        'stages': {stage: {'calls': len(latencies),
+                           'p50': get_percentile(sorted(latencies), 50),
+                           'p99': get_percentile(sorted(latencies), 99)}
+                   for stage, latencies in stages_latencies.items()},
+        # Kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def format_latency(latency) -> str:
+    return f'{latency * 1000:8.1f}' if latency is not None else f'{"-":>8}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the monitor against local fake servers')
+    parser.add_argument('--subgraphs', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='Number of synthetic subgraphs of each sweep')
+    parser.add_argument('--status-latency', type=float, default=0.02, help='Seconds of status endpoint latency')
+    parser.add_argument('--rpc-latency', type=float, default=0.02, help='Seconds of JSON-RPC node latency')
+    parser.add_argument('--slack-latency', type=float, default=0.05, help='Seconds of Slack webhook latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests that fail in every server')
+    parser.add_argument('--unhealthy-ratio', type=float, default=0.05, help='Fraction of unhealthy subgraph versions')
+    parser.add_argument('--webhooks', type=int, default=5, help='Number of different Slack incoming webhooks')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    # Internal argument used to run each sweep in a new process
+    parser.add_argument('--sweep', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--slack-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.sweep is not None:
+        print(json.dumps(run_sweep(args.sweep, args.slack_url, args.webhooks)))
+        return
+
+    index_node_server = FakeIndexNodeServer(latency=args.status_latency, error_rate=args.error_rate,
+                                            unhealthy_ratio=args.unhealthy_ratio).start()
+    json_rpc_server = FakeJsonRpcServer(latency=args.rpc_latency, error_rate=args.error_rate).start()
+    slack_server = FakeSlackServer(latency=args.slack_latency, error_rate=args.error_rate).start()
+    servers = {'status': index_node_server, 'rpc': json_rpc_server, 'slack': slack_server}
+
+    results = []
+    with tempfile.TemporaryDirectory() as temporal_dir:
+        for number_of_subgraphs in args.subgraphs:
+            for server in servers.values():
+                server.requests = server.errors = 0
+
+            # Each sweep starts without cached states, as a cold one-shot run
+            environment = {
+                **os.environ,
+                'LOGLEVEL': 'CRITICAL',
+                'THEGRAPH_STATUS_URL': index_node_server.url,
+                'INFURA_TOKEN': '',
+                'RPC_URLS': f'mainnet={json_rpc_server.url}',
+                'ALERT_STATE_DB': os.path.join(temporal_dir, f'alert_state_{number_of_subgraphs}.db'),
+                'HISTORY_DIR': os.path.join(temporal_dir, f'history_{number_of_subgraphs}')
+            }
+            sweep_process = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.run_benchmark', '--sweep', str(number_of_subgraphs),
+                 '--slack-url', slack_server.url, '--webhooks', str(args.webhooks)],
+                env=environment, capture_output=True, text=True, check=True)
+
+            result = json.loads(sweep_process.stdout.strip().splitlines()[-1])
+            result['subgraphs'] = number_of_subgraphs
+            result['requests'] = {name: server.requests for name, server in servers.items()}
+            result['errors'] = {name: server.errors for name, server in servers.items()}
+            results.append(result)
+
+    for server in servers.values():
+        server.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f'{"subgraphs":>9} {"wall (s)":>9} {"requests st/rpc/sl":>19} {"peak RSS (MB)":>13}  '
+          + '  '.join(f'{stage + " p50/p99 (ms)":>32}' for stage in STAGES))
+    for result in results:
+        requests = '/'.join(str(result['requests'][name]) for name in servers)
+        print(f'{result["subgraphs"]:>9} {result["wall_time"]:>9.2f} {requests:>19} '
+              f'{result["peak_rss_kb"] / 1024:>13.1f}  '
+              + '  '.join(f'{format_latency(result["stages"][stage]["p50"]):>15} '
+                          f'{format_latency(result["stages"][stage]["p99"]):>16}' for stage in STAGES))
+
+
+if __name__ == '__main__':
+    main()
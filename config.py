@@ -11,6 +11,12 @@ subgraphs = [
     },
     {
         'name': 'gnosis/dfusion-rinkeby',
+        # Optional. Seconds between checks in daemon mode (by default CHECK_INTERVAL)
+        'check_interval': 300,
+        # Optional. Status endpoint of the index node of the subgraph (by default THEGRAPH_STATUS_URL)
+        'index_node': 'https://graph-node.example.com/index-node/graphql',
+        # Optional. Other index nodes whose proofs of indexing are compared (by default POI_INDEX_NODES)
+        'poi_index_nodes': ['https://api.thegraph.com/index-node/graphql'],
         'notifications': {
             'slack': {
                 'incoming_webhook': 'https://hooks.slack.com/services/yyyyyy'
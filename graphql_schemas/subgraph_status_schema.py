@@ -1,3 +1,5 @@
+# Generated by `python tools/graphql_schema_generator.py` with only the types and fields selected by the monitor. Do not edit
+# Schema hash: cc5c980646a195a784cf6b17d18b218dc88e48f05d4c6345812c8d5ea538e558
 import sgqlc.types
 
 
@@ -23,8 +25,6 @@ class Health(sgqlc.types.Enum):
     __choices__ = ('healthy', 'unhealthy', 'failed')
 
 
-ID = sgqlc.types.ID
-
 String = sgqlc.types.String
 
 
@@ -35,6 +35,15 @@ String = sgqlc.types.String
 ########################################################################
 # Output Objects and Interfaces
 ########################################################################
+class ChainIndexingStatus(sgqlc.types.Interface):
+    __schema__ = subgraph_status_schema
+    __field_names__ = ('network', 'chain_head_block', 'latest_block', 'last_healthy_block')
+    network = sgqlc.types.Field(sgqlc.types.non_null(String), graphql_name='network')
+    chain_head_block = sgqlc.types.Field('Block', graphql_name='chainHeadBlock')
+    latest_block = sgqlc.types.Field('Block', graphql_name='latestBlock')
+    last_healthy_block = sgqlc.types.Field('Block', graphql_name='lastHealthyBlock')
+
+
 class Block(sgqlc.types.Type):
     __schema__ = subgraph_status_schema
     __field_names__ = ('hash', 'number')
@@ -42,29 +51,20 @@ class Block(sgqlc.types.Type):
     number = sgqlc.types.Field(sgqlc.types.non_null(BigInt), graphql_name='number')
 
 
-class ChainIndexingStatus(sgqlc.types.Interface):
+class EthereumIndexingStatus(sgqlc.types.Type, ChainIndexingStatus):
     __schema__ = subgraph_status_schema
-    __field_names__ = ('network', 'chain_head_block', 'earliest_block', 'latest_block', 'last_healthy_block')
-    network = sgqlc.types.Field(sgqlc.types.non_null(String), graphql_name='network')
-    chain_head_block = sgqlc.types.Field(Block, graphql_name='chainHeadBlock')
-    earliest_block = sgqlc.types.Field(Block, graphql_name='earliestBlock')
-    latest_block = sgqlc.types.Field(Block, graphql_name='latestBlock')
-    last_healthy_block = sgqlc.types.Field(Block, graphql_name='lastHealthyBlock')
+    __field_names__ = ()
 
 
 class Query(sgqlc.types.Type):
     __schema__ = subgraph_status_schema
-    __field_names__ = ('indexing_status_for_current_version', 'indexing_status_for_pending_version', 'indexing_statuses_for_subgraph_name', 'indexing_statuses', 'proof_of_indexing')
+    __field_names__ = ('indexing_status_for_current_version', 'indexing_status_for_pending_version', 'indexing_statuses', 'proof_of_indexing')
     indexing_status_for_current_version = sgqlc.types.Field('SubgraphIndexingStatus', graphql_name='indexingStatusForCurrentVersion', args=sgqlc.types.ArgDict((
         ('subgraph_name', sgqlc.types.Arg(sgqlc.types.non_null(String), graphql_name='subgraphName', default=None)),
 ))
     )
     indexing_status_for_pending_version = sgqlc.types.Field('SubgraphIndexingStatus', graphql_name='indexingStatusForPendingVersion', args=sgqlc.types.ArgDict((
         ('subgraph_name', sgqlc.types.Arg(sgqlc.types.non_null(String), graphql_name='subgraphName', default=None)),
-))
-    )
-    indexing_statuses_for_subgraph_name = sgqlc.types.Field(sgqlc.types.non_null(sgqlc.types.list_of(sgqlc.types.non_null('SubgraphIndexingStatus'))), graphql_name='indexingStatusesForSubgraphName', args=sgqlc.types.ArgDict((
-        ('subgraph_name', sgqlc.types.Arg(sgqlc.types.non_null(String), graphql_name='subgraphName', default=None)),
 ))
     )
     indexing_statuses = sgqlc.types.Field(sgqlc.types.non_null(sgqlc.types.list_of(sgqlc.types.non_null('SubgraphIndexingStatus'))), graphql_name='indexingStatuses', args=sgqlc.types.ArgDict((
@@ -81,27 +81,18 @@ class Query(sgqlc.types.Type):
 
 class SubgraphError(sgqlc.types.Type):
     __schema__ = subgraph_status_schema
-    __field_names__ = ('message', 'block', 'handler')
+    __field_names__ = ('message',)
     message = sgqlc.types.Field(sgqlc.types.non_null(String), graphql_name='message')
-    block = sgqlc.types.Field(Block, graphql_name='block')
-    handler = sgqlc.types.Field(String, graphql_name='handler')
 
 
 class SubgraphIndexingStatus(sgqlc.types.Type):
     __schema__ = subgraph_status_schema
-    __field_names__ = ('subgraph', 'synced', 'health', 'fatal_error', 'non_fatal_errors', 'chains', 'node')
+    __field_names__ = ('subgraph', 'synced', 'health', 'fatal_error', 'chains')
     subgraph = sgqlc.types.Field(sgqlc.types.non_null(String), graphql_name='subgraph')
     synced = sgqlc.types.Field(sgqlc.types.non_null(Boolean), graphql_name='synced')
     health = sgqlc.types.Field(sgqlc.types.non_null(Health), graphql_name='health')
     fatal_error = sgqlc.types.Field(SubgraphError, graphql_name='fatalError')
-    non_fatal_errors = sgqlc.types.Field(sgqlc.types.non_null(sgqlc.types.list_of(sgqlc.types.non_null(SubgraphError))), graphql_name='nonFatalErrors')
     chains = sgqlc.types.Field(sgqlc.types.non_null(sgqlc.types.list_of(sgqlc.types.non_null(ChainIndexingStatus))), graphql_name='chains')
-    node = sgqlc.types.Field(sgqlc.types.non_null(String), graphql_name='node')
-
-
-class EthereumIndexingStatus(sgqlc.types.Type, ChainIndexingStatus):
-    __schema__ = subgraph_status_schema
-    __field_names__ = ()
 
 
 
@@ -115,4 +106,3 @@ class EthereumIndexingStatus(sgqlc.types.Type, ChainIndexingStatus):
 subgraph_status_schema.query_type = Query
 subgraph_status_schema.mutation_type = None
 subgraph_status_schema.subscription_type = None
-
@@ -1,76 +1,771 @@
 #!/usr/bin/env python
+import argparse
 import config
+import datetime
+import functools
+import json
 import logging
 import os
+import signal
+import time
 import traceback
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError, as_completed
 
-from services.thegraph_service import ThegraphService, StatusEndpointUnavailableException
+from services.alert_state_service import AlertStateProvider, RECOVERY_NOTIFICATION
+from services.cassette_service import open_cassette
+from services.config_service import SubgraphsConfigService
+from services.history_service import StatusHistoryProvider, VERSIONS, build_slo_report, get_history_subgraph_names
+from services.http_service import HttpProvider
+from services.thegraph_service import ThegraphService, StatusEndpointUnavailableException, \
+    fetch_subgraphs_statuses_batch, fetch_deployments_statuses_batch, split_in_batches, is_index_node_available, \
+    THEGRAPH_STATUS_URL
 from services.infura_service import InfuraProvider
+from services.metrics_service import MetricsProvider, METRICS_PORT, PUSHGATEWAY_URL
+from services.poi_service import ProofOfIndexingProvider, POI_INDEX_NODES
+from services.profiling_service import ProfiledThreadPoolExecutor
+from services.retry_service import DeadlineExceededException, get_remaining_time
+from services.scheduler_service import SubgraphCheckScheduler
+from services.sharding_service import ShardService
+from services.velocity_service import SyncVelocityProvider, VELOCITY_MIN_WINDOW
+from services.slack_service import SlackNotifierProvider
+from services.status_api_service import StatusApiProvider, STATUS_API_PORT
+from services.sync_evaluation_service import evaluate_subgraphs_sync, get_blocks_to_consider_out_of_sync
+from services.tracing_service import TracingProvider
 
-import requests
 from templates import slack_templates
 
 # Read log level as environment variable (by default INFO)
 LOGLEVEL = os.environ.get('LOGLEVEL', 'INFO').upper()
 assert (LOGLEVEL in ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']), 'LOGLEVEL is not valid'
 
+# Max number of threads used to fetch, evaluate and notify subgraph statuses (by default 16)
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 16))
+
+# Max seconds to wait for queued Slack notifications before exiting (by default 30)
+SLACK_FLUSH_TIMEOUT = float(os.environ.get('SLACK_FLUSH_TIMEOUT', 30))
+
+# Max seconds of a check of all subgraphs. Subgraphs not checked before it are checked in the next one
+# (by default 300, 0 disables it)
+SWEEP_TIMEOUT = float(os.environ.get('SWEEP_TIMEOUT', 300))
+
 # Configure logs format
 logging.basicConfig(
     format='%(asctime)s [%(levelname)s] %(message)s',
     level=LOGLEVEL)
 
 
-if __name__ == '__main__':
+# Checks whose state is notified apart from the status of a version. {check: reason shown when it recovers}
+NOTIFIED_CHECKS = {'velocity': 'sync velocity', 'poi': 'proof of indexing'}
 
-    # Check status of each defined subgraph
-    for subgraph in config.subgraphs:
 
-        try:
-            # Subgraph information
-            subgraph_name = subgraph['name']
-            slack_incoming_webhook = subgraph['notifications']['slack']['incoming_webhook']
-
-            thegraph_service = ThegraphService(subgraph_name=subgraph_name)
-            infura_service = InfuraProvider()
-
-            if not thegraph_service.is_current_subgraph_version_ok():
-                subgraph_last_block_number = thegraph_service.get_current_subgraph_last_block_number()
-                subgraph_network = thegraph_service.get_current_subgraph_network()
-                infura_last_block_number = infura_service.get_latest_block_number_of_network(subgraph_network)
-
-                slack_message = slack_templates.get_slack_current_subgraph_notification_message(
-                    subgraph_name=subgraph_name,
-                    subgraph_version='current',
-                    subgraph_network=subgraph_network,
-                    subgraph_last_block_number=subgraph_last_block_number,
-                    infura_last_block_number=infura_last_block_number
-                    )
-                # Send notification to Slack
-                # Using the json parameter in the request will change the Content-Type to application/json.
-                requests.post(url=slack_incoming_webhook,
-                              json=slack_message,
-                              timeout=2)
+def build_notification(subgraph_name: str, version: str, is_ok: bool, build_slack_message, check: str = None) -> list:
+    """
+    Build the notification of a subgraph version if its state has to be notified
+    :param subgraph_name: str
+    :param version: str. `current` or `pending`
+    :param is_ok: bool. Evaluated state
+    :param build_slack_message: function that builds the NOT OK Slack message
+    :param check: str. Key of `NOTIFIED_CHECKS` whose state is evaluated, or None if it is the status of the version.
+    Each check has its own alert state (`{version}_{check}`)
+    :return: list. Empty or with one notification
+    """
+
+    alert_version = version if check is None else f'{version}_{check}'
+    notification_type = AlertStateProvider().get_notification_type(subgraph_name, alert_version, is_ok)
+
+    if notification_type is None:
+        return []
+    elif notification_type == RECOVERY_NOTIFICATION:
+        slack_message = slack_templates.get_slack_subgraph_recovered_notification_message(
+            subgraph_name=subgraph_name,
+            subgraph_version=version,
+            reason=NOTIFIED_CHECKS.get(check))
+    else:
+        slack_message = build_slack_message()
+
+    return [{
+        'subgraph_name': subgraph_name,
+        'version': alert_version,
+        'is_ok': is_ok,
+        'slack_message': slack_message
+    }]
+
+
+def update_subgraph_metrics(thegraph_service: ThegraphService):
+    """
+    Update health, synced and block lag metrics of a checked subgraph
+    :param thegraph_service: ThegraphService. Its versions have already been checked
+    """
+
+    metrics = MetricsProvider()
+    subgraph_name = thegraph_service.subgraph_name
+
+    metrics.set_gauge('subgraph_healthy', int(thegraph_service.is_subgraph_healthy(thegraph_service.current_subgraph_status)),
+                      subgraph=subgraph_name, version='current')
+    if thegraph_service.pending_subgraph_status:
+        metrics.set_gauge('subgraph_healthy',
+                          int(thegraph_service.is_subgraph_healthy(thegraph_service.pending_subgraph_status)),
+                          subgraph=subgraph_name, version='pending')
+
+    if thegraph_service.is_current_synced is not None:
+        metrics.set_gauge('subgraph_synced', int(thegraph_service.is_current_synced), subgraph=subgraph_name)
+
+    for chain in thegraph_service.get_current_subgraph_chains():
+        if chain.block_lag is not None:
+            metrics.set_gauge('subgraph_block_lag', chain.block_lag, subgraph=subgraph_name, network=chain.network)
+
+
+def record_subgraph_history(subgraph_name: str, thegraph_service: ThegraphService):
+    """
+    Store health, synced status and block lag of the checked versions of a subgraph in its status history
+    :param subgraph_name: str
+    :param thegraph_service: ThegraphService. Its versions have already been checked
+    """
+
+    history = StatusHistoryProvider()
+    timestamp = time.time()
+
+    # Block lags are the ones of the chain that is most behind
+    if thegraph_service.current_subgraph_status:
+        current_block_lag = None
+        if thegraph_service.is_current_synced is not None:
+            current_block_lag = thegraph_service.get_current_subgraph_block_lag()
+
+        history.record(subgraph_name, 'current', timestamp,
+                       thegraph_service.is_subgraph_healthy(thegraph_service.current_subgraph_status),
+                       thegraph_service.is_current_synced, current_block_lag)
+
+    pending_subgraph_status = thegraph_service.pending_subgraph_status
+    if pending_subgraph_status:
+        # PENDING versions are never synced
+        history.record(subgraph_name, 'pending', timestamp,
+                       thegraph_service.is_subgraph_healthy(pending_subgraph_status), None,
+                       thegraph_service.get_pending_subgraph_block_lag())
+
+
+def get_subgraph_version_status(subgraph_status, is_ok: bool, chains: list):
+    """
+    :param subgraph_status: SubgraphStatus or None if the version does not exist
+    :param is_ok: bool. Evaluated state
+    :param chains: list. ChainSyncStatus of each chain of the version
+    :return: dict. JSON serializable status of a subgraph version or None
+    """
+
+    if not subgraph_status:
+        return None
+
+    block_lags = [chain.block_lag for chain in chains if chain.block_lag is not None]
+
+    return {
+        'deployment': subgraph_status.deployment,
+        'ok': is_ok,
+        'health': subgraph_status.health,
+        'synced': subgraph_status.synced,
+        'fatal_error': subgraph_status.fatal_error,
+        'chains': [{
+            'network': chain.network,
+            'latest_block': chain.latest_block_number,
+            'chain_head_block': chain.chain_head_block_number,
+            'block_lag': None if chain.block_lag is None else max(0, chain.block_lag),
+            'synced': chain.is_synced,
+        } for chain in chains],
+        # Lag of the chain that is most behind
+        'block_lag': max(0, max(block_lags)) if block_lags else None,
+    }
+
+
+def update_subgraph_status_api(subgraph: dict, thegraph_service: ThegraphService, is_current_ok: bool,
+                               is_pending_ok: bool):
+    """
+    Store the evaluated status of a subgraph to serve it in the status API (see `STATUS_API_PORT`)
+    :param subgraph: dict. Subgraph defined in `config.subgraphs`
+    :param thegraph_service: ThegraphService. Its versions have already been checked
+    :param is_current_ok: bool
+    :param is_pending_ok: bool
+    """
+
+    StatusApiProvider().update(subgraph['name'], {
+        'subgraph': subgraph['name'],
+        'index_node': thegraph_service.thegraph_status_url,
+        'checked_at': time.time(),
+        'current': get_subgraph_version_status(thegraph_service.current_subgraph_status, is_current_ok,
+                                               thegraph_service.get_current_subgraph_chains()),
+        'pending': get_subgraph_version_status(thegraph_service.pending_subgraph_status, is_pending_ok,
+                                               thegraph_service.get_pending_subgraph_chains()),
+    })
+
+
+def evaluate_subgraph_sync_velocity(subgraph_name: str, thegraph_service: ThegraphService) -> list:
+    """
+    Track indexing velocity of each chain of CURRENT and PENDING versions against chain growth. A version is NOT OK
+    when one of its chains is stalled, when the predicted lag of a chain of CURRENT version that is still below the out
+    of sync threshold of its network reaches it or when PENDING version is not catching up with a chain head
+    :param subgraph_name: str
+    :param thegraph_service: ThegraphService. Its versions have already been checked
+    :return: list. Notifications to send
+    """
+
+    metrics = MetricsProvider()
+    timestamp = time.time()
+    notifications = []
+
+    for version, subgraph_status, chains in [
+            ('current', thegraph_service.current_subgraph_status, thegraph_service.get_current_subgraph_chains()),
+            ('pending', thegraph_service.pending_subgraph_status, thegraph_service.get_pending_subgraph_chains())]:
+        trackers = SyncVelocityProvider().add_samples(subgraph_name, version, subgraph_status, timestamp, chains)
+        if not trackers:
+            continue
+
+        # Chains without enough samples yet are not evaluated. The version is OK when all evaluated chains are OK
+        chain_evaluations = []
+        for network, tracker in trackers.items():
+            lag = tracker.get_lag()
+            indexing_velocity, chain_velocity = tracker.get_velocities()
+            catch_up_eta = tracker.get_catch_up_eta()
+
+            if indexing_velocity is not None:
+                metrics.set_gauge('subgraph_indexing_velocity', indexing_velocity, subgraph=subgraph_name,
+                                  version=version, network=network)
+            if catch_up_eta is not None:
+                metrics.set_gauge('subgraph_catch_up_eta_seconds', catch_up_eta, subgraph=subgraph_name,
+                                  version=version, network=network)
+
+            if tracker.is_stalled():
+                reason = 'stalled'
+            elif indexing_velocity is None or chain_velocity is None or lag is None:
+                continue
+            # Chains that are already out of sync are notified by the sync check, not predicted
+            elif version == 'current' and lag >= get_blocks_to_consider_out_of_sync(network):
+                continue
+            elif version == 'current' and tracker.get_predicted_lag() >= get_blocks_to_consider_out_of_sync(network):
+                reason = 'falling behind'
+            elif version == 'pending' and lag > 0 and catch_up_eta is None:
+                reason = 'not catching up'
             else:
-                logging.debug(f'Subgraph {subgraph_name} CURRENT version is OK')
+                reason = None
+
+            chain_evaluations.append((reason, network, lag, indexing_velocity, chain_velocity, catch_up_eta))
+
+        if not chain_evaluations:
+            continue
+
+        # The first chain that is NOT OK is notified
+        reason, network, lag, indexing_velocity, chain_velocity, catch_up_eta = next(
+            (chain_evaluation for chain_evaluation in chain_evaluations if chain_evaluation[0] is not None),
+            chain_evaluations[0])
+
+        def build_velocity_slack_message(version=version, network=network, reason=reason, lag=lag,
+                                         indexing_velocity=indexing_velocity, chain_velocity=chain_velocity,
+                                         catch_up_eta=catch_up_eta):
+            return slack_templates.get_slack_subgraph_sync_velocity_notification_message(
+                subgraph_name=subgraph_name,
+                subgraph_version=version,
+                subgraph_network=network,
+                reason=reason,
+                lag=lag,
+                indexing_velocity=indexing_velocity,
+                chain_velocity=chain_velocity,
+                catch_up_eta=catch_up_eta)
+
+        notifications += build_notification(subgraph_name, version, reason is None, build_velocity_slack_message,
+                                            check='velocity')
+
+    return notifications
+
+
+def is_subgraph_degraded(subgraph_name: str, is_current_ok: bool, is_pending_ok: bool) -> bool:
+    """
+    Check if a subgraph must be checked more often: a version is NOT OK, the lag of a chain of CURRENT version is
+    growing or its PENDING version has just been deployed (there are not enough samples to compute its velocity)
+    :return: bool
+    """
 
-            if not thegraph_service.is_pending_subgraph_version_ok():
-                slack_message = slack_templates.get_slack_pending_subgraph_notification_message(
-                    subgraph_name=subgraph_name)
+    if not is_current_ok or not is_pending_ok:
+        return True
 
-                # Send notification to Slack
-                # Using the json parameter in the request will change the Content-Type  to application/json.
-                requests.post(url=slack_incoming_webhook,
-                              json=slack_message,
-                              timeout=2)
+    for current_tracker in SyncVelocityProvider().get_trackers(subgraph_name, 'current').values():
+        lag = current_tracker.get_lag()
+        predicted_lag = current_tracker.get_predicted_lag()
+        if lag is not None and predicted_lag is not None and predicted_lag > lag:
+            return True
+
+    return any(pending_tracker.get_window() < VELOCITY_MIN_WINDOW
+               for pending_tracker in SyncVelocityProvider().get_trackers(subgraph_name, 'pending').values())
+
+
+def evaluate_subgraph(subgraph: dict, subgraph_statuses: dict, on_evaluated=None) -> list:
+    """
+    Check CURRENT and PENDING versions of a subgraph
+    Only changes of state (and reminders) are notified
+    :param subgraph: dict. Subgraph defined in `config.subgraphs`
+    :param subgraph_statuses: dict. Statuses fetched with `fetch_subgraphs_statuses_batch`
+    :param on_evaluated: function called with the subgraph name and whether it is degraded (see `is_subgraph_degraded`)
+    :return: list. Notifications to send
+    """
+
+    subgraph_name = subgraph['name']
+
+    thegraph_service = ThegraphService(subgraph_name=subgraph_name,
+                                       thegraph_status_url=subgraph.get('index_node', THEGRAPH_STATUS_URL),
+                                       subgraph_statuses=subgraph_statuses)
+
+    def build_current_slack_message():
+        # Chain that is most behind
+        chain = thegraph_service.get_current_subgraph_lagging_chain()
+        if chain is None:
+            # The version has no chains (e.g. it failed before indexing any block)
+            return slack_templates.get_slack_current_subgraph_notification_message(
+                subgraph_name=subgraph_name,
+                subgraph_version='current',
+                subgraph_network='unknown',
+                subgraph_last_block_number='unknown',
+                infura_last_block_number='unknown'
+                )
+
+        # Chain head used to check the subgraph. When Infura was unavailable, it is requested again unless its
+        # circuit breaker is open (then the chain head known by the index node is shown)
+        infura_last_block_number = chain.chain_head_block_number
+        if infura_last_block_number is None:
+            if InfuraProvider().is_network_available(chain.network):
+                infura_last_block_number = InfuraProvider().get_latest_block_number_of_network(chain.network)
             else:
-                logging.debug(f'Subgraph {subgraph_name} PENDING version is OK')
+                status_chains = thegraph_service.current_subgraph_status.chains
+                infura_last_block_number = next((status_chain.chain_head_block_number for status_chain in status_chains
+                                                 if status_chain.network.lower() == chain.network), None)
+
+        return slack_templates.get_slack_current_subgraph_notification_message(
+            subgraph_name=subgraph_name,
+            subgraph_version='current',
+            subgraph_network=chain.network,
+            subgraph_last_block_number=chain.latest_block_number,
+            infura_last_block_number=infura_last_block_number
+            )
+
+    def build_pending_slack_message():
+        return slack_templates.get_slack_pending_subgraph_notification_message(
+            subgraph_name=subgraph_name)
+
+    with TracingProvider().span('evaluate', subgraph=subgraph_name):
+        is_current_ok = thegraph_service.is_current_subgraph_version_ok()
+        logging.debug(f'Subgraph {subgraph_name} CURRENT version is {"OK" if is_current_ok else "NOT OK"}')
+
+        is_pending_ok = thegraph_service.is_pending_subgraph_version_ok()
+        logging.debug(f'Subgraph {subgraph_name} PENDING version is {"OK" if is_pending_ok else "NOT OK"}')
+
+    update_subgraph_metrics(thegraph_service)
+    record_subgraph_history(subgraph_name, thegraph_service)
+    update_subgraph_status_api(subgraph, thegraph_service, is_current_ok, is_pending_ok)
+
+    notifications = build_notification(subgraph_name, 'current', is_current_ok, build_current_slack_message) + \
+        build_notification(subgraph_name, 'pending', is_pending_ok, build_pending_slack_message) + \
+        evaluate_subgraph_sync_velocity(subgraph_name, thegraph_service)
+
+    if on_evaluated:
+        on_evaluated(subgraph_name, is_subgraph_degraded(subgraph_name, is_current_ok, is_pending_ok))
+
+    return notifications
+
+
+def fetch_subgraphs(subgraph_names: list, index_node: str, deployments: bool = False, deadline: float = None) -> dict:
+    """
+    Fetch statuses of a batch of subgraphs and latest block numbers of the networks they use
+    :param subgraph_names: list
+    :param index_node: str. Status endpoint of the index node of the subgraphs
+    :param deployments: bool. Subgraphs are deployment IDs (discovered subgraphs)
+    :param deadline: float. `time.monotonic()` time after which requests are not retried
+    :return: dict. Statuses fetched with `fetch_subgraphs_statuses_batch` and the `sync_evaluation` of the batch
+    """
+
+    with TracingProvider().span('fetch_batch', index_node=index_node, subgraphs=len(subgraph_names)):
+        if deployments:
+            subgraphs_statuses = fetch_deployments_statuses_batch(subgraph_names, index_node, deadline=deadline)
+        else:
+            subgraphs_statuses = fetch_subgraphs_statuses_batch(subgraph_names, index_node, deadline=deadline)
+
+        # All chains of the batch are evaluated together, and latest block numbers are requested to Infura only once
+        # for each network of the batch
+        try:
+            sync_evaluation = evaluate_subgraphs_sync(subgraphs_statuses, deadline=deadline)
+            for subgraph_statuses in subgraphs_statuses.values():
+                subgraph_statuses['sync_evaluation'] = sync_evaluation
+        except Exception as exception:
+            # Each subgraph check will handle it
+            logging.error(f'Sync status of the batch could not be evaluated. Exception: {exception}')
+
+        return subgraphs_statuses
+
+
+def queue_notifications(subgraph: dict, notifications: list):
+    """
+    Queue notifications of a subgraph. Notified state is stored once Slack accepts each notification, and
+    notifications that are still pending are not queued again
+    :param subgraph: dict. Subgraph defined in `config.subgraphs`
+    :param notifications: list. Notifications built with `build_notification`
+    """
+
+    slack_incoming_webhook = subgraph['notifications']['slack']['incoming_webhook']
 
-        except StatusEndpointUnavailableException as unavailable_endpoint:
-            logging.error('Thegraph subgraph status endpoint is unavailable. '
-                          'No more subgraphs will be checked until status endpoint is available again')
+    for notification in notifications:
+        SlackNotifierProvider().notify(
+            slack_incoming_webhook,
+            notification['slack_message'],
+            on_delivered=functools.partial(AlertStateProvider().mark_notified, notification['subgraph_name'],
+                                           notification['version'], notification['is_ok']),
+            key=(notification['subgraph_name'], notification['version'], notification['is_ok']))
 
-            raise unavailable_endpoint
+
+def check_subgraph(subgraph: dict, subgraph_statuses: dict, on_evaluated=None):
+    """
+    Evaluate a subgraph and queue its notifications. Checks never wait for notifications to be sent
+    Exceptions are logged here so that a subgraph failure does not affect the other subgraphs
+    """
+
+    subgraph_name = subgraph['name']
+
+    try:
+        with TracingProvider().span('check', subgraph=subgraph_name):
+            queue_notifications(subgraph, evaluate_subgraph(subgraph, subgraph_statuses, on_evaluated))
+    except Exception as exception:
+        logging.error(f'Exception when checking subgraph {subgraph_name}. Exception: {exception}')
+        # Show exception stack trace
+        traceback.print_exc()
+
+
+def check_subgraphs_proofs_of_indexing(subgraphs: list, index_node: str, subgraphs_statuses: dict,
+                                       deadline: float = None):
+    """
+    Compare proofs of indexing of the CURRENT versions of a batch of subgraphs with the ones of other index nodes
+    (`poi_index_nodes` of each subgraph or `POI_INDEX_NODES`) and queue notifications when they disagree
+    :param subgraphs: list. Subgraphs of the batch
+    :param index_node: str. Index node whose statuses have been fetched
+    :param subgraphs_statuses: dict. Statuses fetched with `fetch_subgraphs`
+    :param deadline: float. `time.monotonic()` time after which requests are not retried
+    """
+
+    # Subgraphs compared with the same index nodes are checked together. {other index nodes: {deployment: [subgraph]}}
+    subgraphs_by_other_index_nodes = {}
+    for subgraph in subgraphs:
+        other_index_nodes = tuple(other_index_node for other_index_node in subgraph.get('poi_index_nodes',
+                                                                                         POI_INDEX_NODES)
+                                  if other_index_node != index_node)
+        current_subgraph_status = subgraphs_statuses[subgraph['name']]['current']
+
+        if other_index_nodes and current_subgraph_status:
+            subgraphs_by_other_index_nodes.setdefault(other_index_nodes, {}).setdefault(
+                current_subgraph_status.deployment, []).append(subgraph)
+
+    for other_index_nodes, subgraphs_by_deployment in subgraphs_by_other_index_nodes.items():
+        deployments_statuses = {deployment: subgraphs_statuses[deployment_subgraphs[0]['name']]['current']
+                                for deployment, deployment_subgraphs in subgraphs_by_deployment.items()}
+
+        try:
+            with TracingProvider().span('poi_check', index_node=index_node, deployments=len(deployments_statuses)):
+                proofs_of_indexing_checks = ProofOfIndexingProvider().check_proofs_of_indexing(
+                    index_node, deployments_statuses, list(other_index_nodes), deadline)
         except Exception as exception:
-            logging.error(f'Exception when checking subgraph {subgraph_name}. Exception: {exception}')
-            # Show exception stack trace
+            logging.error(f'Exception when checking proofs of indexing. Exception: {exception}')
             traceback.print_exc()
+            continue
+
+        for deployment, proofs_of_indexing_check in proofs_of_indexing_checks.items():
+            is_consistent = proofs_of_indexing_check.is_consistent()
+            # Less than two index nodes could compute it
+            if is_consistent is None:
+                continue
+
+            for subgraph in subgraphs_by_deployment[deployment]:
+                subgraph_name = subgraph['name']
+                MetricsProvider().set_gauge('subgraph_poi_consistent', int(is_consistent), subgraph=subgraph_name)
+
+                def build_poi_slack_message():
+                    return slack_templates.get_slack_poi_mismatch_notification_message(
+                        subgraph_name=subgraph_name,
+                        deployment=deployment,
+                        block_number=proofs_of_indexing_check.block_number,
+                        proofs_of_indexing=proofs_of_indexing_check.proofs_of_indexing)
+
+                try:
+                    queue_notifications(subgraph, build_notification(subgraph_name, 'current', is_consistent,
+                                                                     build_poi_slack_message, check='poi'))
+                except Exception as exception:
+                    logging.error(f'Exception when checking proofs of indexing of subgraph {subgraph_name}. '
+                                  f'Exception: {exception}')
+                    traceback.print_exc()
+
+
+def check_subgraphs(subgraphs: list, executor: ThreadPoolExecutor, on_evaluated=None):
+    """
+    Check all subgraphs using a pipeline of concurrent stages:
+    1. Fetch statuses in batches. 2. Evaluate each subgraph as soon as its batch is fetched.
+    3. Notifications are queued and sent in background by `SlackNotifierService`.
+    Requests to each remote host are limited by `HostConcurrencyLimiter`.
+    If the status endpoint of an index node is unavailable (or its circuit breaker is open), only its subgraphs
+    are not checked. Subgraphs that are not checked before `SWEEP_TIMEOUT` are skipped
+    :param subgraphs: list. Subgraphs defined in `config.subgraphs`
+    :param executor: ThreadPoolExecutor. Threads used to fetch and evaluate
+    :param on_evaluated: function called with the name of each evaluated subgraph and whether it is degraded
+    """
+
+    tracing = TracingProvider()
+
+    # Root span of the sweep. Spans of its tasks are its children
+    with tracing.span('sweep', subgraphs=len(subgraphs)):
+        deadline = time.monotonic() + SWEEP_TIMEOUT if SWEEP_TIMEOUT else None
+        subgraphs_by_name = {subgraph['name']: subgraph for subgraph in subgraphs}
+
+        # Subgraphs are requested in batches to their index node.
+        # Subgraph names and deployment IDs are requested with different queries
+        subgraph_names_by_index_node = {}
+        for subgraph_name, subgraph in subgraphs_by_name.items():
+            index_node_key = (subgraph.get('index_node', THEGRAPH_STATUS_URL), subgraph.get('deployment', False))
+            subgraph_names_by_index_node.setdefault(index_node_key, []).append(subgraph_name)
+
+        # 1. Fetch stage. {fetch future: index node}
+        fetch_futures = {}
+        unavailable_index_nodes = set()
+        for (index_node, deployments), index_node_subgraph_names in subgraph_names_by_index_node.items():
+            # Index nodes whose circuit breaker is open are not requested, their subgraphs are not evaluated
+            if not is_index_node_available(index_node):
+                unavailable_index_nodes.add(index_node)
+                continue
+
+            for batch_subgraph_names in split_in_batches(index_node_subgraph_names):
+                fetch_future = executor.submit(tracing.propagate(fetch_subgraphs), batch_subgraph_names, index_node,
+                                               deployments, deadline)
+                fetch_futures[fetch_future] = index_node
+
+        check_futures = []
+        try:
+            for fetch_future in as_completed(fetch_futures, timeout=get_remaining_time(deadline)):
+                index_node = fetch_futures[fetch_future]
+
+                try:
+                    subgraphs_statuses = fetch_future.result()
+                except StatusEndpointUnavailableException:
+                    # Other batches of the same index node are not requested
+                    unavailable_index_nodes.add(index_node)
+                    for pending_fetch_future, pending_index_node in fetch_futures.items():
+                        if pending_index_node == index_node:
+                            pending_fetch_future.cancel()
+
+                    continue
+                except (CancelledError, DeadlineExceededException):
+                    continue
+
+                # 2. Evaluation stage
+                for subgraph_name, subgraph_statuses in subgraphs_statuses.items():
+                    check_futures.append(executor.submit(tracing.propagate(check_subgraph),
+                                                         subgraphs_by_name[subgraph_name], subgraph_statuses,
+                                                         on_evaluated))
+
+                # Proofs of indexing of the batch are compared at the same time
+                batch_subgraphs = [subgraphs_by_name[subgraph_name] for subgraph_name in subgraphs_statuses]
+                check_futures.append(executor.submit(tracing.propagate(check_subgraphs_proofs_of_indexing),
+                                                     batch_subgraphs, index_node, subgraphs_statuses, deadline))
+
+            for check_future in as_completed(check_futures, timeout=get_remaining_time(deadline)):
+                check_future.result()
+        except TimeoutError:
+            logging.error(f'Subgraphs could not be checked in {SWEEP_TIMEOUT} seconds. '
+                          'Remaining subgraphs are not checked this time')
+
+            for pending_future in list(fetch_futures) + check_futures:
+                pending_future.cancel()
+
+        for index_node in sorted(unavailable_index_nodes):
+            logging.error(f'Thegraph subgraph status endpoint {index_node} is unavailable. '
+                          'Subgraphs of this index node are not checked until it is available again')
+
+        # Notified states are written to disk once per check
+        AlertStateProvider().commit()
+
+        # Subgraphs of the other index nodes have been checked
+        if unavailable_index_nodes:
+            raise StatusEndpointUnavailableException(', '.join(sorted(unavailable_index_nodes)))
+
+
+def flush_notifications():
+    """
+    Wait for queued notifications to be sent and store their notified states
+    """
+
+    if not SlackNotifierProvider().flush(SLACK_FLUSH_TIMEOUT):
+        logging.error(f'Some Slack notifications could not be sent in {SLACK_FLUSH_TIMEOUT} seconds')
+
+    AlertStateProvider().commit()
+
+
+def run_daemon(subgraphs_config_service: SubgraphsConfigService, shard_service: ShardService,
+               executor: ThreadPoolExecutor):
+    """
+    Check subgraphs periodically until SIGTERM or SIGINT is received.
+    The same threads, HTTP connections, Infura service (its latest block numbers expire with `CHAIN_HEAD_CACHE_TTL`)
+    and built queries are reused between checks. Monitored subgraphs are updated when the config file changes
+    :param subgraphs_config_service: SubgraphsConfigService. Subgraphs to monitor
+    :param shard_service: ShardService. Only subgraphs of the shard of this replica are checked
+    :param executor: ThreadPoolExecutor. Threads used to check subgraphs
+    """
+
+    def get_shard_subgraphs() -> list:
+        # The lease is also renewed when subgraphs are refreshed, so that it does not expire between checks
+        shard_service.acquire_lease()
+        shard_subgraphs = shard_service.get_shard_subgraphs(subgraphs_config_service.get_subgraphs())
+        # Subgraphs that are not monitored anymore are not served nor exported
+        StatusApiProvider().retain(subgraph['name'] for subgraph in shard_subgraphs)
+        MetricsProvider().retain(subgraph['name'] for subgraph in shard_subgraphs)
+        return shard_subgraphs
+
+    subgraphs = get_shard_subgraphs()
+    scheduler = SubgraphCheckScheduler(subgraphs)
+
+    def check_due_subgraphs(due_subgraphs: list):
+        # Another replica holds the lease of this shard
+        if not shard_service.acquire_lease():
+            logging.debug(f'Lease of shard {shard_service.shard_index} is not held. {len(due_subgraphs)} subgraphs '
+                          'are not checked')
+            return
+
+        # Intervals are adapted to the evaluations (see `ADAPTIVE_POLLING`). The lease is renewed while subgraphs
+        # are checked, as a sweep can last longer than it (up to `SWEEP_TIMEOUT`)
+        with shard_service.renewing_lease():
+            check_subgraphs(due_subgraphs, executor, scheduler.report_evaluation)
+
+    def stop_daemon(signal_number, frame):
+        logging.info(f'Signal {signal_number} received. Stopping daemon after the current check')
+        scheduler.stop()
+
+    # tini (Docker entrypoint) forwards SIGTERM to this process
+    signal.signal(signal.SIGTERM, stop_daemon)
+    signal.signal(signal.SIGINT, stop_daemon)
+
+    if METRICS_PORT:
+        MetricsProvider().start_server(METRICS_PORT)
+    if STATUS_API_PORT:
+        StatusApiProvider().start_server(STATUS_API_PORT)
+
+    logging.info(f'Daemon started. Monitoring {len(subgraphs)} subgraphs '
+                 f'(shard {shard_service.shard_index} of {shard_service.shard_count})')
+    scheduler.run(check_due_subgraphs, get_shard_subgraphs)
+    flush_notifications()
+    shard_service.release_lease()
+    logging.info('Daemon stopped')
+
+
+def print_slo_reports(subgraph_names: list, version: str, since: datetime.datetime, until: datetime.datetime,
+                      as_json: bool = False):
+    """
+    Print uptime, block lag percentiles and incidents of subgraphs from their status history
+    :param subgraph_names: list. By default all subgraphs with history
+    :param version: str. `current` or `pending`
+    :param since: datetime
+    :param until: datetime
+    :param as_json: bool. Print one JSON report per line
+    """
+
+    for subgraph_name in subgraph_names or get_history_subgraph_names():
+        report = build_slo_report(subgraph_name, version, since.timestamp(), until.timestamp())
+
+        if as_json:
+            print(json.dumps(report))
+            continue
+
+        print(f'{subgraph_name} ({version}) from {since.isoformat()} to {until.isoformat()}')
+        if not report['checks']:
+            print('  No checks')
+            continue
+
+        print(f'  Checks: {report["checks"]}. Uptime: {report["uptime"]:.3f}%')
+        print(f'  Block lag p50: {report["block_lag_p50"]}, p95: {report["block_lag_p95"]}, '
+              f'p99: {report["block_lag_p99"]}, max: {report["block_lag_max"]}')
+        print(f'  Incidents: {len(report["incidents"])}')
+        for incident in report['incidents']:
+            end = datetime.datetime.fromtimestamp(incident['end']).isoformat() if incident['end'] else 'ongoing'
+            print(f'    {datetime.datetime.fromtimestamp(incident["start"]).isoformat()} - {end} '
+                  f'({datetime.timedelta(seconds=round(incident["duration"]))})')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Check statuses of subgraphs running on Thegraph')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and check each subgraph periodically (see `check_interval`)')
+    parser.add_argument('--profile', nargs='?', const='profile.txt', metavar='REPORT_FILE',
+                        help='Profile the checks with cProfile and write the functions that take most time '
+                             '(by default to `profile.txt`). In daemon mode it is written when the daemon stops')
+    parser.add_argument('--record', nargs='?', const='cassette.jsonl.gz', metavar='CASSETTE_FILE',
+                        help='Record all requests to index nodes, RPC urls and Slack and their responses with their '
+                             'timing (by default to `cassette.jsonl.gz`)')
+    parser.add_argument('--replay', nargs='?', const='cassette.jsonl.gz', metavar='CASSETTE_FILE',
+                        help='Answer requests with the responses recorded with `--record` instead of sending them '
+                             '(by default from `cassette.jsonl.gz`)')
+    parser.add_argument('--replay-speed', type=float, default=0, metavar='SPEED',
+                        help='Speed of replayed responses: 1 waits their recorded latency, 10 is 10 times faster '
+                             '(by default 0, responses are replayed without waiting)')
+    subparsers = parser.add_subparsers(dest='command')
+    report_parser = subparsers.add_parser('report', help='Show uptime, block lag percentiles and incidents of '
+                                                         'subgraphs from their status history (see `HISTORY_DIR`)')
+    report_parser.add_argument('--subgraph', action='append', default=[],
+                               help='Subgraph name. It can be used several times (by default all subgraphs)')
+    report_parser.add_argument('--version', choices=VERSIONS, default='current')
+    report_parser.add_argument('--since', type=datetime.datetime.fromisoformat,
+                               default=datetime.datetime.now() - datetime.timedelta(days=30),
+                               help='ISO date or datetime (by default 30 days ago)')
+    report_parser.add_argument('--until', type=datetime.datetime.fromisoformat, default=datetime.datetime.now(),
+                               help='ISO date or datetime (by default now)')
+    report_parser.add_argument('--json', action='store_true', help='Print one JSON report per line')
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        print_slo_reports(args.subgraph, args.version, args.since, args.until, args.json)
+        raise SystemExit()
+
+    # Requests of the shared HTTP transport are recorded or replayed
+    cassette = open_cassette(args.record, args.replay, args.replay_speed)
+    if cassette is not None:
+        HttpProvider.use_cassette(cassette)
+
+    # Replays start without alert states and do not change the ones, the history and the shard leases of real runs,
+    # so the same cassette always sends the same requests
+    if args.replay:
+        AlertStateProvider.use_memory_store()
+        StatusHistoryProvider.disable()
+
+    # Subgraphs defined in `config.py` or in `CONFIG_FILE`
+    subgraphs_config_service = SubgraphsConfigService(config.subgraphs)
+    # Shard of this replica (`SHARD_INDEX` and `SHARD_COUNT`)
+    shard_service = ShardService(lease_dir='') if args.replay else ShardService()
+
+    # Tasks of the checks are profiled in each thread
+    executor_class = ProfiledThreadPoolExecutor if args.profile else ThreadPoolExecutor
+
+    with executor_class(max_workers=MAX_WORKERS, thread_name_prefix='check') as executor:
+        def run(function, *function_args):
+            # The thread that runs the checks is also profiled
+            return executor.profile(function, *function_args) if args.profile else function(*function_args)
+
+        try:
+            if args.daemon:
+                run(run_daemon, subgraphs_config_service, shard_service, executor)
+            elif not shard_service.acquire_lease():
+                logging.info(f'Lease of shard {shard_service.shard_index} is held by another replica. '
+                             'Subgraphs are not checked')
+            else:
+                # Check status of each defined subgraph of this shard
+                try:
+                    run(check_subgraphs, shard_service.get_shard_subgraphs(subgraphs_config_service.get_subgraphs()),
+                        executor)
+                finally:
+                    flush_notifications()
+                    shard_service.release_lease()
+
+                    if PUSHGATEWAY_URL:
+                        MetricsProvider().push(PUSHGATEWAY_URL)
+        finally:
+            # Spans not exported yet are sent to the collector
+            TracingProvider().stop()
+
+            if args.profile:
+                executor.write_report(args.profile)
+
+            if cassette is not None:
+                cassette.close()
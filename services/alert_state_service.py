@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite file where the last notified state of each subgraph version is stored (by default `alert_state.db`).
+# If it is empty, states are not stored and every NOT OK subgraph version is notified in every check
+ALERT_STATE_DB = os.environ.get('ALERT_STATE_DB', 'alert_state.db')
+
+# Seconds after which a subgraph version that is still NOT OK is notified again (by default 0, never)
+ALERT_REMINDER_INTERVAL = float(os.environ.get('ALERT_REMINDER_INTERVAL', 0))
+
+# Notification types
+ALERT_NOTIFICATION = 'alert'
+REMINDER_NOTIFICATION = 'reminder'
+RECOVERY_NOTIFICATION = 'recovery'
+
+
+class AlertStateService:
+    def __init__(self, db_path: str = ALERT_STATE_DB, reminder_interval: float = ALERT_REMINDER_INTERVAL):
+        """
+        Store of the last notified state of each subgraph version, so that notifications are only sent
+        when a subgraph version changes its state (OK -> NOT OK and NOT OK -> OK) or a reminder is due.
+        States are read and written by primary key, so the cost per subgraph is constant
+        :param db_path: str. SQLite file. If it is empty, states are not stored
+        :param reminder_interval: float. Seconds after which a NOT OK subgraph version is notified again (0 is never)
+        """
+
+        self.reminder_interval = reminder_interval
+        self.connection = None
+        # The connection is shared by all threads
+        self.lock = threading.Lock()
+
+        if db_path:
+            self.connection = sqlite3.connect(db_path, check_same_thread=False)
+            # WAL journal avoids a full sync of the database file on every commit
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS alert_states ('
+                                    'subgraph_name TEXT NOT NULL, '
+                                    'version TEXT NOT NULL, '
+                                    'is_ok INTEGER NOT NULL, '
+                                    'notified_at REAL NOT NULL, '
+                                    'PRIMARY KEY (subgraph_name, version)) WITHOUT ROWID')
+            self.connection.commit()
+
+    def get_notification_type(self, subgraph_name: str, version: str, is_ok: bool):
+        """
+        Get the notification that must be sent for the evaluated state of a subgraph version
+        :param subgraph_name: str
+        :param version: str. `current` or `pending`
+        :param is_ok: bool. Evaluated state
+        :return: str (`alert`, `reminder` or `recovery`) or None if nothing must be sent
+        """
+
+        if self.connection is None:
+            return None if is_ok else ALERT_NOTIFICATION
+
+        with self.lock:
+            notified_state = self.connection.execute(
+                'SELECT is_ok, notified_at FROM alert_states WHERE subgraph_name = ? AND version = ?',
+                (subgraph_name, version)).fetchone()
+
+        # Subgraph versions never notified are considered OK
+        notified_is_ok, notified_at = notified_state if notified_state else (True, None)
+
+        if is_ok:
+            return None if notified_is_ok else RECOVERY_NOTIFICATION
+        elif notified_is_ok:
+            return ALERT_NOTIFICATION
+        elif self.reminder_interval and time.time() - notified_at >= self.reminder_interval:
+            return REMINDER_NOTIFICATION
+
+        return None
+
+    def mark_notified(self, subgraph_name: str, version: str, is_ok: bool):
+        """
+        Store the state of a subgraph version once it has been notified.
+        It is not stored before, so that failed notifications are sent again in the next check
+        Changes are written to disk with `commit`
+        :param subgraph_name: str
+        :param version: str. `current` or `pending`
+        :param is_ok: bool. Notified state
+        """
+
+        if self.connection is None:
+            return
+
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO alert_states (subgraph_name, version, is_ok, notified_at) '
+                                    'VALUES (?, ?, ?, ?)', (subgraph_name, version, int(is_ok), time.time()))
+
+    def commit(self):
+        """
+        Write stored states to disk. It is done once per check instead of once per subgraph
+        """
+
+        if self.connection is None:
+            return
+
+        with self.lock:
+            self.connection.commit()
+
+
+class AlertStateProvider:
+    # Several threads can request the singleton at the same time and it must be created only once
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = AlertStateService()
+        return cls.instance
+
+    @classmethod
+    def use_memory_store(cls):
+        """
+        Store states in memory from now on, so that they are neither read from nor written to `ALERT_STATE_DB`
+        """
+
+        with cls.lock:
+            cls.instance = AlertStateService(db_path=':memory:')
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            del cls.instance
@@ -0,0 +1,264 @@
+import base64
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from .http_service import redact_url
+
+# Version of the cassette format, written in the first line. Version 2 stores redacted urls
+CASSETTE_VERSION = 2
+
+# Response headers that are recorded. Other headers are not used by the monitor
+RECORDED_HEADERS = ('Content-Type', 'Retry-After')
+
+
+class CassetteMissException(Exception):
+    pass
+
+
+class RecordedRequestException(Exception):
+    pass
+
+
+def _open_cassette_file(cassette_file: str, mode: str):
+    """
+    Cassettes are JSON lines, compressed with gzip when the file name ends with `.gz`
+    :param mode: str. `wt` or `rt`
+    """
+
+    if cassette_file.endswith('.gz'):
+        return gzip.open(cassette_file, mode, encoding='utf-8')
+
+    return open(cassette_file, mode, encoding='utf-8')
+
+
+def get_request_key(url: str, json_body=None, data: bytes = None) -> str:
+    """
+    :return: str. Hash of a request, used to find its response when it is replayed
+    """
+
+    if data is None:
+        data = json.dumps(json_body, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    return hashlib.sha1(url.encode('utf-8') + b'\n' + data).hexdigest()[:20]
+
+
+class RecordedResponse:
+    # Slots avoid a dict per object, as there is one per replayed request
+    __slots__ = ('status_code', 'headers', 'content')
+
+    def __init__(self, status_code: int, headers: dict, content: bytes):
+        """
+        Replayed response. It has the attributes of the responses of the HTTP clients that are used by the monitor
+        :param status_code: int
+        :param headers: dict. Only `RECORDED_HEADERS`
+        :param content: bytes. Decompressed body
+        """
+
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class CassetteRecorder:
+    def __init__(self, cassette_file: str):
+        """
+        Write every request sent with the shared HTTP transport and its response (or exception) to a cassette.
+        Each line is a JSON object with the start time of the request (seconds since the cassette was started),
+        its duration, redacted url (see `redact_url`), request hash, status code, headers and body.
+        Urls contain credentials (Infura tokens and Slack incoming webhooks), so only their redacted form is stored
+        and cassettes can be shared. Lines are written as responses arrive, so cassettes can be read while they
+        are recorded
+        :param cassette_file: str. Compressed with gzip if it ends with `.gz`
+        """
+
+        self.cassette_file = cassette_file
+        self.replaying = False
+        self.file = _open_cassette_file(cassette_file, 'wt')
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+        self._write({'version': CASSETTE_VERSION, 'recorded_at': time.time()})
+        logging.info(f'Recording requests to cassette {cassette_file}')
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.file:
+                self.file.write(line)
+
+    def post(self, send, url: str, json=None, timeout: float = None, data: bytes = None, headers: dict = None):
+        """
+        Send a request with `send` and record it
+        :param send: function with the parameters of `HttpService.post`
+        :return: response of `send`
+        """
+
+        start = time.monotonic()
+        entry = {'t': round(start - self.start, 6), 'url': redact_url(url), 'key': get_request_key(url, json, data)}
+
+        try:
+            response = send(url, json=json, timeout=timeout, data=data, headers=headers)
+        except Exception as exception:
+            entry.update(d=round(time.monotonic() - start, 6), error=f'{type(exception).__name__}: {exception}')
+            self._write(entry)
+            raise
+
+        entry.update(d=round(time.monotonic() - start, 6), status=response.status_code,
+                     headers={header: response.headers[header] for header in RECORDED_HEADERS
+                              if header in response.headers})
+        try:
+            entry['body'] = response.content.decode('utf-8')
+        except UnicodeDecodeError:
+            entry['body_base64'] = base64.b64encode(response.content).decode('ascii')
+
+        self._write(entry)
+
+        return response
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+                logging.info(f'Cassette {self.cassette_file} recorded')
+
+
+class CassettePlayer:
+    def __init__(self, cassette_file: str, speed: float = 0):
+        """
+        Answer requests with the responses of a cassette recorded by `CassetteRecorder`, without sending them.
+        A request gets the first response not replayed yet of the same request (same url and body) or, if there is
+        none, of the same redacted url. The cassette is read as requests are sent, so only responses recorded before
+        the ones being replayed are kept in memory
+        :param cassette_file: str
+        :param speed: float. 1 waits the recorded latency of each response, 10 is 10 times faster and 0 does not wait
+        """
+
+        self.cassette_file = cassette_file
+        self.speed = speed
+        self.replaying = True
+        self.file = _open_cassette_file(cassette_file, 'rt')
+
+        header = json.loads(self.file.readline() or '{}')
+        if header.get('version') != CASSETTE_VERSION:
+            raise ValueError(f'{cassette_file} is not a cassette of version {CASSETTE_VERSION}')
+
+        # Read entries not replayed yet. The same entry is in both queues. {request hash or url: deque}
+        self.entries_by_key = {}
+        self.entries_by_url = {}
+        self.lock = threading.Lock()
+
+        logging.info(f'Replaying requests from cassette {cassette_file}')
+
+    def _read_entry(self):
+        """
+        :return: dict. Next entry of the cassette or None at its end
+        """
+
+        line = self.file.readline() if self.file else ''
+        if not line:
+            return None
+
+        entry = json.loads(line)
+        self.entries_by_key.setdefault(entry['key'], collections.deque()).append(entry)
+        self.entries_by_url.setdefault(entry['url'], collections.deque()).append(entry)
+
+        return entry
+
+    @staticmethod
+    def _pop_entry(entries):
+        """
+        :param entries: deque or None
+        :return: dict. First entry not replayed yet or None
+        """
+
+        while entries:
+            entry = entries.popleft()
+            if not entry.get('replayed'):
+                entry['replayed'] = True
+                return entry
+
+        return None
+
+    def _find_entry(self, url: str, key: str):
+        """
+        :param url: str. Redacted url
+        :param key: str. Request hash
+        """
+
+        with self.lock:
+            entry = self._pop_entry(self.entries_by_key.get(key))
+
+            # Entries are read until one of the same request is found
+            while entry is None:
+                read_entry = self._read_entry()
+                if read_entry is None:
+                    break
+                if read_entry['key'] == key:
+                    entry = self._pop_entry(self.entries_by_key[key])
+
+            # Requests whose body changes between runs (e.g. merged Slack notifications) use the ones of their url
+            if entry is None:
+                entry = self._pop_entry(self.entries_by_url.get(url))
+
+        return entry
+
+    def post(self, send, url: str, json=None, timeout: float = None, data: bytes = None, headers: dict = None):
+        """
+        Replay the recorded response of a request. `send` is not called
+        :return: RecordedResponse
+        """
+
+        redacted_url = redact_url(url)
+        entry = self._find_entry(redacted_url, get_request_key(url, json, data))
+        if entry is None:
+            raise CassetteMissException(f'Request to {redacted_url} is not recorded in cassette {self.cassette_file}')
+
+        if self.speed:
+            time.sleep(entry['d'] / self.speed)
+
+        if 'error' in entry:
+            raise RecordedRequestException(entry['error'])
+
+        if 'body_base64' in entry:
+            content = base64.b64decode(entry['body_base64'])
+        else:
+            content = entry['body'].encode('utf-8')
+
+        return RecordedResponse(entry['status'], entry['headers'], content)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+def open_cassette(record_file: str = None, replay_file: str = None, replay_speed: float = 0):
+    """
+    :param record_file: str. Cassette where requests are recorded
+    :param replay_file: str. Cassette whose responses are replayed
+    :param replay_speed: float. See `CassettePlayer`
+    :return: CassetteRecorder, CassettePlayer or None if requests are neither recorded nor replayed
+    """
+
+    if record_file and replay_file:
+        raise ValueError('Requests cannot be recorded and replayed at the same time')
+    if record_file:
+        return CassetteRecorder(record_file)
+    if replay_file:
+        return CassettePlayer(replay_file, replay_speed)
+
+    return None
@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+
+from .http_service import redact_url
+from .metrics_service import MetricsProvider
+
+# Consecutive failed requests to an endpoint that open its circuit (by default 3)
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 3))
+
+# Seconds that a circuit stays open before a probe request is allowed (by default 30)
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_BREAKER_RESET_TIMEOUT', 30))
+
+CLOSED_STATE = 'closed'
+OPEN_STATE = 'open'
+HALF_OPEN_STATE = 'half_open'
+
+# Values of the `subgraph_monitor_circuit_breaker_state` gauge
+STATE_METRIC_VALUES = {CLOSED_STATE: 0, HALF_OPEN_STATE: 1, OPEN_STATE: 2}
+
+
+class CircuitOpenException(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, endpoint: str, failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_BREAKER_RESET_TIMEOUT):
+        """
+        Stop requesting an endpoint after `failure_threshold` consecutive failures.
+        After `reset_timeout` seconds only one probe request is allowed (half open): if it succeeds the circuit
+        is closed again, otherwise it stays open for another `reset_timeout` seconds
+        :param endpoint: str. Url of the endpoint. It can contain credentials, so only its redacted url is logged and
+        exported
+        :param failure_threshold: int
+        :param reset_timeout: float
+        """
+
+        self.endpoint = endpoint
+        self.name = redact_url(endpoint)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED_STATE
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN_STATE
+        return OPEN_STATE
+
+    def is_available(self) -> bool:
+        """
+        Check if the endpoint can be requested (closed circuit, or half open without a probe in flight)
+        :return: bool
+        """
+
+        state = self.state
+        return state == CLOSED_STATE or (state == HALF_OPEN_STATE and not self.probe_in_flight)
+
+    def _allow_request(self) -> bool:
+        with self.lock:
+            state = self.state
+            if state == CLOSED_STATE:
+                return True
+            if state == HALF_OPEN_STATE and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def _record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logging.info(f'Endpoint {self.name} is available again')
+            self.failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+            self._update_metric()
+
+    def _record_failure(self):
+        with self.lock:
+            self.failures += 1
+            # A failed probe opens the circuit again
+            if self.probe_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.error(f'Endpoint {self.name} failed {self.failures} times. '
+                                  f'It will not be requested for {self.reset_timeout} seconds')
+                self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+            self._update_metric()
+
+    def _update_metric(self):
+        MetricsProvider().set_gauge('subgraph_monitor_circuit_breaker_state',
+                                    STATE_METRIC_VALUES[self.state], endpoint=self.name)
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call a function that requests the endpoint. Any exception is considered a failure of the endpoint
+        :raises CircuitOpenException: if the endpoint is not requested because its circuit is open
+        """
+
+        if not self._allow_request():
+            raise CircuitOpenException(self.name)
+
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self._record_failure()
+            raise
+
+        self._record_success()
+        return result
+
+
+class CircuitBreakerService:
+    def __init__(self):
+        # One circuit breaker per endpoint. They are created the first time an endpoint is requested
+        self.circuit_breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        """
+        Get the circuit breaker of an endpoint
+        :param endpoint: str. Url of the endpoint
+        :return: CircuitBreaker
+        """
+
+        with self.lock:
+            if endpoint not in self.circuit_breakers:
+                self.circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+
+            return self.circuit_breakers[endpoint]
+
+    def get_states(self) -> dict:
+        """
+        :return: dict. {endpoint: state}
+        """
+
+        with self.lock:
+            return {endpoint: circuit_breaker.state for endpoint, circuit_breaker in self.circuit_breakers.items()}
+
+
+class CircuitBreakerProvider:
+    # Several threads can request the singleton at the same time
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = CircuitBreakerService()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            del cls.instance
@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+# Max number of requests per minute to status endpoints and RPC urls of all hosts (by default 0, unlimited)
+REQUEST_BUDGET_PER_MINUTE = float(os.environ.get('REQUEST_BUDGET_PER_MINUTE', 0))
+
+
+class HostConcurrencyLimiter:
+    def __init__(self):
+        # One semaphore per remote host (or endpoint). They are created the first time a host is requested
+        self.host_semaphores = {}
+        # Max concurrency of each semaphore. {host or endpoint: max concurrency}
+        self.max_concurrencies = {}
+        # Hosts (or endpoints) requested with different max concurrencies, they are only warned once
+        self.conflicting_keys = set()
+        self.lock = threading.Lock()
+
+    def limit(self, url: str, max_concurrency: int, per_endpoint: bool = False) -> threading.BoundedSemaphore:
+        """
+        Get the semaphore that limits the concurrent requests to the host of an url (or to the url itself).
+        It must be used as a context manager: `with host_limiter.limit(url, 4): HttpProvider().post(url)`
+        :param url: str. Url that is going to be requested
+        :param max_concurrency: int. Max number of concurrent requests to the host (used when the semaphore is created)
+        :param per_endpoint: bool. Limit the requests to the url instead of the ones to its host, so that endpoints of
+        the same host have their own limit
+        :return: threading.BoundedSemaphore
+        """
+
+        key = url if per_endpoint else urlparse(url).netloc
+
+        with self.lock:
+            if key not in self.host_semaphores:
+                self.host_semaphores[key] = threading.BoundedSemaphore(max_concurrency)
+                self.max_concurrencies[key] = max_concurrency
+            elif self.max_concurrencies[key] != max_concurrency and key not in self.conflicting_keys:
+                self.conflicting_keys.add(key)
+                logging.warning(f'Requests to {key} are limited to {self.max_concurrencies[key]} concurrent requests, '
+                                f'not to {max_concurrency}')
+
+            return self.host_semaphores[key]
+
+
+class RequestBudget:
+    def __init__(self, requests_per_minute: float = REQUEST_BUDGET_PER_MINUTE):
+        """
+        Token bucket that caps the number of requests per minute. Up to one minute of requests can be sent in a burst
+        :param requests_per_minute: float. 0 is unlimited
+        """
+
+        self.requests_per_minute = requests_per_minute
+        self.tokens = requests_per_minute
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        Wait until a request can be sent
+        :param timeout: float. Max seconds to wait (by default no limit)
+        :return: bool. False if the request can not be sent before the timeout
+        """
+
+        if not self.requests_per_minute:
+            return True
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.requests_per_minute,
+                              self.tokens + (now - self.updated_at) * self.requests_per_minute / 60)
+            self.updated_at = now
+
+            # Tokens are reserved in order, so waiting requests are not starved
+            self.tokens -= 1
+            wait_time = -self.tokens * 60 / self.requests_per_minute if self.tokens < 0 else 0
+
+            if timeout is not None and wait_time > timeout:
+                self.tokens += 1
+                return False
+
+        if wait_time:
+            time.sleep(wait_time)
+
+        return True
+
+
+class RequestBudgetProvider:
+    # Several threads can request the singleton at the same time
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = RequestBudget()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            del cls.instance
+
+
+class HostConcurrencyLimiterProvider:
+    # Several threads can request the singleton at the same time
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = HostConcurrencyLimiter()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            del cls.instance
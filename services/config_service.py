@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+
+from .discovery_service import SubgraphDiscoveryService
+from .thegraph_service import THEGRAPH_STATUS_URL
+
+# JSON or YAML file with the subgraphs to monitor. If it is not defined, `config.subgraphs` is used
+CONFIG_FILE = os.environ.get('CONFIG_FILE', '')
+
+
+class ConfigFileNotValidException(Exception):
+    pass
+
+
+def load_config_file(config_file: str) -> dict:
+    """
+    Load a JSON or YAML (`.yml` or `.yaml`, it requires `pip install pyyaml`) config file
+    :param config_file: str
+    :return: dict
+    """
+
+    with open(config_file) as file:
+        if config_file.endswith(('.yml', '.yaml')):
+            import yaml
+            config = yaml.safe_load(file)
+        else:
+            config = json.load(file)
+
+    if not isinstance(config, dict):
+        raise ConfigFileNotValidException(f'Config file {config_file} must contain an object')
+
+    return config
+
+
+class SubgraphsConfigService:
+    def __init__(self, default_subgraphs: list, config_file: str = CONFIG_FILE):
+        """
+        Subgraphs to monitor, from `config.subgraphs` or from a config file with this format:
+        {
+            "subgraphs": [same format as `config.subgraphs`],
+            "discovery": {
+                "index_nodes": ["https://api.thegraph.com/index-node/graphql"],
+                "include": ["Qm*"],
+                "exclude": [],
+                "routes": [{"pattern": "*", "notifications": {"slack": {"incoming_webhook": "https://..."}}}],
+                "refresh_interval": 600
+            }
+        }
+        The config file is loaded again when it changes
+        :param default_subgraphs: list. Subgraphs used when there is no config file
+        :param config_file: str
+        """
+
+        self.default_subgraphs = default_subgraphs
+        self.config_file = config_file
+        self.config_file_mtime = None
+        self.subgraphs = default_subgraphs
+        self.discovery_service = None
+
+    def reload_if_changed(self):
+        """
+        Load the config file again if it has been modified. If it is not valid, the previous config is kept
+        """
+
+        if not self.config_file:
+            return
+
+        try:
+            config_file_mtime = os.stat(self.config_file).st_mtime
+            if config_file_mtime == self.config_file_mtime:
+                return
+
+            config = load_config_file(self.config_file)
+
+            discovery = config.get('discovery')
+            discovery_service = SubgraphDiscoveryService(
+                index_nodes=discovery.get('index_nodes', [THEGRAPH_STATUS_URL]),
+                include=discovery.get('include'),
+                exclude=discovery.get('exclude'),
+                routes=discovery.get('routes'),
+                refresh_interval=discovery.get('refresh_interval', 600)
+            ) if discovery else None
+        except Exception as exception:
+            logging.error(f'Config file {self.config_file} could not be loaded. Exception: {exception}')
+            return
+
+        self.config_file_mtime = config_file_mtime
+        self.subgraphs = config.get('subgraphs', [])
+        self.discovery_service = discovery_service
+
+        logging.info(f'Config file {self.config_file} loaded')
+
+    def get_subgraphs(self) -> list:
+        """
+        Get subgraphs to monitor: defined ones and discovered ones (defined ones have priority)
+        :return: list
+        """
+
+        self.reload_if_changed()
+
+        if self.discovery_service is None:
+            return self.subgraphs
+
+        subgraph_names = {subgraph['name'] for subgraph in self.subgraphs}
+
+        return self.subgraphs + [subgraph for subgraph in self.discovery_service.get_subgraphs()
+                                 if subgraph['name'] not in subgraph_names]
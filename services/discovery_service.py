@@ -0,0 +1,104 @@
+import fnmatch
+import logging
+import time
+
+from .thegraph_service import fetch_deployments
+
+
+class SubgraphDiscoveryService:
+    def __init__(self, index_nodes: list, include: list = None, exclude: list = None, routes: list = None,
+                 refresh_interval: float = 600):
+        """
+        Discover subgraphs to monitor from the deployments indexed by index nodes.
+        The status endpoint only returns deployment IDs when it is requested without filters,
+        so patterns are matched against deployment IDs and discovered subgraphs are monitored by deployment
+        :param index_nodes: list. Status endpoints
+        :param include: list. Glob patterns of deployments to monitor (by default all)
+        :param exclude: list. Glob patterns of deployments not to monitor
+        :param routes: list. [{'pattern': glob, 'notifications': {...}}]. The first matching route defines
+        the notifications of a deployment. Deployments without route are not monitored
+        :param refresh_interval: float. Seconds that discovered subgraphs are reused before enumerating them again
+        :raise ValueError: if a pattern is a subgraph name pattern (it contains `/`), as it would never match
+        """
+
+        patterns = (include or []) + (exclude or []) + [route['pattern'] for route in routes or []]
+        name_patterns = [pattern for pattern in patterns if '/' in pattern]
+        if name_patterns:
+            raise ValueError(f'Discovery patterns are matched against deployment IDs, not subgraph names: '
+                             f'{", ".join(name_patterns)}. Subgraphs monitored by name must be defined in `subgraphs`')
+
+        self.index_nodes = index_nodes
+        self.include = include or ['*']
+        self.exclude = exclude or []
+        self.routes = routes or []
+        self.refresh_interval = refresh_interval
+
+        # {deployment: subgraph}. Subgraphs are reused between refreshes so that they keep their schedule
+        self.discovered_subgraphs = {}
+        self.refreshed_at = None
+
+    def _get_route(self, deployment: str):
+        """
+        :return: dict. First route whose pattern matches the deployment, or None
+        """
+
+        if not any(fnmatch.fnmatchcase(deployment, pattern) for pattern in self.include) or \
+                any(fnmatch.fnmatchcase(deployment, pattern) for pattern in self.exclude):
+            return None
+
+        return next((route for route in self.routes if fnmatch.fnmatchcase(deployment, route['pattern'])), None)
+
+    def get_subgraphs(self) -> list:
+        """
+        Get discovered subgraphs. They are only enumerated again after `refresh_interval` seconds
+        :return: list. Subgraphs with the same format as `config.subgraphs` (`deployment` is True)
+        """
+
+        if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.refresh_interval:
+            self.refresh()
+
+        return list(self.discovered_subgraphs.values())
+
+    def refresh(self):
+        """
+        Enumerate deployments of all index nodes. Only added and removed deployments change the discovered subgraphs
+        If an index node is unavailable, its previously discovered subgraphs are kept
+        """
+
+        discovered_subgraphs = {}
+
+        for index_node in self.index_nodes:
+            try:
+                deployments = fetch_deployments(index_node)
+            except Exception as exception:
+                logging.error(f'Subgraphs of index node {index_node} could not be discovered. Exception: {exception}')
+                discovered_subgraphs.update({deployment: subgraph
+                                             for deployment, subgraph in self.discovered_subgraphs.items()
+                                             if subgraph['index_node'] == index_node})
+                continue
+
+            for deployment in deployments:
+                if deployment in discovered_subgraphs:
+                    continue
+
+                route = self._get_route(deployment)
+                if route is None:
+                    continue
+
+                subgraph = self.discovered_subgraphs.get(deployment)
+                if subgraph is None or subgraph['notifications'] != route['notifications']:
+                    subgraph = {
+                        'name': deployment,
+                        'deployment': True,
+                        'index_node': index_node,
+                        'notifications': route['notifications']
+                    }
+                discovered_subgraphs[deployment] = subgraph
+
+        added_deployments = discovered_subgraphs.keys() - self.discovered_subgraphs.keys()
+        removed_deployments = self.discovered_subgraphs.keys() - discovered_subgraphs.keys()
+        if added_deployments or removed_deployments:
+            logging.info(f'Discovered subgraphs: {len(added_deployments)} added, {len(removed_deployments)} removed')
+
+        self.discovered_subgraphs = discovered_subgraphs
+        self.refreshed_at = time.monotonic()
@@ -0,0 +1,309 @@
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import urllib.parse
+
+# Directory where the status history of each subgraph is stored (by default `history`). If it is empty,
+# history is not stored
+HISTORY_DIR = os.environ.get('HISTORY_DIR', 'history')
+
+# Seconds of history stored in each file. A new file is started after them (by default 86400, one day)
+HISTORY_ROTATION_INTERVAL = int(os.environ.get('HISTORY_ROTATION_INTERVAL', 86400))
+
+# Seconds of history kept. Older files are deleted when a new file is started (by default 2592000, 30 days).
+# If it is 0, history is never deleted
+HISTORY_RETENTION = int(os.environ.get('HISTORY_RETENTION', 2592000))
+
+# Fixed-width record of each check: timestamp (float64), block lag (int64, -1 if unknown), version (0 current,
+# 1 pending), healthy (0 or 1) and synced (0, 1 or 2 if unknown). 24 bytes, little endian
+RECORD = struct.Struct('<dqBBB5x')
+
+VERSIONS = ('current', 'pending')
+UNKNOWN_SYNCED = 2
+UNKNOWN_LAG = -1
+
+# Block lags lower than 2 ** LAG_HISTOGRAM_BITS have their own bucket. Higher ones share buckets of their
+# LAG_HISTOGRAM_BITS most significant bits, so percentiles of block lags are at most 2 ** (1 - LAG_HISTOGRAM_BITS)
+# (3%) higher than the exact ones
+LAG_HISTOGRAM_BITS = 6
+
+
+def get_subgraph_history_dir(history_dir: str, subgraph_name: str) -> str:
+    # Subgraph names contain `/`
+    return os.path.join(history_dir, urllib.parse.quote(subgraph_name, safe=''))
+
+
+class StatusHistoryService:
+    def __init__(self, history_dir: str = HISTORY_DIR, rotation_interval: int = HISTORY_ROTATION_INTERVAL,
+                 retention: int = HISTORY_RETENTION):
+        """
+        Append-only status history of each subgraph, in files of fixed-width records:
+        `<history_dir>/<quoted subgraph name>/<start of the rotation interval>.bin`
+        :param history_dir: str. Empty disables the history
+        :param rotation_interval: int. Seconds of history stored in each file
+        :param retention: int. Seconds of history kept (0 keeps it forever)
+        """
+
+        self.history_dir = history_dir
+        self.rotation_interval = rotation_interval
+        self.retention = retention
+        # Rotation interval of the last record of each subgraph directory that already exists. {directory: start}
+        self.current_intervals = {}
+        self.lock = threading.Lock()
+
+    def _delete_expired_files(self, subgraph_history_dir: str, interval_start: int):
+        """
+        Delete the files of a subgraph whose records are all older than the retention
+        :param subgraph_history_dir: str
+        :param interval_start: int. Start of the current rotation interval
+        """
+
+        if not self.retention:
+            return
+
+        for file_name in os.listdir(subgraph_history_dir):
+            if file_name.endswith('.bin') and \
+                    int(file_name[:-len('.bin')]) + self.rotation_interval <= interval_start - self.retention:
+                os.remove(os.path.join(subgraph_history_dir, file_name))
+
+    def record(self, subgraph_name: str, version: str, timestamp: float, is_healthy: bool, is_synced=None,
+               block_lag=None):
+        """
+        Append the status of a checked subgraph version
+        :param subgraph_name: str
+        :param version: str. `current` or `pending`
+        :param timestamp: float. Check time (seconds since epoch)
+        :param is_healthy: bool
+        :param is_synced: bool or None if it is unknown
+        :param block_lag: int or None if it is unknown
+        """
+
+        if not self.history_dir:
+            return
+
+        subgraph_history_dir = get_subgraph_history_dir(self.history_dir, subgraph_name)
+        interval_start = int(timestamp // self.rotation_interval * self.rotation_interval)
+        history_file = os.path.join(subgraph_history_dir, f'{interval_start}.bin')
+        record = RECORD.pack(timestamp, UNKNOWN_LAG if block_lag is None else max(0, int(block_lag)),
+                             VERSIONS.index(version), int(bool(is_healthy)),
+                             UNKNOWN_SYNCED if is_synced is None else int(is_synced))
+
+        try:
+            # Expired files are only looked for once per subgraph and rotation interval
+            if self.current_intervals.get(subgraph_history_dir) != interval_start:
+                os.makedirs(subgraph_history_dir, exist_ok=True)
+                self._delete_expired_files(subgraph_history_dir, interval_start)
+                with self.lock:
+                    self.current_intervals[subgraph_history_dir] = interval_start
+
+            # Appends of only one record are atomic, so concurrent checks never interleave records
+            file_descriptor = os.open(history_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(file_descriptor, record)
+            finally:
+                os.close(file_descriptor)
+        except OSError as exception:
+            logging.error(f'Status history of subgraph {subgraph_name} could not be stored. Exception: {exception}')
+
+
+class StatusHistoryProvider:
+    # Several threads can request the singleton at the same time
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = StatusHistoryService()
+        return cls.instance
+
+    @classmethod
+    def disable(cls):
+        """
+        Do not store history from now on
+        """
+
+        with cls.lock:
+            cls.instance = StatusHistoryService(history_dir='')
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            del cls.instance
+
+
+def get_history_subgraph_names(history_dir: str = HISTORY_DIR) -> list:
+    """
+    :return: list. Names of the subgraphs with stored history
+    """
+
+    if not os.path.isdir(history_dir):
+        return []
+
+    return sorted(urllib.parse.unquote(directory) for directory in os.listdir(history_dir)
+                  if os.path.isdir(os.path.join(history_dir, directory)))
+
+
+def iter_history_records(subgraph_name: str, since: float, until: float, history_dir: str = HISTORY_DIR,
+                         rotation_interval: int = HISTORY_ROTATION_INTERVAL):
+    """
+    Iterate records of a subgraph between two times without loading the files in memory.
+    Only files of the rotation intervals in the range are opened, and they are memory mapped
+    :param subgraph_name: str
+    :param since: float. Seconds since epoch (included)
+    :param until: float. Seconds since epoch (excluded)
+    :return: iterator of (timestamp, block lag, version, healthy, synced) tuples in time order
+    """
+
+    subgraph_history_dir = get_subgraph_history_dir(history_dir, subgraph_name)
+    if not os.path.isdir(subgraph_history_dir):
+        return
+
+    history_files = sorted((int(file_name[:-len('.bin')]), file_name) for file_name in os.listdir(subgraph_history_dir)
+                           if file_name.endswith('.bin'))
+
+    for interval_start, file_name in history_files:
+        if interval_start + rotation_interval <= since or interval_start >= until:
+            continue
+
+        with open(os.path.join(subgraph_history_dir, file_name), 'rb') as file:
+            # A partially written record at the end of the file is ignored
+            size = os.fstat(file.fileno()).st_size // RECORD.size * RECORD.size
+            if not size:
+                continue
+
+            with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as history:
+                for record in RECORD.iter_unpack(history):
+                    if record[0] >= until:
+                        break
+                    if record[0] >= since:
+                        yield record
+
+
+def get_percentile(sorted_values, percentile: float):
+    """
+    :param sorted_values: sorted sequence
+    :param percentile: float. Between 0 and 100
+    :return: nearest-rank percentile (the smallest value with at least `percentile`% of the values lower or equal)
+    or None if there are no values
+    """
+
+    if not sorted_values:
+        return None
+
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(percentile / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class BlockLagHistogram:
+    def __init__(self):
+        """
+        Counts of block lags in fixed buckets (see `LAG_HISTOGRAM_BITS`), so percentiles of any number of checks
+        are computed with constant memory
+        """
+
+        self.half_bucket_count = 1 << (LAG_HISTOGRAM_BITS - 1)
+        # Block lags are int64, so the highest shift is 64 - LAG_HISTOGRAM_BITS
+        self.counts = [0] * ((64 - LAG_HISTOGRAM_BITS + 2) * self.half_bucket_count)
+        self.count = 0
+        self.max = None
+
+    def _get_bucket(self, block_lag: int) -> int:
+        shift = max(0, block_lag.bit_length() - LAG_HISTOGRAM_BITS)
+        return shift * self.half_bucket_count + (block_lag >> shift)
+
+    def _get_bucket_upper_bound(self, bucket: int) -> int:
+        if bucket < 2 * self.half_bucket_count:
+            return bucket
+
+        # Buckets of each shift start after the ones of the previous shift, whose values have one bit less
+        shift, mantissa = divmod(bucket - self.half_bucket_count, self.half_bucket_count)
+        return ((mantissa + self.half_bucket_count + 1) << shift) - 1
+
+    def add(self, block_lag: int):
+        """
+        :param block_lag: int. Not negative
+        """
+
+        self.counts[self._get_bucket(block_lag)] += 1
+        self.count += 1
+        self.max = block_lag if self.max is None else max(self.max, block_lag)
+
+    def get_percentile(self, percentile: float):
+        """
+        :param percentile: float. Between 0 and 100
+        :return: int. Upper bound of the bucket of the nearest-rank percentile (never higher than the max block lag)
+        or None if there are no block lags
+        """
+
+        if not self.count:
+            return None
+
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+        cumulative_count = 0
+        for bucket, count in enumerate(self.counts):
+            cumulative_count += count
+            if cumulative_count >= rank:
+                return min(self.max, self._get_bucket_upper_bound(bucket))
+
+        return self.max
+
+
+def build_slo_report(subgraph_name: str, version: str, since: float, until: float, history_dir: str = HISTORY_DIR,
+                     rotation_interval: int = HISTORY_ROTATION_INTERVAL) -> dict:
+    """
+    Compute uptime (percentage of checks with the version healthy and not out of sync), block lag percentiles and
+    incidents (consecutive NOT OK checks) of a subgraph version between two times.
+    Records are scanned once and block lags are counted in a `BlockLagHistogram`, so memory does not grow with the
+    number of checks
+    :param subgraph_name: str
+    :param version: str. `current` or `pending`
+    :param since: float. Seconds since epoch
+    :param until: float. Seconds since epoch
+    :return: dict
+    """
+
+    version_index = VERSIONS.index(version)
+
+    checks = 0
+    ok_checks = 0
+    block_lag_histogram = BlockLagHistogram()
+    # [(start, end or None if it is still open)]
+    incidents = []
+
+    for timestamp, block_lag, record_version, is_healthy, is_synced in iter_history_records(
+            subgraph_name, since, until, history_dir, rotation_interval):
+        if record_version != version_index:
+            continue
+
+        checks += 1
+        if block_lag != UNKNOWN_LAG:
+            block_lag_histogram.add(block_lag)
+
+        is_ok = is_healthy and is_synced != 0
+        if is_ok:
+            ok_checks += 1
+            if incidents and incidents[-1][1] is None:
+                incidents[-1] = (incidents[-1][0], timestamp)
+        elif not incidents or incidents[-1][1] is not None:
+            incidents.append((timestamp, None))
+
+    # Incidents that are still open last until now (or until the end of the range)
+    now = time.time()
+    incident_durations = [(end if end is not None else min(until, now)) - start for start, end in incidents]
+
+    return {
+        'subgraph': subgraph_name,
+        'version': version,
+        'checks': checks,
+        'uptime': 100 * ok_checks / checks if checks else None,
+        'block_lag_p50': block_lag_histogram.get_percentile(50),
+        'block_lag_p95': block_lag_histogram.get_percentile(95),
+        'block_lag_p99': block_lag_histogram.get_percentile(99),
+        'block_lag_max': block_lag_histogram.max,
+        'incidents': [{'start': start, 'end': end, 'duration': duration}
+                      for (start, end), duration in zip(incidents, incident_durations)],
+    }
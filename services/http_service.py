@@ -0,0 +1,167 @@
+import functools
+import hashlib
+import logging
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+# Number of hosts whose connection pools are kept alive (by default 10)
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+
+# Max number of connections kept alive for each host (by default 16)
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 16))
+
+# Default timeout (in seconds) of requests (by default 10)
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 10))
+
+# Use HTTP/2 when it is available. It requires `httpx[http2]` to be installed (by default disabled)
+HTTP2_ENABLED = os.environ.get('HTTP2_ENABLED', 'false').lower() == 'true'
+
+# Responses are requested compressed to reduce transferred data
+DEFAULT_HEADERS = {'Accept-Encoding': 'gzip, deflate'}
+
+# Url path segments that look like credentials: API tokens (e.g. Infura project IDs) and Slack webhook IDs
+SECRET_URL_PART = re.compile(r'(?=.*[0-9])(?=.*[A-Za-z])[0-9A-Za-z_-]{8,}|[0-9A-Za-z_-]{20,}')
+
+
+@functools.lru_cache(maxsize=1024)
+def redact_url(url: str) -> str:
+    """
+    Url without credentials, so that it can be logged, exported in metrics or written to cassettes.
+    User info is removed, and path segments that look like credentials and query strings are replaced by a short
+    hash of them, so different urls of the same host still have different redacted urls
+    :param url: str
+    :return: str. E.g. `https://mainnet.infura.io/v3/<1a2b3c4d>`
+    """
+
+    def get_hash(part: str) -> str:
+        return f'<{hashlib.sha1(part.encode("utf-8")).hexdigest()[:8]}>'
+
+    try:
+        parsed_url = urlsplit(url)
+        host = parsed_url.hostname
+        port = parsed_url.port
+    except ValueError:
+        return get_hash(url)
+    if not host:
+        return get_hash(url)
+
+    path = '/'.join(get_hash(segment) if SECRET_URL_PART.fullmatch(segment) else segment
+                    for segment in parsed_url.path.split('/'))
+    query = f'?{get_hash(parsed_url.query)}' if parsed_url.query else ''
+
+    return f'{parsed_url.scheme}://{host}{f":{port}" if port else ""}{path}{query}'
+
+
+class HttpService:
+    def __init__(self, pool_connections: int = HTTP_POOL_CONNECTIONS, pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 timeout: float = HTTP_TIMEOUT, http2_enabled: bool = HTTP2_ENABLED, cassette=None):
+        """
+        Shared HTTP transport. Connections are kept alive and reused for every request to the same host,
+        so TCP and TLS handshakes are only done once per connection
+        :param pool_connections: int. Number of hosts whose connection pools are kept alive
+        :param pool_maxsize: int. Max number of connections kept alive for each host
+        :param timeout: float. Default timeout (in seconds) of requests
+        :param http2_enabled: bool. Use HTTP/2 if `httpx[http2]` is installed
+        :param cassette: CassetteRecorder or CassettePlayer. Requests are recorded or replayed
+        (see `services.cassette_service`)
+        """
+
+        self.timeout = timeout
+        self.cassette = cassette
+        self.client = None
+        self.http2 = False
+
+        # Replayed requests are not sent, so no client is built
+        if cassette is not None and cassette.replaying:
+            return
+
+        if http2_enabled:
+            self.client = self._build_http2_client(pool_connections, pool_maxsize)
+
+        # HTTP/2 client is only built if `httpx[http2]` is installed
+        self.http2 = self.client is not None
+
+        if self.client is None:
+            # `requests` takes a big part of the startup time, so it is only imported when the first request is sent
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self.client = requests.Session()
+            self.client.headers.update(DEFAULT_HEADERS)
+
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            self.client.mount('http://', adapter)
+            self.client.mount('https://', adapter)
+
+    def _build_http2_client(self, pool_connections: int, pool_maxsize: int):
+        """
+        Build a HTTP/2 client. If `httpx[http2]` is not installed, None is returned and HTTP/1.1 is used
+        :return: httpx.Client
+        """
+
+        try:
+            import httpx
+
+            return httpx.Client(http2=True,
+                                headers=DEFAULT_HEADERS,
+                                limits=httpx.Limits(max_connections=pool_connections * pool_maxsize,
+                                                    max_keepalive_connections=pool_connections * pool_maxsize))
+        except ImportError:
+            logging.warning('HTTP/2 is enabled but `httpx[http2]` is not installed. Using HTTP/1.1')
+
+            return None
+
+    def post(self, url: str, json=None, timeout: float = None, data: bytes = None, headers: dict = None):
+        """
+        Send a POST request reusing the pooled connections.
+        Using the json parameter in the request will change the Content-Type to application/json.
+        :param url: str
+        :param json: object serializable to JSON
+        :param timeout: float. Seconds to wait for the response (by default `HTTP_TIMEOUT`)
+        :param data: bytes. Raw body, used instead of `json`
+        :param headers: dict. Extra headers
+        :return: response. It has `status_code`, `headers` and `json()` for both HTTP/1.1 and HTTP/2 clients
+        """
+
+        if self.cassette is not None:
+            return self.cassette.post(self._post, url, json=json, timeout=timeout, data=data, headers=headers)
+
+        return self._post(url, json=json, timeout=timeout, data=data, headers=headers)
+
+    def _post(self, url: str, json=None, timeout: float = None, data: bytes = None, headers: dict = None):
+        if data is not None:
+            # httpx names raw bodies `content`
+            body_argument = 'content' if self.http2 else 'data'
+            return self.client.post(url, headers=headers, timeout=timeout or self.timeout, **{body_argument: data})
+
+        return self.client.post(url, json=json, headers=headers, timeout=timeout or self.timeout)
+
+
+class HttpProvider:
+    # Several threads can request the singleton at the same time and it must be created only once
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = HttpService()
+        return cls.instance
+
+    @classmethod
+    def use_cassette(cls, cassette):
+        """
+        Record or replay the requests of the shared transport from now on
+        :param cassette: CassetteRecorder, CassettePlayer or None
+        """
+
+        with cls.lock:
+            cls.instance = HttpService(cassette=cassette)
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            if cls.instance.cassette is not None:
+                cls.instance.cassette.close()
+            del cls.instance
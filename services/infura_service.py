@@ -1,5 +1,17 @@
-import requests
+import array
+import logging
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .circuit_breaker_service import CircuitBreakerProvider, CircuitOpenException
+from .concurrency_service import HostConcurrencyLimiterProvider, RequestBudgetProvider
+from .history_service import get_percentile
+from .http_service import HttpProvider
+from .metrics_service import MetricsProvider
+from .retry_service import RETRY_MAX_ATTEMPTS, DeadlineExceededException, call_with_retries, get_remaining_time
+from .tracing_service import TracingProvider
 
 
 class InfuraService(Exception):
@@ -20,83 +32,468 @@ class InfuraTokenNotDefinedException(InfuraService):
 
 INFURA_TOKEN = os.environ.get('INFURA_TOKEN')
 
+# Networks whose RPC urls are provided by Infura when `INFURA_TOKEN` is defined
+INFURA_NETWORKS = ['mainnet', 'ropsten', 'rinkeby', 'kovan', 'goerli']
+
+# Other RPC urls by network, with format `network=url,network=url` (e.g. `xdai=https://rpc.xdaichain.com`).
+# A network can have several RPC urls (e.g. Infura and a local node), they are used as hedged providers
+RPC_URLS = [tuple(network_rpc_url.strip().split('=', 1))
+            for network_rpc_url in os.environ.get('RPC_URLS', '').split(',') if network_rpc_url.strip()]
+
+# Seconds that a latest block number is reused before requesting it again (by default 5)
+CHAIN_HEAD_CACHE_TTL = float(os.environ.get('CHAIN_HEAD_CACHE_TTL', 5))
+
+# Max number of concurrent requests to each RPC host (by default 2)
+INFURA_MAX_CONCURRENCY = int(os.environ.get('INFURA_MAX_CONCURRENCY', 2))
+
+# Seconds to wait for a response of a RPC url (by default 2)
+RPC_REQUEST_TIMEOUT = float(os.environ.get('RPC_REQUEST_TIMEOUT', 2))
+
+# Percentile of the latency of a RPC url after which the next RPC url of the network is also requested
+# (by default 95)
+RPC_HEDGE_PERCENTILE = float(os.environ.get('RPC_HEDGE_PERCENTILE', 95))
+
+# Seconds after which the next RPC url is requested while a RPC url does not have enough latency samples
+# (by default 0.5)
+RPC_HEDGE_DELAY = float(os.environ.get('RPC_HEDGE_DELAY', 0.5))
+
+# Number of RPC urls of a network whose answers are waited for. The highest latest block number is used
+# (by default 1, the first valid answer)
+CHAIN_HEAD_QUORUM = int(os.environ.get('CHAIN_HEAD_QUORUM', 1))
+
+# Latency samples kept for each RPC url
+RPC_LATENCY_SAMPLES = 64
+
+# Latency samples of a RPC url needed to use its latency percentile as hedge delay
+RPC_HEDGE_MIN_SAMPLES = 10
+
+# Min seconds before a hedged request, so that fast RPC urls are not requested twice every time
+RPC_HEDGE_MIN_DELAY = 0.01
+
+# Weight of each new request in the error rate of a RPC url
+RPC_ERROR_RATE_WEIGHT = 0.1
+
+# Max number of hedged requests sent at the same time
+RPC_HEDGE_MAX_WORKERS = 16
+
 
 class InfuraProvider:
+    # Several threads can request the singleton at the same time and it must be created only once
+    lock = threading.Lock()
+
     def __new__(cls):
-        if not hasattr(cls, 'instance'):
-            cls.instance = InfuraService()
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = InfuraService()
         return cls.instance
 
     @classmethod
     def del_singleton(cls):
         if hasattr(cls, "instance"):
+            if cls.instance.executor is not None:
+                cls.instance.executor.shutdown(wait=False)
             del cls.instance
 
 
+class RpcUrlStats:
+    # Slots avoid a dict per object
+    __slots__ = ('latencies', 'size', 'count', 'next_index', 'error_rate')
+
+    def __init__(self, size: int = RPC_LATENCY_SAMPLES):
+        """
+        Latencies of the last successful requests to a RPC url (in a ring buffer of doubles) and its error rate
+        :param size: int. Max number of latency samples
+        """
+
+        self.latencies = array.array('d', bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.next_index = 0
+        # Exponentially weighted rate of failed requests
+        self.error_rate = 0.0
+
+    def add_success(self, latency: float):
+        self.latencies[self.next_index] = latency
+        self.next_index = (self.next_index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        self.error_rate *= 1 - RPC_ERROR_RATE_WEIGHT
+
+    def add_error(self):
+        self.error_rate = self.error_rate * (1 - RPC_ERROR_RATE_WEIGHT) + RPC_ERROR_RATE_WEIGHT
+
+    def get_latency_percentile(self, percentile: float):
+        """
+        :param percentile: float. Between 0 and 100
+        :return: float. Seconds or None if there are no samples
+        """
+
+        if not self.count:
+            return None
+
+        # Samples are stored from the first position until the buffer is full
+        return get_percentile(sorted(self.latencies[:self.count]), percentile)
+
+    def get_score(self) -> float:
+        """
+        Expected seconds until a valid answer: median latency divided by the rate of successful requests.
+        RPC urls without samples score 0, so they are requested first and get samples
+        :return: float
+        """
+
+        median_latency = self.get_latency_percentile(50)
+        if median_latency is None:
+            return 0.0
+
+        return median_latency / max(0.05, 1 - self.error_rate)
+
+
 class InfuraService:
-    def __init__(self, infura_token: str = INFURA_TOKEN):
+    def __init__(self, infura_token: str = INFURA_TOKEN, rpc_urls: dict = None,
+                 cache_ttl: float = CHAIN_HEAD_CACHE_TTL, hedge_percentile: float = RPC_HEDGE_PERCENTILE,
+                 hedge_delay: float = RPC_HEDGE_DELAY, quorum: int = CHAIN_HEAD_QUORUM):
         """
+        Chain head provider. Latest block numbers are only requested when a network is used,
+        and they are cached during `cache_ttl` seconds.
+        A network can have several RPC urls (Infura, `RPC_URLS` and `rpc_urls`). They are requested in order of
+        their latency and error rate, and the next one is also requested (hedged request) when a RPC url fails or
+        does not answer within the `hedge_percentile` of its latency
         :param infura_token: str. Infura specifies a token to control service usage
+        :param rpc_urls: dict. {network: rpc url or list of rpc urls}. Added after Infura and `RPC_URLS` urls
+        :param cache_ttl: float. Seconds that a latest block number is reused
+        :param hedge_percentile: float. Percentile of the latency of a RPC url after which the next one is requested
+        :param hedge_delay: float. Seconds before the next RPC url is requested when there are not enough samples
+        :param quorum: int. Number of RPC urls whose answers are waited for. The highest block number is used
         """
 
-        if not infura_token:
+        self.infura_token = infura_token
+        self.cache_ttl = cache_ttl
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.quorum = max(1, quorum)
+
+        # Registry of RPC urls by network name (as it is returned by Thegraph status endpoint). {network: [rpc url]}
+        self.rpc_urls = {}
+        if self.infura_token:
+            for network in INFURA_NETWORKS:
+                self.register_network(network, f'https://{network}.infura.io/v3/{self.infura_token}')
+        for network, rpc_url in RPC_URLS:
+            self.register_network(network, rpc_url)
+        for network, network_rpc_urls in (rpc_urls or {}).items():
+            for rpc_url in ([network_rpc_urls] if isinstance(network_rpc_urls, str) else network_rpc_urls):
+                self.register_network(network, rpc_url)
+
+        if not self.rpc_urls:
             raise InfuraTokenNotDefinedException()
 
-        self.infura_token = infura_token
+        # {network: (latest block number, monotonic time when it was requested)}
+        self.latest_block_numbers = {}
+        # One lock per set of RPC urls so that concurrent checks of the same network only do one request
+        self.rpc_url_locks = {}
+        # {rpc url: RpcUrlStats}
+        self.rpc_url_stats = {}
+        self.lock = threading.Lock()
+        # Threads of hedged requests. They are only started when a network has several RPC urls
+        self.executor = None
 
-        self.mainnet_url = f'https://mainnet.infura.io/v3/{self.infura_token}'
-        self.rinkeby_url = f'https://rinkeby.infura.io/v3/{self.infura_token}'
+    def register_network(self, network: str, rpc_url: str):
+        """
+        Add a RPC url used to get latest block numbers of a network
+        :param network: str
+        :param rpc_url: str
+        """
 
-        # Get latest blocks to only do it one time
-        self.latest_mainnet_block_number = self.get_latest_mainnet_block_number()
-        self.latest_rinkeby_block_number = self.get_latest_rinkeby_block_number()
+        network_rpc_urls = self.rpc_urls.setdefault(network.lower(), [])
+        if rpc_url not in network_rpc_urls:
+            network_rpc_urls.append(rpc_url)
 
-    def get_latest_mainnet_block_number(self) -> int:
+    def _get_cached_latest_block_number(self, network: str):
         """
-        Get latest MAINNET block number from Infura service
-        :return: int
+        Get latest block number of a network if it was requested less than `cache_ttl` seconds ago
+        :return: int or None
         """
 
-        response = requests.post(url=self.mainnet_url,
-                                 json={"jsonrpc":"2.0","method":"eth_blockNumber","params": [],"id":1},
-                                 timeout=2)
+        cached_block_number = self.latest_block_numbers.get(network)
 
-        response_json = response.json()
+        if cached_block_number and time.monotonic() - cached_block_number[1] < self.cache_ttl:
+            return cached_block_number[0]
 
-        # Hex to int
-        infura_mainnet_latest_block = int(response_json['result'], 16)
+        return None
 
-        return infura_mainnet_latest_block
+    def _get_rpc_url_lock(self, rpc_urls: tuple) -> threading.Lock:
+        with self.lock:
+            return self.rpc_url_locks.setdefault(rpc_urls, threading.Lock())
 
-    def get_latest_rinkeby_block_number(self) -> int:
+    def _get_rpc_url_stats(self, rpc_url: str) -> RpcUrlStats:
+        # It must be called with the lock
+        rpc_url_stats = self.rpc_url_stats.get(rpc_url)
+        if rpc_url_stats is None:
+            rpc_url_stats = self.rpc_url_stats[rpc_url] = RpcUrlStats()
+        return rpc_url_stats
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=RPC_HEDGE_MAX_WORKERS, thread_name_prefix='rpc-hedge')
+            return self.executor
+
+    def is_network_available(self, network: str) -> bool:
         """
-        Get latest RINKEBY block number from Infura service
-        :return: int
+        Check if some RPC url of a network can be requested (its circuit breaker is not open)
+        :param network: str
+        :return: bool
+        """
+
+        return any(CircuitBreakerProvider().get(rpc_url).is_available()
+                   for rpc_url in self.rpc_urls.get(network.lower(), []))
+
+    def get_ordered_rpc_urls(self, network: str) -> list:
+        """
+        Get the RPC urls of a network that can be requested, the ones with the lowest expected latency first
+        (see `RpcUrlStats.get_score`)
+        :param network: str
+        :return: list
+        """
+
+        rpc_urls = [rpc_url for rpc_url in self.rpc_urls.get(network.lower(), [])
+                    if CircuitBreakerProvider().get(rpc_url).is_available()]
+        with self.lock:
+            scores = {rpc_url: self._get_rpc_url_stats(rpc_url).get_score() for rpc_url in rpc_urls}
+
+        return sorted(rpc_urls, key=scores.get)
+
+    def _get_hedge_delay(self, rpc_url: str) -> float:
+        """
+        :return: float. Seconds to wait for a RPC url before requesting the next one
         """
 
-        response = requests.post(url=self.rinkeby_url,
-                                 json={"jsonrpc":"2.0","method":"eth_blockNumber","params": [],"id":1},
-                                 timeout=2)
+        with self.lock:
+            rpc_url_stats = self._get_rpc_url_stats(rpc_url)
+            if rpc_url_stats.count < RPC_HEDGE_MIN_SAMPLES:
+                return self.hedge_delay
+            return max(RPC_HEDGE_MIN_DELAY, rpc_url_stats.get_latency_percentile(self.hedge_percentile))
+
+    def _request_latest_block_numbers(self, rpc_url: str, networks: list, max_attempts: int = RETRY_MAX_ATTEMPTS,
+                                      deadline: float = None) -> dict:
+        """
+        Request latest block numbers of several networks that use the same RPC url with only one request
+        (a JSON-RPC batch request is used when there is more than one network).
+        Failed requests are retried with backoff, and the RPC url is not requested while its circuit breaker is open
+        :param rpc_url: str
+        :param networks: list
+        :param max_attempts: int
+        :param deadline: float. `time.monotonic()` time after which the request is not retried
+        :return: dict. {network: latest block number}
+        """
 
-        if response:
+        def request_rpc_url():
+            # Retries are also limited by the global request budget
+            if not RequestBudgetProvider().acquire(get_remaining_time(deadline)):
+                raise InfuraEndpointUnavailableException()
+
+            start = time.monotonic()
+            try:
+                latest_block_numbers = CircuitBreakerProvider().get(rpc_url).call(self._post_latest_block_numbers,
+                                                                                  rpc_url, networks)
+            except InfuraEndpointUnavailableException:
+                with self.lock:
+                    self._get_rpc_url_stats(rpc_url).add_error()
+                raise
+
+            with self.lock:
+                self._get_rpc_url_stats(rpc_url).add_success(time.monotonic() - start)
+            return latest_block_numbers
+
+        try:
+            return call_with_retries(request_rpc_url, retry_exceptions=(InfuraEndpointUnavailableException,),
+                                     deadline=deadline, max_attempts=max_attempts)
+        except (CircuitOpenException, DeadlineExceededException):
+            raise InfuraEndpointUnavailableException()
+
+    def _request_hedged_latest_block_numbers(self, rpc_urls: list, networks: list, deadline: float = None) -> dict:
+        """
+        Request latest block numbers of several networks to their RPC urls (in order). The next RPC url is also
+        requested when the previous one fails or does not answer within its hedge delay. When `quorum` RPC urls
+        have answered (or all of them have been requested), the highest block number of each network is used
+        :param rpc_urls: list. RPC urls of the networks, in order
+        :param networks: list
+        :param deadline: float. `time.monotonic()` time after which RPC urls are not requested
+        :return: dict. {network: latest block number}
+        """
+
+        # Failed requests are retried with the same RPC url when it is the only one
+        if len(rpc_urls) == 1:
+            return self._request_latest_block_numbers(rpc_urls[0], networks, deadline=deadline)
+
+        quorum = min(self.quorum, len(rpc_urls))
+        # {future: rpc url}
+        futures = {}
+        answers = []
+        next_index = 0
+        next_hedge_time = None
+
+        def request_next_rpc_url():
+            nonlocal next_index, next_hedge_time
+
+            rpc_url = rpc_urls[next_index]
+            next_index += 1
+            # The next RPC url is the retry, so each RPC url is requested only once.
+            # A context can only be entered by one thread at a time, so each request gets its own copy
+            request_latest_block_numbers = TracingProvider().propagate(self._request_latest_block_numbers)
+            futures[self._get_executor().submit(request_latest_block_numbers, rpc_url, networks, 1, deadline)] = rpc_url
+            next_hedge_time = time.monotonic() + self._get_hedge_delay(rpc_url)
+
+        for _ in range(quorum):
+            request_next_rpc_url()
+
+        while futures and len(answers) < quorum:
+            timeout = max(0.0, next_hedge_time - time.monotonic()) if next_index < len(rpc_urls) else None
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                logging.debug(f'Latest block numbers of {", ".join(networks)} are slow. Requesting the next RPC url')
+                MetricsProvider().inc_counter('subgraph_monitor_rpc_hedged_requests_total', reason='slow')
+                request_next_rpc_url()
+                continue
+
+            for future in done:
+                del futures[future]
+                try:
+                    answers.append(future.result())
+                except Exception as exception:
+                    # Unexpected exceptions are failed attempts too, so the other RPC urls are still requested
+                    if not isinstance(exception, InfuraEndpointUnavailableException):
+                        logging.warning(f'Latest block numbers of {", ".join(networks)} could not be requested. '
+                                        f'Exception: {exception}')
+                    if next_index < len(rpc_urls):
+                        MetricsProvider().inc_counter('subgraph_monitor_rpc_hedged_requests_total', reason='failed')
+                        request_next_rpc_url()
+
+        if not answers:
+            raise InfuraEndpointUnavailableException()
+
+        # Nodes that are behind return lower block numbers
+        return {network: max(answer[network] for answer in answers) for network in networks}
+
+    def _post_latest_block_numbers(self, rpc_url: str, networks: list) -> dict:
+        """
+        Send the `eth_blockNumber` requests of `_request_latest_block_numbers` (only one attempt)
+        :return: dict. {network: latest block number}
+        """
+
+        rpc_requests = [{"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": index}
+                        for index, _ in enumerate(networks)]
+
+        try:
+            with HostConcurrencyLimiterProvider().limit(rpc_url, INFURA_MAX_CONCURRENCY), \
+                    MetricsProvider().time('subgraph_monitor_stage_duration_seconds', stage='chain_head_fetch'), \
+                    TracingProvider().span('chain_head_fetch', networks=','.join(networks)):
+                response = HttpProvider().post(url=rpc_url,
+                                               json=rpc_requests if len(rpc_requests) > 1 else rpc_requests[0],
+                                               timeout=RPC_REQUEST_TIMEOUT)
+        except Exception:
+            raise InfuraEndpointUnavailableException()
+
+        if response.status_code != 200:
+            raise InfuraEndpointUnavailableException()
+
+        try:
             response_json = response.json()
-            # Hex to int
-            infura_mainnet_latest_block = int(response_json['result'], 16)
+        except ValueError:
+            raise InfuraEndpointUnavailableException()
 
-            return infura_mainnet_latest_block
-        else:
+        if not isinstance(response_json, list):
+            response_json = [response_json]
+
+        latest_block_numbers = {}
+        for rpc_response in response_json:
+            try:
+                # Hex to int
+                latest_block_numbers[networks[rpc_response['id']]] = int(rpc_response['result'], 16)
+            except (KeyError, IndexError, TypeError, ValueError):
+                raise InfuraEndpointUnavailableException()
+
+        # Only answers with all networks are valid
+        if len(latest_block_numbers) != len(networks):
+            raise InfuraEndpointUnavailableException()
+
+        return latest_block_numbers
+
+    def prefetch_latest_block_numbers(self, networks, deadline: float = None) -> None:
+        """
+        Get latest block numbers of several networks that are not cached.
+        Networks that share the same RPC urls are requested with only one JSON-RPC batch request to each RPC url
+        :param networks: iterable. Networks in use
+        :param deadline: float. `time.monotonic()` time after which RPC urls are not requested
+        :raises InfuraEndpointUnavailableException: if some networks could not be requested (the other ones are cached)
+        """
+
+        # {RPC urls in order: [network]}
+        networks_by_rpc_urls = {}
+        for network in {network.lower() for network in networks}:
+            if network in self.rpc_urls and self._get_cached_latest_block_number(network) is None:
+                networks_by_rpc_urls.setdefault(tuple(self.get_ordered_rpc_urls(network)), []).append(network)
+
+        is_unavailable = False
+        for rpc_urls, rpc_urls_networks in networks_by_rpc_urls.items():
+            # All RPC urls have their circuit breaker open
+            if not rpc_urls:
+                is_unavailable = True
+                continue
+
+            with self._get_rpc_url_lock(tuple(sorted(rpc_urls))):
+                # Another thread could have requested them while waiting for the lock
+                rpc_urls_networks = [network for network in rpc_urls_networks
+                                     if self._get_cached_latest_block_number(network) is None]
+                if not rpc_urls_networks:
+                    continue
+
+                request_time = time.monotonic()
+                try:
+                    latest_block_numbers = self._request_hedged_latest_block_numbers(list(rpc_urls), rpc_urls_networks,
+                                                                                     deadline)
+                except InfuraEndpointUnavailableException:
+                    is_unavailable = True
+                    continue
+
+                for network, block_number in latest_block_numbers.items():
+                    self.latest_block_numbers[network] = (block_number, request_time)
+
+        if is_unavailable:
             raise InfuraEndpointUnavailableException()
 
-    def get_latest_block_number_of_network(self, network: str) -> int:
+    def get_latest_mainnet_block_number(self) -> int:
+        """
+        Get latest MAINNET block number
+        :return: int
+        """
+
+        return self.get_latest_block_number_of_network('mainnet')
+
+    def get_latest_rinkeby_block_number(self) -> int:
+        """
+        Get latest RINKEBY block number
+        :return: int
+        """
+
+        return self.get_latest_block_number_of_network('rinkeby')
+
+    def get_latest_block_number_of_network(self, network: str, deadline: float = None) -> int:
         """
         Get latest block number of network requested
-        Only mainnet and rinkeby networks are supported
+        Only networks with a RPC url (Infura networks, `RPC_URLS` or registered ones) are supported
+        :param network: str
+        :param deadline: float. `time.monotonic()` time after which RPC urls are not requested
         :return: int
         """
 
-        if network == 'mainnet':
-            return self.latest_mainnet_block_number
-        elif network == 'rinkeby':
-            return self.latest_rinkeby_block_number
-        else:
+        network = network.lower()
+
+        if network not in self.rpc_urls:
             raise InfuraNetworkNotSupported()
+
+        latest_block_number = self._get_cached_latest_block_number(network)
+        if latest_block_number is None:
+            self.prefetch_latest_block_numbers([network], deadline)
+            latest_block_number = self.latest_block_numbers[network][0]
+
+        return latest_block_number
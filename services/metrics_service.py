@@ -0,0 +1,230 @@
+import bisect
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from .http_service import HttpProvider
+
+# Port of the Prometheus `/metrics` endpoint. It is only started in daemon mode (by default 0, disabled)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+
+# Prometheus Pushgateway where metrics are pushed after one-shot runs (by default disabled)
+PUSHGATEWAY_URL = os.environ.get('PUSHGATEWAY_URL', '')
+
+# Job name used in the Pushgateway
+PUSHGATEWAY_JOB = os.environ.get('PUSHGATEWAY_JOB', 'thegraph_subgraphs_monitor')
+
+# Buckets (in seconds) of latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# {metric name: (type, help)}
+METRICS = {
+    'subgraph_healthy': ('gauge', 'Whether the subgraph version is healthy (1) or not (0)'),
+    'subgraph_synced': ('gauge', 'Whether the current subgraph version is synced (1) or not (0)'),
+    'subgraph_block_lag': ('gauge', 'Blocks between the chain head and the latest block of the current subgraph version'),
+    'subgraph_indexing_velocity': ('gauge', 'Blocks indexed per second by the subgraph version'),
+    'subgraph_catch_up_eta_seconds': ('gauge', 'Estimated seconds until the subgraph version reaches the chain head'),
+    'subgraph_poi_consistent': ('gauge', 'Whether the proofs of indexing of the current subgraph version are the same '
+                                         'in all index nodes (1) or not (0)'),
+    'subgraph_monitor_stage_duration_seconds': ('histogram', 'Duration of the requests of each check stage'),
+    'subgraph_monitor_infura_fallbacks_total': ('counter', 'Times that Infura was used or was unavailable '
+                                                           'to check the synced status'),
+    'subgraph_monitor_rpc_hedged_requests_total': ('counter', 'Times that the next RPC url of a network was requested '
+                                                              'because the previous one was slow or failed'),
+    'subgraph_monitor_status_endpoint_unavailable_total': ('counter', 'Times that each status endpoint was unavailable'),
+    'subgraph_monitor_circuit_breaker_state': ('gauge', 'Circuit breaker state of each endpoint '
+                                                        '(0 closed, 1 half open, 2 open)'),
+}
+
+
+class MetricsService:
+    def __init__(self, enabled: bool = bool(METRICS_PORT or PUSHGATEWAY_URL)):
+        """
+        Metrics in Prometheus text format. When metrics are not enabled, updates do nothing
+        Gauges are updated without locks (a dict assignment is atomic), counters and histograms use one lock
+        that is only held to add numbers
+        :param enabled: bool
+        """
+
+        self.enabled = enabled
+        # {(metric name, labels tuple): value}
+        self.gauges = {}
+        self.counters = {}
+        # {(metric name, labels tuple): [bucket counts..., +Inf count, sum]}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.http_server = None
+
+    def set_gauge(self, name: str, value: float, **labels):
+        if self.enabled:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def retain(self, subgraph_names):
+        """
+        Remove the series of subgraphs that are not monitored anymore, so that they are not exported forever
+        :param subgraph_names: iterable
+        """
+
+        if not self.enabled:
+            return
+
+        subgraph_names = set(subgraph_names)
+
+        def is_removed(key: tuple) -> bool:
+            subgraph_name = dict(key[1]).get('subgraph')
+            return subgraph_name is not None and subgraph_name not in subgraph_names
+
+        # Copying the keys is atomic, gauges set meanwhile are kept
+        for key in list(self.gauges):
+            if is_removed(key):
+                self.gauges.pop(key, None)
+
+        with self.lock:
+            for series in (self.counters, self.histograms):
+                for key in [key for key in series if is_removed(key)]:
+                    del series[key]
+
+    def inc_counter(self, name: str, amount: float = 1, **labels):
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self.lock:
+                self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Add an observation to a histogram with `LATENCY_BUCKETS`
+        """
+
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            bucket_index = bisect.bisect_left(LATENCY_BUCKETS, value)
+            with self.lock:
+                histogram = self.histograms.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 2))
+                histogram[bucket_index] += 1
+                histogram[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, name: str, **labels):
+        """
+        Observe the duration of a block of code: `with metrics.time('name', stage='x'): ...`
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        """
+        Get all metrics in Prometheus text format
+        :return: str
+        """
+
+        def format_labels(labels: tuple, extra_labels: tuple = ()) -> str:
+            all_labels = labels + extra_labels
+            if not all_labels:
+                return ''
+            return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in all_labels) + '}'
+
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(histogram) for key, histogram in self.histograms.items()}
+        gauges = dict(self.gauges)
+
+        lines = []
+        for name, (metric_type, metric_help) in METRICS.items():
+            lines.append(f'# HELP {name} {metric_help}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+            for (metric_name, labels), value in {**gauges, **counters}.items():
+                if metric_name == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+
+            for (metric_name, labels), histogram in histograms.items():
+                if metric_name == name:
+                    cumulative_count = 0
+                    for bucket, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram[:-1]):
+                        cumulative_count += count
+                        lines.append(f'{name}_bucket{format_labels(labels, (("le", bucket),))} {cumulative_count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram[-1]}')
+                    lines.append(f'{name}_count{format_labels(labels)} {cumulative_count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def start_server(self, port: int = METRICS_PORT):
+        """
+        Serve metrics in `http://0.0.0.0:port/metrics` from a background thread
+        """
+
+        # Only the daemon serves metrics, so one-shot runs do not import it
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics_service = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = metrics_service.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.http_server = ThreadingHTTPServer(('0.0.0.0', port), MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, name='metrics', daemon=True).start()
+        logging.info(f'Metrics served in port {port}')
+
+    def stop_server(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server = None
+
+    def push(self, pushgateway_url: str = PUSHGATEWAY_URL, job: str = PUSHGATEWAY_JOB):
+        """
+        Push all metrics to a Prometheus Pushgateway (used after one-shot runs)
+        """
+
+        response = HttpProvider().post(url=f'{pushgateway_url.rstrip("/")}/metrics/job/{job}',
+                                       data=self.render().encode('utf-8'),
+                                       headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+        if response.status_code >= 300:
+            logging.error(f'Metrics could not be pushed. Pushgateway responded with status code {response.status_code}')
+
+
+def escape_label_value(value) -> str:
+    """
+    Escape a label value as the Prometheus text format requires (backslash, double quote and line feed)
+    :param value: str or number
+    :return: str
+    """
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsProvider:
+    # Several threads can request the singleton at the same time and it must be created only once
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = MetricsService()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            cls.instance.stop_server()
+            del cls.instance
@@ -0,0 +1,252 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+from .thegraph_service import fetch_deployments_statuses_batch, fetch_proofs_of_indexing_batch, \
+    StatusEndpointUnavailableException
+
+# Other index nodes whose proofs of indexing are compared with the ones of the index node of each subgraph,
+# with format `url,url` (by default disabled). Subgraphs can also define them in `poi_index_nodes`
+POI_INDEX_NODES = [index_node.strip() for index_node in os.environ.get('POI_INDEX_NODES', '').split(',')
+                   if index_node.strip()]
+
+# Min seconds between proof of indexing checks of a deployment (by default 3600)
+POI_CHECK_INTERVAL = float(os.environ.get('POI_CHECK_INTERVAL', 3600))
+
+# Max number of proofs of indexing that are kept in memory (by default 10000)
+POI_CACHE_SIZE = int(os.environ.get('POI_CACHE_SIZE', 10000))
+
+
+class ProofOfIndexingCheck:
+    # Slots avoid a dict per object, as there can be thousands of them
+    __slots__ = ('deployment', 'block_number', 'block_hash', 'proofs_of_indexing')
+
+    def __init__(self, deployment: str, block_number: int, block_hash: str, proofs_of_indexing: dict):
+        """
+        Proofs of indexing of a deployment at the same block
+        :param deployment: str
+        :param block_number: int
+        :param block_hash: str
+        :param proofs_of_indexing: dict. {index node: proof of indexing}
+        """
+
+        self.deployment = deployment
+        self.block_number = block_number
+        self.block_hash = block_hash
+        self.proofs_of_indexing = proofs_of_indexing
+
+    def is_consistent(self):
+        """
+        :return: bool. True if all index nodes returned the same proof of indexing, or None if less than two
+        index nodes could compute it
+        """
+
+        proofs_of_indexing = [proof_of_indexing for proof_of_indexing in self.proofs_of_indexing.values()
+                              if proof_of_indexing]
+        if len(proofs_of_indexing) < 2:
+            return None
+
+        return len(set(proofs_of_indexing)) == 1
+
+
+def get_poi_block(subgraph_status):
+    """
+    Block whose proof of indexing is checked: the last healthy block of failed subgraphs or the latest block
+    :param subgraph_status: SubgraphStatus
+    :return: tuple. (block number, block hash) or None if the status does not have it
+    """
+
+    if not subgraph_status or not subgraph_status.chains:
+        return None
+
+    chain = subgraph_status.chains[0]
+    if chain.last_healthy_block_hash:
+        return chain.last_healthy_block_number, chain.last_healthy_block_hash
+    if chain.latest_block_hash:
+        return chain.latest_block_number, chain.latest_block_hash
+
+    return None
+
+
+class ProofOfIndexingService:
+    def __init__(self, check_interval: float = POI_CHECK_INTERVAL, cache_size: int = POI_CACHE_SIZE):
+        """
+        Compare proofs of indexing of the same deployments in several index nodes.
+        Proofs of indexing are requested in batches (one request per index node) and cached by
+        (deployment, block hash), so the same block is never requested twice to an index node
+        :param check_interval: float. Min seconds between checks of a deployment
+        :param cache_size: int. Max number of cached (deployment, block hash)
+        """
+
+        self.check_interval = check_interval
+        self.cache_size = cache_size
+
+        # {(deployment, block hash): {index node: proof of indexing}}. Least recently used are removed first
+        self.proofs_of_indexing = collections.OrderedDict()
+        # {deployment: monotonic time of its last check whose proofs of indexing were fetched}
+        self.checked_at = {}
+        # Deployments that are being checked, so that concurrent batches do not check them twice
+        self.checking = set()
+        self.lock = threading.Lock()
+
+    def _pop_due_deployments(self, deployments: list) -> list:
+        """
+        Take the deployments that are due and not being checked. They must be released with `_release_deployments`
+        """
+
+        now = time.monotonic()
+
+        with self.lock:
+            due_deployments = [deployment for deployment in deployments if deployment not in self.checking and
+                               now - self.checked_at.get(deployment, -self.check_interval) >= self.check_interval]
+            self.checking.update(due_deployments)
+
+        return due_deployments
+
+    def _release_deployments(self, deployments: list, checked_deployments: set):
+        """
+        :param deployments: list. Taken by `_pop_due_deployments`
+        :param checked_deployments: set. Deployments whose proofs of indexing were fetched. The other ones are due
+        again in the next check
+        """
+
+        now = time.monotonic()
+
+        with self.lock:
+            self.checking.difference_update(deployments)
+            for deployment in checked_deployments:
+                self.checked_at[deployment] = now
+
+    def _get_cached_proofs_of_indexing(self, deployment_block: tuple) -> dict:
+        with self.lock:
+            if deployment_block in self.proofs_of_indexing:
+                self.proofs_of_indexing.move_to_end(deployment_block)
+            return self.proofs_of_indexing.setdefault(deployment_block, {})
+
+    def _remove_old_proofs_of_indexing(self):
+        with self.lock:
+            while len(self.proofs_of_indexing) > self.cache_size:
+                self.proofs_of_indexing.popitem(last=False)
+
+    def _fetch_proofs_of_indexing(self, index_node: str, deployment_blocks: list, deadline: float = None) -> bool:
+        """
+        Request proofs of indexing of an index node that are not cached
+        :param deployment_blocks: list. [(deployment, block hash)]
+        :return: bool. False if they could not be requested
+        """
+
+        deployment_blocks = [deployment_block for deployment_block in deployment_blocks
+                             if index_node not in self._get_cached_proofs_of_indexing(deployment_block)]
+        if not deployment_blocks:
+            return True
+
+        try:
+            proofs_of_indexing = fetch_proofs_of_indexing_batch(deployment_blocks, index_node, deadline)
+        except StatusEndpointUnavailableException:
+            logging.error(f'Proofs of indexing of index node {index_node} could not be requested')
+            return False
+
+        for deployment_block, proof_of_indexing in zip(deployment_blocks, proofs_of_indexing):
+            self._get_cached_proofs_of_indexing(deployment_block)[index_node] = proof_of_indexing
+
+        return True
+
+    def check_proofs_of_indexing(self, index_node: str, deployments_statuses: dict, other_index_nodes: list,
+                                 deadline: float = None) -> dict:
+        """
+        Compare proofs of indexing of deployments that are due. The block of each deployment is the lowest
+        block indexed by all index nodes, so that all of them can compute its proof of indexing.
+        Deployments are only considered checked (and not due until `check_interval`) when all index nodes were
+        requested, so failed requests are retried in the next check
+        :param index_node: str. Index node whose statuses have been fetched
+        :param deployments_statuses: dict. {deployment: current SubgraphStatus in `index_node`}
+        :param other_index_nodes: list. Index nodes compared with `index_node`
+        :param deadline: float. `time.monotonic()` time after which requests are not retried
+        :return: dict. {deployment: ProofOfIndexingCheck} of checked deployments
+        """
+
+        due_deployments = self._pop_due_deployments([deployment for deployment, status in deployments_statuses.items()
+                                                     if get_poi_block(status)])
+        if not due_deployments:
+            return {}
+
+        # Deployments are released even if the check raises, then none of them is checked
+        checked_deployments = set()
+        try:
+            proofs_of_indexing_checks, checked_deployments = self._compare_proofs_of_indexing(
+                index_node, deployments_statuses, other_index_nodes, due_deployments, deadline)
+        finally:
+            self._release_deployments(due_deployments, checked_deployments)
+
+        return proofs_of_indexing_checks
+
+    def _compare_proofs_of_indexing(self, index_node: str, deployments_statuses: dict, other_index_nodes: list,
+                                    due_deployments: list, deadline: float = None) -> tuple:
+        """
+        Compare proofs of indexing of the due deployments of `check_proofs_of_indexing`
+        :return: tuple. ({deployment: ProofOfIndexingCheck}, set of deployments whose statuses and proofs of indexing
+        were requested to all index nodes)
+        """
+
+        # Deployments whose statuses or proofs of indexing could not be requested to some index node
+        failed_deployments = set()
+
+        # {deployment: {index node: (block number, block hash)}}
+        blocks = {deployment: {index_node: get_poi_block(deployments_statuses[deployment])}
+                  for deployment in due_deployments}
+        for other_index_node in other_index_nodes:
+            try:
+                other_statuses = fetch_deployments_statuses_batch(due_deployments, other_index_node, deadline)
+            except StatusEndpointUnavailableException:
+                logging.error(f'Statuses of index node {other_index_node} could not be requested '
+                              'to check proofs of indexing')
+                failed_deployments.update(due_deployments)
+                continue
+
+            for deployment, statuses in other_statuses.items():
+                block = get_poi_block(statuses['current'])
+                if block:
+                    blocks[deployment][other_index_node] = block
+
+        # {index node: [(deployment, block hash)]}. Only one batch request per index node
+        deployment_blocks_by_index_node = {}
+        deployment_blocks = {}
+        for deployment, index_node_blocks in blocks.items():
+            if len(index_node_blocks) < 2:
+                continue
+
+            deployment_blocks[deployment] = min(index_node_blocks.values())
+            for block_index_node in index_node_blocks:
+                deployment_blocks_by_index_node.setdefault(block_index_node, []).append(
+                    (deployment, deployment_blocks[deployment][1]))
+
+        for block_index_node, index_node_deployment_blocks in deployment_blocks_by_index_node.items():
+            if not self._fetch_proofs_of_indexing(block_index_node, index_node_deployment_blocks, deadline):
+                failed_deployments.update(deployment for deployment, _ in index_node_deployment_blocks)
+
+        proofs_of_indexing_checks = {
+            deployment: ProofOfIndexingCheck(deployment, block_number, block_hash,
+                                             dict(self._get_cached_proofs_of_indexing((deployment, block_hash))))
+            for deployment, (block_number, block_hash) in deployment_blocks.items()
+        }
+        self._remove_old_proofs_of_indexing()
+
+        return proofs_of_indexing_checks, set(due_deployments) - failed_deployments
+
+
+class ProofOfIndexingProvider:
+    # Several threads can request the singleton at the same time
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = ProofOfIndexingService()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            del cls.instance
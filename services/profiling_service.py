@@ -0,0 +1,89 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of functions shown in each section of the profile report
+PROFILE_REPORT_LIMIT = 40
+
+
+class ProfiledThreadPoolExecutor(ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs):
+        """
+        ThreadPoolExecutor whose tasks are profiled with cProfile. `cProfile` only profiles the thread that enables
+        it, so each worker thread has its own profile and they are merged in the report
+        """
+
+        super().__init__(*args, **kwargs)
+        # Profiles of all threads. {thread name: cProfile.Profile}
+        self.profiles = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def _get_profile(self):
+        """
+        :return: cProfile.Profile of the current thread
+        """
+
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            # Profiling modules are only imported when `--profile` is used
+            import cProfile
+
+            profile = self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles[threading.current_thread().name] = profile
+        return profile
+
+    def submit(self, function, *args, **kwargs):
+        def run_profiled(*args, **kwargs):
+            profile = self._get_profile()
+            profile.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+
+        return super().submit(run_profiled, *args, **kwargs)
+
+    def profile(self, function, *args, **kwargs):
+        """
+        Call a function in the current thread and profile it (the sweep itself, not only its tasks)
+        """
+
+        profile = self._get_profile()
+        profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+
+    def write_report(self, report_file: str, limit: int = PROFILE_REPORT_LIMIT):
+        """
+        Write the hot paths of all threads: functions sorted by cumulative time and by own time
+        :param report_file: str
+        :param limit: int. Number of functions of each section
+        """
+
+        with self.lock:
+            profiles = list(self.profiles.values())
+
+        report = io.StringIO()
+        if not profiles:
+            report.write('Nothing was profiled\n')
+        else:
+            import pstats
+
+            stats = pstats.Stats(*profiles, stream=report)
+            stats.strip_dirs()
+
+            report.write(f'Profile of {len(profiles)} threads\n\n')
+            report.write('Sorted by cumulative time\n')
+            stats.sort_stats('cumulative').print_stats(limit)
+            report.write('Sorted by own time\n')
+            stats.sort_stats('tottime').print_stats(limit)
+
+        with open(report_file, 'w') as file:
+            file.write(report.getvalue())
+
+        logging.info(f'Profile report written to {report_file}')
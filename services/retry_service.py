@@ -0,0 +1,56 @@
+import os
+import random
+import time
+
+# Max attempts of a request to the status endpoint or to a RPC url (by default 3)
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 3))
+
+# Seconds of the first backoff. It is doubled after each attempt (by default 0.5)
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 0.5))
+
+# Max seconds of a backoff (by default 5)
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 5))
+
+
+class DeadlineExceededException(Exception):
+    pass
+
+
+def get_remaining_time(deadline):
+    """
+    :param deadline: float. `time.monotonic()` deadline or None
+    :return: float. Seconds until the deadline (never negative) or None if there is no deadline
+    """
+
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def call_with_retries(function, retry_exceptions: tuple, deadline: float = None,
+                      max_attempts: int = RETRY_MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                      max_delay: float = RETRY_MAX_DELAY):
+    """
+    Call a function again when it raises one of `retry_exceptions`, waiting a capped exponential backoff
+    with full jitter (a random time between 0 and the backoff) so that retries of concurrent requests are spread
+    :param function: function without arguments
+    :param retry_exceptions: tuple. Exceptions that are retried. Other exceptions are raised immediately
+    :param deadline: float. `time.monotonic()` time after which no more attempts are done
+    :param max_attempts: int
+    :param base_delay: float
+    :param max_delay: float
+    :raises DeadlineExceededException: if the deadline is reached before the first attempt
+    """
+
+    for attempt in range(max_attempts):
+        if get_remaining_time(deadline) == 0:
+            raise DeadlineExceededException()
+
+        try:
+            return function()
+        except retry_exceptions:
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+            # Last exception is raised when there are no more attempts or the deadline would be reached
+            if attempt == max_attempts - 1 or (deadline is not None and time.monotonic() + delay >= deadline):
+                raise
+
+            time.sleep(delay)
@@ -0,0 +1,225 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+# Default interval (in seconds) between checks of a subgraph (by default 60)
+CHECK_INTERVAL = float(os.environ.get('CHECK_INTERVAL', 60))
+
+# Max random delay added to each check, as a fraction of the check interval (by default 0.1)
+CHECK_JITTER = float(os.environ.get('CHECK_JITTER', 0.1))
+
+# Subgraphs due within this window (in seconds) are checked together to batch their requests (by default 1)
+CHECK_COALESCE_WINDOW = float(os.environ.get('CHECK_COALESCE_WINDOW', 1))
+
+# Max seconds between updates of the monitored subgraphs (config file reload and discovery) (by default 30)
+SUBGRAPHS_REFRESH_INTERVAL = float(os.environ.get('SUBGRAPHS_REFRESH_INTERVAL', 30))
+
+# Adapt the interval of each subgraph to its last evaluation (by default true): OK subgraphs are checked less
+# often after each check and degraded subgraphs are checked every `MIN_CHECK_INTERVAL` seconds
+ADAPTIVE_POLLING = os.environ.get('ADAPTIVE_POLLING', 'true').lower() == 'true'
+
+# Interval (in seconds) between checks of degraded subgraphs (by default 15)
+MIN_CHECK_INTERVAL = float(os.environ.get('MIN_CHECK_INTERVAL', 15))
+
+# Max interval (in seconds) between checks of OK subgraphs (by default 600)
+MAX_CHECK_INTERVAL = float(os.environ.get('MAX_CHECK_INTERVAL', 600))
+
+# The interval of an OK subgraph is multiplied by this factor after each check (by default 1.5)
+CHECK_INTERVAL_BACKOFF = float(os.environ.get('CHECK_INTERVAL_BACKOFF', 1.5))
+
+
+class SubgraphCheckScheduler:
+    def __init__(self, subgraphs: list, check_interval: float = CHECK_INTERVAL, jitter: float = CHECK_JITTER,
+                 coalesce_window: float = CHECK_COALESCE_WINDOW, adaptive_polling: bool = ADAPTIVE_POLLING,
+                 min_check_interval: float = MIN_CHECK_INTERVAL, max_check_interval: float = MAX_CHECK_INTERVAL,
+                 check_interval_backoff: float = CHECK_INTERVAL_BACKOFF):
+        """
+        :param subgraphs: list. Subgraphs defined in `config.subgraphs`. Each one can define its own `check_interval`
+        :param check_interval: float. Seconds between checks of subgraphs without `check_interval`
+        :param jitter: float. Max random delay added to each check, as a fraction of the check interval
+        :param coalesce_window: float. Subgraphs due within this window are checked together
+        :param adaptive_polling: bool. Adapt intervals to the evaluations reported with `report_evaluation`
+        :param min_check_interval: float. Interval of degraded subgraphs
+        :param max_check_interval: float. Max interval of OK subgraphs
+        :param check_interval_backoff: float. Factor applied to the interval of OK subgraphs after each check
+        """
+
+        self.check_interval = check_interval
+        self.jitter = jitter
+        self.coalesce_window = coalesce_window
+        self.adaptive_polling = adaptive_polling
+        self.min_check_interval = min_check_interval
+        self.max_check_interval = max_check_interval
+        self.check_interval_backoff = check_interval_backoff
+        self.stop_event = threading.Event()
+
+        # Adapted interval and last check time of each subgraph. {subgraph name: float}
+        self.adapted_check_intervals = {}
+        self.checked_at = {}
+        # Evaluations reported by checks that have not been applied yet. {subgraph name: is degraded}
+        self.evaluations = {}
+        self.evaluations_lock = threading.Lock()
+
+        # Heap of (next check time, subgraph index, subgraph). The index avoids comparing subgraph dicts
+        self.schedule = []
+        self.subgraph_indexes = itertools.count()
+        self.update_subgraphs(subgraphs)
+
+    def update_subgraphs(self, subgraphs: list):
+        """
+        Replace the scheduled subgraphs. Subgraphs that were already scheduled keep their next check time
+        :param subgraphs: list
+        """
+
+        subgraphs_by_name = {subgraph['name']: subgraph for subgraph in subgraphs}
+
+        schedule = []
+        for check_time, index, subgraph in self.schedule:
+            if subgraph['name'] in subgraphs_by_name:
+                schedule.append((check_time, index, subgraphs_by_name.pop(subgraph['name'])))
+
+        now = time.monotonic()
+        for subgraph in subgraphs_by_name.values():
+            # First checks are also spread so that they don't all fire together
+            first_check_time = now + random.uniform(0, self.get_subgraph_check_interval(subgraph) * self.jitter)
+            schedule.append((first_check_time, next(self.subgraph_indexes), subgraph))
+
+        heapq.heapify(schedule)
+        self.schedule = schedule
+
+        # Removed subgraphs are forgotten
+        for subgraph_name in set(self.adapted_check_intervals) - set(subgraph['name'] for _, _, subgraph in schedule):
+            self.adapted_check_intervals.pop(subgraph_name, None)
+            self.checked_at.pop(subgraph_name, None)
+
+    def get_subgraph_base_check_interval(self, subgraph: dict) -> float:
+        """
+        Get the configured interval between checks of a subgraph
+        :return: float
+        """
+
+        return float(subgraph.get('check_interval', self.check_interval))
+
+    def get_subgraph_check_interval(self, subgraph: dict) -> float:
+        """
+        Get the interval between checks of a subgraph (adapted to its last evaluations)
+        :return: float
+        """
+
+        return self.adapted_check_intervals.get(subgraph['name'], self.get_subgraph_base_check_interval(subgraph))
+
+    def report_evaluation(self, subgraph_name: str, is_degraded: bool):
+        """
+        Report the evaluation of a checked subgraph. It can be called from any thread,
+        intervals are adapted after the check with `apply_evaluations`
+        :param subgraph_name: str
+        :param is_degraded: bool. NOT OK, lagging or with a PENDING version that has just been deployed
+        """
+
+        with self.evaluations_lock:
+            self.evaluations[subgraph_name] = is_degraded
+
+    def apply_evaluations(self):
+        """
+        Adapt intervals of the subgraphs whose evaluations have been reported and reschedule their next check:
+        degraded subgraphs use the min interval, and the interval of OK subgraphs grows up to the max interval
+        """
+
+        with self.evaluations_lock:
+            evaluations, self.evaluations = self.evaluations, {}
+
+        if not self.adaptive_polling or not evaluations:
+            return
+
+        rescheduled = False
+        for position, (check_time, index, subgraph) in enumerate(self.schedule):
+            is_degraded = evaluations.get(subgraph['name'])
+            if is_degraded is None:
+                continue
+
+            base_check_interval = self.get_subgraph_base_check_interval(subgraph)
+            check_interval = self.get_subgraph_check_interval(subgraph)
+            if is_degraded:
+                adapted_check_interval = min(self.min_check_interval, base_check_interval)
+            else:
+                adapted_check_interval = min(max(self.max_check_interval, base_check_interval),
+                                             max(check_interval * self.check_interval_backoff, base_check_interval))
+
+            if adapted_check_interval != check_interval:
+                self.adapted_check_intervals[subgraph['name']] = adapted_check_interval
+                next_check_time = self.checked_at.get(subgraph['name'], time.monotonic()) + adapted_check_interval + \
+                    random.uniform(0, adapted_check_interval * self.jitter)
+                self.schedule[position] = (next_check_time, index, subgraph)
+                rescheduled = True
+
+        if rescheduled:
+            heapq.heapify(self.schedule)
+
+    def pop_due_subgraphs(self) -> list:
+        """
+        Remove from the schedule the subgraphs that must be checked now and schedule their next check
+        :return: list. Subgraphs to check
+        """
+
+        due_subgraphs = []
+        now = time.monotonic()
+
+        while self.schedule and self.schedule[0][0] <= now + self.coalesce_window:
+            _, index, subgraph = heapq.heappop(self.schedule)
+            due_subgraphs.append((index, subgraph))
+
+        for index, subgraph in due_subgraphs:
+            self.checked_at[subgraph['name']] = now
+            check_interval = self.get_subgraph_check_interval(subgraph)
+            next_check_time = now + check_interval + random.uniform(0, check_interval * self.jitter)
+            heapq.heappush(self.schedule, (next_check_time, index, subgraph))
+
+        return [subgraph for _, subgraph in due_subgraphs]
+
+    def run(self, check_function, get_subgraphs_function=None,
+            subgraphs_refresh_interval: float = SUBGRAPHS_REFRESH_INTERVAL):
+        """
+        Check subgraphs when they are due until the scheduler is stopped
+        :param check_function: function that receives the list of subgraphs to check
+        :param get_subgraphs_function: function that returns the subgraphs to monitor (e.g. after config reloads)
+        :param subgraphs_refresh_interval: float. Max seconds between calls to `get_subgraphs_function`
+        """
+
+        subgraphs_refreshed_at = time.monotonic()
+
+        while not self.stop_event.is_set():
+            if get_subgraphs_function and time.monotonic() - subgraphs_refreshed_at >= subgraphs_refresh_interval:
+                try:
+                    self.update_subgraphs(get_subgraphs_function())
+                except Exception as exception:
+                    logging.error(f'Exception when updating monitored subgraphs. Exception: {exception}')
+                subgraphs_refreshed_at = time.monotonic()
+
+            due_subgraphs = self.pop_due_subgraphs()
+
+            if due_subgraphs:
+                try:
+                    check_function(due_subgraphs)
+                except Exception as exception:
+                    # The daemon must keep running, next checks could work
+                    logging.error(f'Exception when checking subgraphs. Exception: {exception}')
+
+                self.apply_evaluations()
+
+            # Sleep until the next check, the next refresh of subgraphs or until the scheduler is stopped
+            wait_time = self.schedule[0][0] - time.monotonic() if self.schedule else None
+            if get_subgraphs_function:
+                refresh_wait_time = subgraphs_refreshed_at + subgraphs_refresh_interval - time.monotonic()
+                wait_time = min(wait_time, refresh_wait_time) if wait_time is not None else refresh_wait_time
+            self.stop_event.wait(max(0, wait_time) if wait_time is not None else None)
+
+    def stop(self):
+        """
+        Stop the scheduler. The check in progress (if any) is finished
+        """
+
+        self.stop_event.set()
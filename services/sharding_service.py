@@ -0,0 +1,199 @@
+import contextlib
+import fcntl
+import functools
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+# Shard of this replica and number of replicas. Each replica only checks the subgraphs of its shard
+# (by default 0 and 1, all subgraphs)
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', 0))
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 1))
+assert (0 <= SHARD_INDEX < SHARD_COUNT), 'SHARD_INDEX must be between 0 and SHARD_COUNT - 1'
+
+# Directory shared by the replicas where shard leases are stored (by default disabled).
+# A shard is only checked by the replica that holds its lease, so two replicas with the same `SHARD_INDEX`
+# never notify the same subgraphs
+SHARD_LEASE_DIR = os.environ.get('SHARD_LEASE_DIR', '')
+
+# Seconds that a lease is valid if it is not renewed (by default 120)
+SHARD_LEASE_TTL = float(os.environ.get('SHARD_LEASE_TTL', 120))
+
+# Files of `SHARD_LEASE_DIR` with the leases of all replicas and the lock that all replicas take to change them
+SHARD_LEASES_FILE_NAME = 'shards.lease'
+SHARD_LEASES_LOCK_FILE_NAME = 'shards.lock'
+
+
+@functools.lru_cache(maxsize=None)
+def get_subgraph_shard(subgraph_name: str, shard_count: int) -> int:
+    """
+    Get the shard of a subgraph with rendezvous hashing: the shard with the highest hash of (shard, subgraph name).
+    When the number of shards changes, only the subgraphs of the added or removed shards are moved
+    :param subgraph_name: str
+    :param shard_count: int
+    :return: int
+    """
+
+    return max(range(shard_count),
+               key=lambda shard: hashlib.md5(f'{shard}:{subgraph_name}'.encode()).digest())
+
+
+class ShardService:
+    def __init__(self, shard_index: int = SHARD_INDEX, shard_count: int = SHARD_COUNT,
+                 lease_dir: str = SHARD_LEASE_DIR, lease_ttl: float = SHARD_LEASE_TTL):
+        """
+        :param shard_index: int. Shard of this replica
+        :param shard_count: int. Number of replicas
+        :param lease_dir: str. Directory shared by the replicas where shard leases are stored (empty disables them)
+        :param lease_ttl: float. Seconds that a lease is valid if it is not renewed
+        """
+
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.lease_ttl = lease_ttl
+        self.lease_dir = lease_dir
+        # Replica that holds the lease
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.has_lease = False
+
+    def get_shard_subgraphs(self, subgraphs: list) -> list:
+        """
+        Get the subgraphs of this shard
+        :param subgraphs: list
+        :return: list
+        """
+
+        if self.shard_count == 1:
+            return subgraphs
+
+        return [subgraph for subgraph in subgraphs
+                if get_subgraph_shard(subgraph['name'], self.shard_count) == self.shard_index]
+
+    @contextlib.contextmanager
+    def _lock_leases(self):
+        """
+        Exclusive lock of the leases of all replicas. It is released if the replica dies
+        """
+
+        file_descriptor = os.open(os.path.join(self.lease_dir, SHARD_LEASES_LOCK_FILE_NAME), os.O_RDWR | os.O_CREAT,
+                                  0o644)
+        try:
+            fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Closing the file releases the lock
+            os.close(file_descriptor)
+
+    def _read_leases(self) -> dict:
+        """
+        :return: dict. {owner: {'shard_index': int, 'shard_count': int, 'expires_at': float}}
+        """
+
+        try:
+            with open(os.path.join(self.lease_dir, SHARD_LEASES_FILE_NAME)) as file:
+                leases = json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+        return leases if isinstance(leases, dict) else {}
+
+    def _write_leases(self, leases: dict):
+        leases_file = os.path.join(self.lease_dir, SHARD_LEASES_FILE_NAME)
+        temporary_leases_file = f'{leases_file}.{os.getpid()}'
+        with open(temporary_leases_file, 'w') as file:
+            json.dump(leases, file)
+        os.replace(temporary_leases_file, leases_file)
+
+    def _is_overlapping(self, lease: dict) -> bool:
+        """
+        :return: bool. True if the shard of a lease can have subgraphs of the shard of this replica: the same shard,
+        or any shard of another number of shards (e.g. replicas of a previous `SHARD_COUNT` during a deployment)
+        """
+
+        return lease.get('shard_count') != self.shard_count or lease.get('shard_index') == self.shard_index
+
+    def acquire_lease(self) -> bool:
+        """
+        Acquire or renew the lease of this shard. It can only be acquired if no other replica holds a lease
+        that is not expired and whose subgraphs can overlap with the ones of this shard (see `_is_overlapping`).
+        Leases of all replicas are read and written holding a lock shared by all of them, so only one replica
+        can acquire the same subgraphs
+        :return: bool. True if leases are disabled or this replica holds the lease
+        """
+
+        if not self.lease_dir:
+            return True
+
+        try:
+            with self._lock_leases():
+                now = time.time()
+                # Expired leases are removed
+                leases = {owner: lease for owner, lease in self._read_leases().items()
+                          if isinstance(lease, dict) and lease.get('expires_at', 0) > now}
+
+                overlapping_owners = [owner for owner, lease in leases.items()
+                                      if owner != self.owner and self._is_overlapping(lease)]
+                if overlapping_owners:
+                    if self.has_lease:
+                        logging.error(f'Lease of shard {self.shard_index} was taken by {", ".join(overlapping_owners)}')
+                    self.has_lease = False
+                    return False
+
+                leases[self.owner] = {'shard_index': self.shard_index, 'shard_count': self.shard_count,
+                                      'expires_at': now + self.lease_ttl}
+                self._write_leases(leases)
+        except OSError as exception:
+            logging.error(f'Lease of shard {self.shard_index} could not be written. Exception: {exception}')
+            self.has_lease = False
+            return False
+
+        if not self.has_lease:
+            logging.info(f'Lease of shard {self.shard_index} acquired by {self.owner}')
+        self.has_lease = True
+
+        return True
+
+    @contextlib.contextmanager
+    def renewing_lease(self):
+        """
+        Renew the lease in a background thread every third of `lease_ttl` while the context is active, so that it
+        does not expire during checks that last longer than it (see `SWEEP_TIMEOUT`)
+        """
+
+        if not self.lease_dir:
+            yield
+            return
+
+        stopped = threading.Event()
+
+        def renew_lease():
+            while not stopped.wait(self.lease_ttl / 3):
+                self.acquire_lease()
+
+        renewal_thread = threading.Thread(target=renew_lease, name='shard-lease-renewal', daemon=True)
+        renewal_thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            renewal_thread.join()
+
+    def release_lease(self):
+        """
+        Release the lease of this shard so that another replica can acquire it without waiting for it to expire
+        """
+
+        if self.lease_dir and self.has_lease:
+            try:
+                with self._lock_leases():
+                    leases = self._read_leases()
+                    if leases.pop(self.owner, None) is not None:
+                        self._write_leases(leases)
+            except OSError as exception:
+                logging.error(f'Lease of shard {self.shard_index} could not be released. Exception: {exception}')
+
+        self.has_lease = False
@@ -0,0 +1,305 @@
+import collections
+import datetime
+import email.utils
+import logging
+import os
+import threading
+import time
+
+from .http_service import HttpProvider, redact_url
+from .metrics_service import MetricsProvider
+from .tracing_service import TracingProvider
+
+# Max number of notifications waiting to be sent (by default 1000)
+SLACK_QUEUE_SIZE = int(os.environ.get('SLACK_QUEUE_SIZE', 1000))
+
+# Notifications dropped when the queue is full: `oldest` or `newest` (by default `oldest`)
+SLACK_DROP_POLICY = os.environ.get('SLACK_DROP_POLICY', 'oldest').lower()
+assert (SLACK_DROP_POLICY in ['oldest', 'newest']), 'SLACK_DROP_POLICY is not valid'
+
+# Number of threads sending notifications to Slack (by default 4)
+SLACK_MAX_CONCURRENCY = int(os.environ.get('SLACK_MAX_CONCURRENCY', 4))
+
+# Max number of attempts to send a notification, including rate limited ones (by default 3)
+SLACK_MAX_ATTEMPTS = int(os.environ.get('SLACK_MAX_ATTEMPTS', 3))
+
+# Slack does not accept messages with more than 50 blocks
+SLACK_MAX_BLOCKS_PER_MESSAGE = 50
+
+# Seconds to wait before retrying a failed notification when Slack does not send `Retry-After`
+SLACK_RETRY_DELAY = 1
+
+
+class SlackNotifierService:
+    def __init__(self, queue_size: int = SLACK_QUEUE_SIZE, drop_policy: str = SLACK_DROP_POLICY,
+                 workers: int = SLACK_MAX_CONCURRENCY, max_attempts: int = SLACK_MAX_ATTEMPTS):
+        """
+        Notifications are queued and sent by background threads, so checks never wait for Slack.
+        Notifications queued for the same incoming webhook are sent together in one message and
+        `Retry-After` of rate limited (HTTP 429) responses is honoured.
+        A notification with the same key as one that is queued or being sent is not queued again, so checks that run
+        while a notification is waiting for Slack do not send it twice
+        :param queue_size: int. Max number of notifications waiting to be sent
+        :param drop_policy: str. Notifications dropped when the queue is full (`oldest` or `newest`)
+        :param workers: int. Number of threads sending notifications
+        :param max_attempts: int. Max number of attempts to send a notification
+        """
+
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.max_attempts = max_attempts
+
+        # Queued notifications: (incoming webhook, slack message, on delivered callback, key, attempts)
+        self.queue = collections.deque()
+        # Keys of the notifications that are queued or being sent
+        self.pending_keys = set()
+        # Number of notifications that are being sent
+        self.in_flight = 0
+        # {incoming webhook: monotonic time until it must not be requested}
+        self.webhooks_retry_after = {}
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.workers = [threading.Thread(target=self._work, name=f'slack-{index}', daemon=True)
+                        for index in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def notify(self, slack_incoming_webhook: str, slack_message: dict, on_delivered=None, key=None) -> bool:
+        """
+        Queue a notification. It never blocks
+        :param slack_incoming_webhook: str
+        :param slack_message: dict. Message built with `slack_templates`
+        :param on_delivered: function called without arguments when Slack accepts the notification
+        :param key: hashable. Notification is not queued if another one with the same key is pending (e.g.
+        (subgraph name, version, is ok))
+        :return: bool. False if the notification has been dropped because the queue is full
+        """
+
+        with self.condition:
+            if key is not None:
+                if key in self.pending_keys:
+                    logging.debug(f'Slack notification {key} is already pending')
+                    return True
+                self.pending_keys.add(key)
+
+            notification = (slack_incoming_webhook, slack_message, on_delivered, key, 0)
+
+            if len(self.queue) >= self.queue_size:
+                if self.drop_policy == 'newest':
+                    self._drop(notification, 'Slack notifications queue is full')
+                    return False
+
+                self._drop(self.queue.popleft(), 'Slack notifications queue is full')
+
+            self.queue.append(notification)
+            self.condition.notify()
+
+        return True
+
+    def _drop(self, notification: tuple, reason: str):
+        """
+        Discard a notification that is not going to be sent.
+        It must be called holding `self.condition`
+        """
+
+        self.pending_keys.discard(notification[3])
+        logging.warning(f'{reason}. Notification to {redact_url(notification[0])} dropped')
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until all queued notifications have been sent (or dropped)
+        :param timeout: float. Max seconds to wait
+        :return: bool. False if there are notifications not sent yet after the timeout
+        """
+
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.in_flight, timeout)
+
+    def stop(self):
+        """
+        Stop the threads. Queued notifications are not sent
+        """
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def _pop_notifications(self) -> list:
+        """
+        Take the oldest notification whose webhook is not rate limited,
+        and the other queued notifications to the same webhook that fit in one message.
+        It must be called holding `self.condition`
+        :return: list. Empty if all queued notifications are rate limited
+        """
+
+        now = time.monotonic()
+
+        for notification in self.queue:
+            if self.webhooks_retry_after.get(notification[0], 0) <= now:
+                slack_incoming_webhook = notification[0]
+                break
+        else:
+            return []
+
+        notifications = []
+        blocks = 0
+        remaining_notifications = collections.deque()
+
+        for notification in self.queue:
+            notification_blocks = len(notification[1].get('blocks', [])) + 1
+            if notification[0] == slack_incoming_webhook and \
+                    (not notifications or blocks + notification_blocks <= SLACK_MAX_BLOCKS_PER_MESSAGE):
+                notifications.append(notification)
+                blocks += notification_blocks
+            else:
+                remaining_notifications.append(notification)
+
+        self.queue = remaining_notifications
+
+        return notifications
+
+    def _work(self):
+        while True:
+            with self.condition:
+                notifications = []
+                while not self.stopped and not notifications:
+                    notifications = self._pop_notifications()
+
+                    if not notifications:
+                        # Wait for new notifications or until the first rate limited webhook can be requested again
+                        retry_times = [self.webhooks_retry_after.get(notification[0], 0)
+                                       for notification in self.queue]
+                        self.condition.wait(max(0, min(retry_times) - time.monotonic()) if retry_times else None)
+
+                if self.stopped:
+                    return
+
+                self.in_flight += len(notifications)
+
+            try:
+                self._send(notifications)
+            finally:
+                with self.condition:
+                    self.in_flight -= len(notifications)
+                    self.condition.notify_all()
+
+    def _send(self, notifications: list):
+        """
+        Send several notifications to the same webhook in one message. Failed notifications are queued again
+        :param notifications: list. Popped by `_pop_notifications`
+        """
+
+        slack_incoming_webhook = notifications[0][0]
+        slack_message = merge_slack_messages([notification[1] for notification in notifications])
+
+        retry_after = None
+        try:
+            # Incoming webhooks are secret, so they are not added to the span
+            with MetricsProvider().time('subgraph_monitor_stage_duration_seconds', stage='slack_delivery'), \
+                    TracingProvider().span('slack_delivery', notifications=len(notifications)):
+                response = HttpProvider().post(url=slack_incoming_webhook, json=slack_message, timeout=2)
+
+            if response.status_code == 200:
+                try:
+                    for notification in notifications:
+                        if notification[2]:
+                            notification[2]()
+                finally:
+                    # Keys are released once the notified state is stored, so the next check does not notify it again
+                    with self.condition:
+                        for notification in notifications:
+                            self.pending_keys.discard(notification[3])
+                return
+
+            logging.error(f'Slack responded with status code {response.status_code}')
+            if response.status_code == 429:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        except Exception as exception:
+            logging.error(f'Exception when sending Slack notification. Exception: {exception}')
+
+        with self.condition:
+            self.webhooks_retry_after[slack_incoming_webhook] = time.monotonic() + (retry_after or SLACK_RETRY_DELAY)
+
+            # Failed notifications are queued first so that they keep their order
+            for notification in reversed(notifications):
+                attempts = notification[4] + 1
+                if attempts >= self.max_attempts:
+                    self._drop(notification, f'Slack notification could not be sent after {attempts} attempts')
+                    continue
+
+                if len(self.queue) >= self.queue_size:
+                    # Failed notifications are the oldest ones
+                    if self.drop_policy == 'oldest':
+                        self._drop(notification, 'Slack notifications queue is full')
+                        continue
+                    self._drop(self.queue.pop(), 'Slack notifications queue is full')
+
+                self.queue.appendleft(notification[:4] + (attempts,))
+
+
+def parse_retry_after(retry_after) -> float:
+    """
+    Parse the `Retry-After` header, which can be a number of seconds or an HTTP date
+    :param retry_after: str or None
+    :return: float. Seconds to wait (`SLACK_RETRY_DELAY` if it is missing or not valid)
+    """
+
+    if not retry_after:
+        return SLACK_RETRY_DELAY
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        logging.warning(f'Retry-After header {retry_after} is not valid')
+        return SLACK_RETRY_DELAY
+
+    # Dates without timezone are in UTC
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def merge_slack_messages(slack_messages: list) -> dict:
+    """
+    Merge several messages built with `slack_templates` into one message
+    :param slack_messages: list
+    :return: dict
+    """
+
+    if len(slack_messages) == 1:
+        return slack_messages[0]
+
+    blocks = []
+    for slack_message in slack_messages:
+        if blocks:
+            blocks.append({'type': 'divider'})
+        blocks.extend(slack_message.get('blocks', []))
+
+    return {
+        'text': f'{len(slack_messages)} subgraph notifications',
+        'blocks': blocks
+    }
+
+
+class SlackNotifierProvider:
+    # Several threads can request the singleton at the same time and it must be created only once
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = SlackNotifierService()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            cls.instance.stop()
+            del cls.instance
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.parse
+
+# Port of the HTTP/JSON API that serves the latest evaluated status of each subgraph. It is only started in
+# daemon mode (by default 0, disabled)
+STATUS_API_PORT = int(os.environ.get('STATUS_API_PORT', 0))
+
+
+def get_etag(body: bytes) -> str:
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def is_etag_matched(if_none_match, etag: str) -> bool:
+    """
+    :param if_none_match: str. `If-None-Match` header or None
+    :param etag: str
+    :return: bool. True if the client already has the representation with `etag`
+    """
+
+    if not if_none_match:
+        return False
+
+    etags = [client_etag.strip() for client_etag in if_none_match.split(',')]
+    # Weak comparison, as required for `If-None-Match`
+    return '*' in etags or etag in etags or f'W/{etag}' in etags
+
+
+class StatusApiService:
+    def __init__(self, enabled: bool = bool(STATUS_API_PORT)):
+        """
+        Latest evaluated status of each subgraph, served over HTTP without any request to the status endpoints.
+        Each status is serialized once when it is updated, so reads only copy bytes. When the API is not enabled,
+        updates do nothing
+        :param enabled: bool
+        """
+
+        self.enabled = enabled
+        # {subgraph name: (JSON body, ETag)}
+        self.statuses = {}
+        # Bulk response of all subgraphs. It is built again on the first read after an update
+        self.bulk_response = None
+        # Incremented on each change of `statuses`, so that an outdated bulk response is never cached
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.http_server = None
+
+    def update(self, subgraph_name: str, status: dict):
+        """
+        :param subgraph_name: str
+        :param status: dict. JSON serializable status of the subgraph
+        """
+
+        if not self.enabled:
+            return
+
+        body = json.dumps(status, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        with self.lock:
+            self.statuses[subgraph_name] = (body, get_etag(body))
+            self.bulk_response = None
+            self.generation += 1
+
+    def retain(self, subgraph_names):
+        """
+        Remove statuses of subgraphs that are not monitored anymore
+        :param subgraph_names: iterable
+        """
+
+        subgraph_names = set(subgraph_names)
+        with self.lock:
+            removed_subgraph_names = [subgraph_name for subgraph_name in self.statuses
+                                      if subgraph_name not in subgraph_names]
+            for subgraph_name in removed_subgraph_names:
+                del self.statuses[subgraph_name]
+            if removed_subgraph_names:
+                self.bulk_response = None
+                self.generation += 1
+
+    def get_subgraph_response(self, subgraph_name: str):
+        """
+        :return: tuple. (JSON body, ETag) or None if the subgraph has not been checked
+        """
+
+        return self.statuses.get(subgraph_name)
+
+    def get_bulk_response(self, subgraph_names: list = None) -> tuple:
+        """
+        Get the statuses of several subgraphs in one response: `{"subgraphs": [...]}`, sorted by name
+        :param subgraph_names: list. By default all checked subgraphs. Subgraphs not checked are not included
+        :return: tuple. (JSON body, ETag)
+        """
+
+        with self.lock:
+            if not subgraph_names and self.bulk_response:
+                return self.bulk_response
+
+            generation = self.generation
+            responses = [self.statuses[subgraph_name] for subgraph_name in sorted(subgraph_names or self.statuses)
+                         if subgraph_name in self.statuses]
+
+        body = b'{"subgraphs":[' + b','.join(body for body, _ in responses) + b']}'
+        # ETag of the bulk response only depends on the ETags of its statuses
+        etag = get_etag(''.join(etag for _, etag in responses).encode('utf-8'))
+
+        if not subgraph_names:
+            with self.lock:
+                if generation == self.generation:
+                    self.bulk_response = (body, etag)
+
+        return body, etag
+
+    def start_server(self, port: int = STATUS_API_PORT):
+        """
+        Serve statuses from a background thread:
+        `GET /subgraphs` (all subgraphs, or only the ones of `?name=` parameters) and `GET /subgraphs/<name>`.
+        Responses have an ETag, and requests with a matching `If-None-Match` get `304 Not Modified`
+        """
+
+        # Only the daemon serves statuses, so one-shot runs do not import it
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        status_api_service = self
+
+        class StatusApiRequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                path = url.path.rstrip('/')
+
+                if path == '/subgraphs':
+                    subgraph_names = urllib.parse.parse_qs(url.query).get('name')
+                    response = status_api_service.get_bulk_response(subgraph_names)
+                elif path.startswith('/subgraphs/'):
+                    # Subgraph names contain `/`, so they can be sent quoted or not
+                    response = status_api_service.get_subgraph_response(
+                        urllib.parse.unquote(path[len('/subgraphs/'):]))
+                else:
+                    response = None
+
+                if response is None:
+                    self.send_error(404)
+                    return
+
+                body, etag = response
+                if is_etag_matched(self.headers.get('If-None-Match'), etag):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                # Clients must revalidate, statuses change after each check
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.http_server = ThreadingHTTPServer(('0.0.0.0', port), StatusApiRequestHandler)
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, name='status-api', daemon=True).start()
+        logging.info(f'Subgraph statuses served in port {port}')
+
+    def stop_server(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server = None
+
+
+class StatusApiProvider:
+    # Several threads can request the singleton at the same time
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = StatusApiService()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            cls.instance.stop_server()
+            del cls.instance
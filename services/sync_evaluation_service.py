@@ -0,0 +1,280 @@
+import array
+import itertools
+import logging
+import operator
+import os
+
+from .infura_service import InfuraProvider, InfuraEndpointUnavailableException, InfuraNetworkNotSupported, \
+    InfuraTokenNotDefinedException
+from .metrics_service import MetricsProvider
+from .tracing_service import TracingProvider
+
+# Blocks of difference with the chain head to consider a subgraph out of sync (by default 15)
+BLOCKS_TO_CONSIDER_OUT_OF_SYNC = int(os.environ.get('BLOCKS_TO_CONSIDER_OUT_OF_SYNC', 15))
+
+# Blocks of difference with the chain head to consider a subgraph out of sync in specific networks, with format
+# `network=blocks,network=blocks`. Networks with faster blocks need bigger thresholds (e.g. `xdai=60`)
+NETWORKS_BLOCKS_TO_CONSIDER_OUT_OF_SYNC = {network.strip().lower(): int(blocks) for network, blocks in (
+    network_blocks.strip().rsplit('=', 1)
+    for network_blocks in os.environ.get('NETWORKS_BLOCKS_TO_CONSIDER_OUT_OF_SYNC', '').split(',')
+    if network_blocks.strip())}
+
+# How `synced` status of CURRENT versions is checked (by default `status`):
+# - `status`: using the chain head block returned by the status endpoint (Infura is only used as fallback)
+# - `rpc`: always using Infura latest block numbers
+# In both modes, the chain head block returned by the status endpoint is used when Infura is unavailable
+SYNC_EVALUATION_MODE = os.environ.get('SYNC_EVALUATION_MODE', 'status').lower()
+assert (SYNC_EVALUATION_MODE in ['status', 'rpc']), 'SYNC_EVALUATION_MODE is not valid'
+
+# In `status` mode, Infura is requested when the lag with the status endpoint chain head reaches this number of blocks
+# or the out of sync threshold of the network (by default 15). So subgraphs are only reported as out of sync when
+# Infura confirms it (or can not be requested)
+CHAIN_HEAD_DISAGREEMENT_THRESHOLD = int(os.environ.get('CHAIN_HEAD_DISAGREEMENT_THRESHOLD', 15))
+
+# Block number of unknown blocks in the columns
+UNKNOWN_BLOCK = -1
+
+# Sync verdicts
+NOT_SYNCED = 0
+SYNCED = 1
+UNKNOWN = 2
+
+
+def get_blocks_to_consider_out_of_sync(network: str) -> int:
+    """
+    :param network: str
+    :return: int. Out of sync threshold of the network
+    """
+
+    return NETWORKS_BLOCKS_TO_CONSIDER_OUT_OF_SYNC.get(network.lower(), BLOCKS_TO_CONSIDER_OUT_OF_SYNC)
+
+
+class ChainSyncStatus:
+    # Slots avoid a dict per object, as there are thousands of them
+    __slots__ = ('network', 'latest_block_number', 'chain_head_block_number', 'block_lag',
+                 'blocks_to_consider_out_of_sync', 'is_synced')
+
+    def __init__(self, network: str, latest_block_number, chain_head_block_number, block_lag,
+                 blocks_to_consider_out_of_sync: int, is_synced):
+        """
+        Evaluated sync status of a subgraph version in one chain
+        :param network: str. Lowercase
+        :param latest_block_number: int or None if no block has been indexed yet
+        :param chain_head_block_number: int or None if it is unknown
+        :param block_lag: int or None if the chain head is unknown
+        :param blocks_to_consider_out_of_sync: int. Threshold of the network
+        :param is_synced: bool or None if the chain head is unknown
+        """
+
+        self.network = network
+        self.latest_block_number = latest_block_number
+        self.chain_head_block_number = chain_head_block_number
+        self.block_lag = block_lag
+        self.blocks_to_consider_out_of_sync = blocks_to_consider_out_of_sync
+        self.is_synced = is_synced
+
+
+class SyncEvaluation:
+    def __init__(self, networks: list, network_ids: array.array, latest_block_numbers: array.array,
+                 chain_head_block_numbers: array.array, block_lags: array.array, verdicts: bytearray, rows: dict):
+        """
+        Sync status of all chains of a set of subgraph versions, stored as columns with one row per
+        (subgraph version, chain). Records of a subgraph are only built when they are read
+        :param networks: list. Network of each network ID
+        :param network_ids: array.array
+        :param latest_block_numbers: array.array. `UNKNOWN_BLOCK` if no block has been indexed yet
+        :param chain_head_block_numbers: array.array. `UNKNOWN_BLOCK` if it is unknown
+        :param block_lags: array.array. Not valid when the chain head is unknown
+        :param verdicts: bytearray. `SYNCED`, `NOT_SYNCED` or `UNKNOWN`
+        :param rows: dict. {(subgraph name, version): (first row, last row + 1)}
+        """
+
+        self.networks = networks
+        self.network_ids = network_ids
+        self.latest_block_numbers = latest_block_numbers
+        self.chain_head_block_numbers = chain_head_block_numbers
+        self.block_lags = block_lags
+        self.verdicts = verdicts
+        self.rows = rows
+
+    def get_chains(self, subgraph_name: str, version: str) -> list:
+        """
+        :param subgraph_name: str
+        :param version: str. `current` or `pending`
+        :return: list. ChainSyncStatus of each chain of the version (empty if the version does not exist)
+        """
+
+        chains = []
+        start, end = self.rows.get((subgraph_name, version), (0, 0))
+        for row in range(start, end):
+            network = self.networks[self.network_ids[row]]
+            latest_block_number = self.latest_block_numbers[row]
+            is_known = self.chain_head_block_numbers[row] != UNKNOWN_BLOCK
+            chains.append(ChainSyncStatus(
+                network=network,
+                latest_block_number=None if latest_block_number == UNKNOWN_BLOCK else latest_block_number,
+                chain_head_block_number=self.chain_head_block_numbers[row] if is_known else None,
+                block_lag=self.block_lags[row] if is_known else None,
+                blocks_to_consider_out_of_sync=get_blocks_to_consider_out_of_sync(network),
+                is_synced=self.verdicts[row] == SYNCED if is_known else None))
+
+        return chains
+
+    def is_synced(self, subgraph_name: str, version: str = 'current'):
+        """
+        A version is synced when all its chains are synced
+        :return: bool or None if it is not known (some chain heads are unknown and the other chains are synced)
+        """
+
+        start, end = self.rows.get((subgraph_name, version), (0, 0))
+        verdicts = self.verdicts[start:end]
+
+        if NOT_SYNCED in verdicts:
+            return False
+        if UNKNOWN in verdicts:
+            return None
+
+        return True
+
+    def get_block_lag(self, subgraph_name: str, version: str):
+        """
+        :return: int. Lag of the chain that is most behind or None if no chain head is known
+        """
+
+        start, end = self.rows.get((subgraph_name, version), (0, 0))
+        block_lags = [block_lag for block_lag, chain_head_block_number in zip(self.block_lags[start:end],
+                                                                             self.chain_head_block_numbers[start:end])
+                      if chain_head_block_number != UNKNOWN_BLOCK]
+
+        return max(block_lags) if block_lags else None
+
+
+def _get_rpc_latest_block_numbers(networks: list, deadline: float = None) -> dict:
+    """
+    Latest block numbers of several networks from Infura (or the RPC urls of `RPC_URLS`)
+    :param networks: list
+    :param deadline: float. `time.monotonic()` time after which RPC urls are not requested
+    :return: dict. {network: latest block number}. Networks that are not supported or whose RPC url is unavailable
+    are not included
+    """
+
+    if not networks:
+        return {}
+
+    try:
+        infura_service = InfuraProvider()
+    except InfuraTokenNotDefinedException:
+        logging.debug('No RPC url is defined. Using the chain head blocks of the status endpoint')
+        return {}
+
+    try:
+        infura_service.prefetch_latest_block_numbers(networks, deadline)
+    except Exception as exception:
+        # Networks are requested again one by one
+        logging.debug(f'Latest block numbers could not be prefetched. Exception: {exception}')
+
+    latest_block_numbers = {}
+    for network in networks:
+        try:
+            latest_block_numbers[network] = infura_service.get_latest_block_number_of_network(network, deadline)
+        except InfuraNetworkNotSupported:
+            logging.error(f'Network {network} is not supported. Define its RPC url in `RPC_URLS` to check if its '
+                          f'subgraphs are synced')
+        except InfuraEndpointUnavailableException:
+            logging.warning(f'Latest block number of {network} could not be requested. Using the chain head block of '
+                            f'the status endpoint')
+
+    return latest_block_numbers
+
+
+def evaluate_subgraphs_sync(subgraphs_statuses: dict, mode: str = SYNC_EVALUATION_MODE,
+                            deadline: float = None) -> SyncEvaluation:
+    """
+    Evaluate if all chains of CURRENT and PENDING versions of several subgraphs are synced.
+    Latest blocks, chain heads and networks are gathered into columns, and lags and verdicts are computed over whole
+    columns, so the cost of each (subgraph version, chain) row is the same with any number of subgraphs and chains.
+    CURRENT versions use the chain heads of `mode` (each network is requested to Infura only once), and PENDING ones
+    the chain heads of the status endpoint
+    :param subgraphs_statuses: dict. Statuses fetched with `fetch_subgraphs_statuses_batch`
+    :param mode: str. `status` or `rpc` (see `SYNC_EVALUATION_MODE`)
+    :param deadline: float. `time.monotonic()` time after which Infura is not requested
+    :return: SyncEvaluation
+    """
+
+    # Chain of each row
+    chains = []
+    # 1 in rows of CURRENT versions
+    is_current = bytearray()
+    rows = {}
+
+    for subgraph_name, subgraph_statuses in subgraphs_statuses.items():
+        for version in ('current', 'pending'):
+            subgraph_status = subgraph_statuses.get(version)
+            if not subgraph_status:
+                continue
+
+            start = len(chains)
+            chains += subgraph_status.chains
+            rows[(subgraph_name, version)] = (start, len(chains))
+            is_current += bytes([version == 'current']) * (len(chains) - start)
+
+    # {network: network ID}
+    network_ids_by_network = {}
+    network_ids = array.array('l', [
+        network_ids_by_network.setdefault(chain.network.lower(), len(network_ids_by_network)) for chain in chains])
+    latest_block_numbers = array.array('q', [UNKNOWN_BLOCK if chain.latest_block_number is None
+                                             else chain.latest_block_number for chain in chains])
+    status_chain_head_block_numbers = array.array('q', [UNKNOWN_BLOCK if chain.chain_head_block_number is None
+                                                        else chain.chain_head_block_number for chain in chains])
+
+    networks = list(network_ids_by_network)
+    thresholds_by_network_id = [get_blocks_to_consider_out_of_sync(network) for network in networks]
+
+    with TracingProvider().span('sync_evaluation', rows=len(latest_block_numbers), networks=len(networks)):
+        # Versions that have not indexed any block yet are behind the whole chain
+        indexed_block_numbers = array.array('q', map(max, latest_block_numbers, itertools.repeat(0)))
+        status_block_lags = array.array('q', map(operator.sub, status_chain_head_block_numbers, indexed_block_numbers))
+
+        # Rows of CURRENT versions whose chain head is requested to Infura
+        if mode == 'rpc':
+            is_rpc_checked = is_current
+        else:
+            disagreement_thresholds_by_network_id = [max(CHAIN_HEAD_DISAGREEMENT_THRESHOLD, threshold)
+                                                     for threshold in thresholds_by_network_id]
+            is_rpc_checked = bytearray(
+                current and (chain_head_block_number == UNKNOWN_BLOCK or block_lag >= disagreement_threshold)
+                for current, chain_head_block_number, block_lag, disagreement_threshold in zip(
+                    is_current, status_chain_head_block_numbers, status_block_lags,
+                    map(disagreement_thresholds_by_network_id.__getitem__, network_ids)))
+
+            rpc_checked_rows = is_rpc_checked.count(1)
+            if rpc_checked_rows:
+                logging.debug(f'{rpc_checked_rows} chains have a missing chain head block or too far from their '
+                              f'latest block. Checking them against Infura')
+                MetricsProvider().inc_counter('subgraph_monitor_infura_fallbacks_total', rpc_checked_rows,
+                                              reason='chain_head_check')
+
+        # Latest block number of each network ID (only for the networks of checked rows)
+        rpc_chain_head_block_numbers = array.array('q', [UNKNOWN_BLOCK]) * len(networks)
+        rpc_networks = {networks[network_id] for network_id, is_checked in zip(network_ids, is_rpc_checked)
+                        if is_checked}
+        for network, latest_block_number in _get_rpc_latest_block_numbers(sorted(rpc_networks), deadline).items():
+            rpc_chain_head_block_numbers[network_ids_by_network[network]] = latest_block_number
+
+        # Chain heads of the status endpoint are used when Infura is unavailable or not configured
+        chain_head_block_numbers = array.array('q', [
+            rpc_chain_head_block_number if is_checked and rpc_chain_head_block_number != UNKNOWN_BLOCK
+            else status_chain_head_block_number
+            for is_checked, rpc_chain_head_block_number, status_chain_head_block_number in zip(
+                is_rpc_checked, map(rpc_chain_head_block_numbers.__getitem__, network_ids),
+                status_chain_head_block_numbers)])
+        block_lags = array.array('q', map(operator.sub, chain_head_block_numbers, indexed_block_numbers))
+
+        thresholds = map(thresholds_by_network_id.__getitem__, network_ids)
+
+        verdicts = bytearray(UNKNOWN if chain_head_block_number == UNKNOWN_BLOCK else is_synced
+                             for chain_head_block_number, is_synced in zip(chain_head_block_numbers,
+                                                                           map(operator.lt, block_lags, thresholds)))
+
+    return SyncEvaluation(networks, network_ids, latest_block_numbers, chain_head_block_numbers, block_lags, verdicts,
+                          rows)
@@ -1,13 +1,15 @@
+import functools
 import logging
 import os
 
-# Operation generates valid queries, which can be printed out and properly indented.
-# Bonus point is that it can be used to later interpret the JSON results into native Python objects.
-from sgqlc.operation import Operation
-from sgqlc.endpoint.http import HTTPEndpoint
-from graphql_schemas.subgraph_status_schema import subgraph_status_schema
-
-from .infura_service import InfuraProvider, InfuraEndpointUnavailableException
+from .circuit_breaker_service import CircuitBreakerProvider, CircuitOpenException
+from .concurrency_service import HostConcurrencyLimiterProvider, RequestBudgetProvider
+from .http_service import HttpProvider
+from .infura_service import InfuraEndpointUnavailableException
+from .metrics_service import MetricsProvider
+from .retry_service import DeadlineExceededException, call_with_retries, get_remaining_time
+from .sync_evaluation_service import evaluate_subgraphs_sync
+from .tracing_service import TracingProvider
 
 # Read log level as environment variable (by default INFO)
 LOGLEVEL = os.environ.get('LOGLEVEL', 'INFO').upper()
@@ -27,89 +29,400 @@ class StatusEndpointUnavailableException(Exception):
     pass
 
 
-class ThegraphService:
-    def __init__(self, subgraph_name: str, thegraph_status_url: str = 'https://api.thegraph.com/index-node/graphql'):
-        self.subgraph_name = subgraph_name
-        self.thegraph_status_url = thegraph_status_url
-        # Use a provider to reuse the same service and not make so many requests to Infura
-        self.infura_service = InfuraProvider()
+# Thegraph status endpoint (by default the hosted service one)
+THEGRAPH_STATUS_URL = os.environ.get('THEGRAPH_STATUS_URL', 'https://api.thegraph.com/index-node/graphql')
+
+# Max number of subgraphs whose statuses are requested in the same Graphql query (by default 50)
+STATUS_BATCH_SIZE = int(os.environ.get('STATUS_BATCH_SIZE', 50))
+
+# Max number of concurrent requests to each status endpoint (by default 4)
+INDEX_NODE_MAX_CONCURRENCY = int(os.environ.get('INDEX_NODE_MAX_CONCURRENCY', 4))
+
+# Max number of concurrent requests of specific status endpoints, with format `url=max,url=max`.
+# Self-hosted index nodes usually support less concurrent requests than the hosted service
+INDEX_NODES_MAX_CONCURRENCY = {url: int(max_concurrency) for url, max_concurrency in (
+    index_node_max_concurrency.strip().rsplit('=', 1)
+    for index_node_max_concurrency in os.environ.get('INDEX_NODES_MAX_CONCURRENCY', '').split(',')
+    if index_node_max_concurrency.strip())}
+
+# Seconds to wait for a response of the status endpoint (by default 10)
+STATUS_REQUEST_TIMEOUT = float(os.environ.get('STATUS_REQUEST_TIMEOUT', 10))
+
+# Graphql field of each subgraph version
+VERSION_FIELDS = {
+    'current': 'indexingStatusForCurrentVersion',
+    'pending': 'indexingStatusForPendingVersion'
+}
+
+# Fields of `SubgraphIndexingStatus` used to check a subgraph. Status records are built from them
+SUBGRAPH_STATUS_FRAGMENT = '''
+fragment SubgraphStatus on SubgraphIndexingStatus {
+  subgraph
+  health
+  synced
+  fatalError {
+    message
+  }
+  chains {
+    network
+    chainHeadBlock {
+      number
+    }
+    latestBlock {
+      number
+      hash
+    }
+    lastHealthyBlock {
+      number
+      hash
+    }
+  }
+}
+'''
+
+
+class ChainStatus:
+    # Slots avoid a dict per object, as there are thousands of them
+    __slots__ = ('network', 'chain_head_block_number', 'latest_block_number', 'latest_block_hash',
+                 'last_healthy_block_number', 'last_healthy_block_hash')
+
+    def __init__(self, chain_json: dict):
+        """
+        Indexing status of a subgraph version in one chain
+        :param chain_json: dict. `chains` element of the status endpoint response
+        """
 
-        # Get subgraph statuses
-        self.current_subgraph_status = self.fetch_current_subgraph_status()
-        self.pending_subgraph_status = self.fetch_pending_subgraph_status()
+        self.network = chain_json['network']
+        self.chain_head_block_number = _get_block_number(chain_json.get('chainHeadBlock'))
+        self.latest_block_number = _get_block_number(chain_json.get('latestBlock'))
+        self.latest_block_hash = (chain_json.get('latestBlock') or {}).get('hash')
+        # Only defined when the subgraph has failed
+        self.last_healthy_block_number = _get_block_number(chain_json.get('lastHealthyBlock'))
+        self.last_healthy_block_hash = (chain_json.get('lastHealthyBlock') or {}).get('hash')
 
-    def fetch_current_subgraph_status(self):
+
+class SubgraphStatus:
+    # Slots avoid a dict per object, as there are thousands of them
+    __slots__ = ('deployment', 'health', 'synced', 'fatal_error', 'chains')
+
+    def __init__(self, status_json: dict):
         """
-        Get CURRENT subgraph status
-        :return: bool
+        Indexing status of a subgraph version
+        :param status_json: dict. `SubgraphIndexingStatus` of the status endpoint response
         """
 
-        # Operation module helps to create complex queries and interpret the JSON returned into native Python objects
-        operation_definition = Operation(subgraph_status_schema.Query)
+        self.deployment = status_json['subgraph']
+        self.health = status_json['health']
+        self.synced = status_json['synced']
+        self.fatal_error = (status_json.get('fatalError') or {}).get('message')
+        self.chains = [ChainStatus(chain_json) for chain_json in status_json['chains']]
 
-        operation_definition.indexing_status_for_current_version(subgraph_name=self.subgraph_name)
+    @classmethod
+    def from_json(cls, status_json):
+        """
+        :param status_json: dict or None when the subgraph version does not exist
+        :return: SubgraphStatus or None
+        """
 
-        # Important: we must select explicity which fields we want to request in our Graphql Query
-        # In this case we select all possible fields
-        operation_definition.indexing_status_for_current_version.__fields__('health', 'synced', 'fatal_error', 'chains')
-        # It is needed so that "latest_block" is parsed as it is as subfield
-        operation_definition.indexing_status_for_current_version.chains.__fields__()
-        operation_definition.indexing_status_for_current_version.chains.latest_block.__fields__()
+        return cls(status_json) if status_json else None
 
-        # Call the endpoint:
-        headers = {}
-        endpoint = HTTPEndpoint(self.thegraph_status_url, headers)
 
-        try:
-            subgraph_statuses_json = endpoint(operation_definition)
-        except Exception:
-            raise StatusEndpointUnavailableException()
+def _get_block_number(block_json):
+    """
+    :param block_json: dict or None. `Block` of the status endpoint response
+    :return: int or None
+    """
+
+    return int(block_json['number']) if block_json else None
+
+
+@functools.lru_cache(maxsize=None)
+def _build_subgraphs_statuses_query(batch_size: int, versions: tuple = ('current', 'pending')) -> str:
+    """
+    Build the Graphql query to get the statuses of `batch_size` subgraphs. Subgraph names are Graphql variables
+    (`$subgraph0`, `$subgraph1`...), so the query is only built once for each batch size and versions.
+    Aliases are needed because the same field is requested several times in the same query (`current0`, `pending0`...)
+    :param batch_size: int. Number of subgraphs
+    :param versions: tuple. Subgraph versions requested (`current` and/or `pending`)
+    :return: str
+    """
+
+    variables = ', '.join(f'$subgraph{index}: String!' for index in range(batch_size))
+    fields = ' '.join(f'{version}{index}: {VERSION_FIELDS[version]}(subgraphName: $subgraph{index}) '
+                      f'{{ ...SubgraphStatus }}'
+                      for index in range(batch_size) for version in versions)
+
+    return f'query SubgraphsStatuses({variables}) {{ {fields} }}{SUBGRAPH_STATUS_FRAGMENT}'
+
+
+def _post_status_endpoint_query(thegraph_status_url: str, query: str, variables: dict, deadline: float) -> dict:
+    """
+    Send a Graphql query to the status endpoint using the shared HTTP transport (only one attempt)
+    :return: dict. `data` of the JSON response
+    """
+
+    max_concurrency = INDEX_NODES_MAX_CONCURRENCY.get(thegraph_status_url, INDEX_NODE_MAX_CONCURRENCY)
+    remaining_time = get_remaining_time(deadline)
+    timeout = STATUS_REQUEST_TIMEOUT if remaining_time is None else min(STATUS_REQUEST_TIMEOUT, remaining_time)
+
+    try:
+        with HostConcurrencyLimiterProvider().limit(thegraph_status_url, max_concurrency, per_endpoint=True), \
+                MetricsProvider().time('subgraph_monitor_stage_duration_seconds', stage='status_fetch'), \
+                TracingProvider().span('status_fetch', index_node=thegraph_status_url):
+            response = HttpProvider().post(url=thegraph_status_url,
+                                           json={'query': query, 'variables': variables},
+                                           timeout=timeout)
+
+        with TracingProvider().span('status_decode', index_node=thegraph_status_url):
+            response_json = response.json()
+    except Exception:
+        raise StatusEndpointUnavailableException(thegraph_status_url)
 
-        # INTERPRET RESULTS INTO NATIVE PYTHON OBJECTS
-        # Since we don’t want to cobbler GraphQL fields, we cannot provide nicely named methods.
-        # Then we use overloaded methods such as __iadd__, __add__ (`+` symbol), __bytes__(compressed GraphQL
-        # representation) and __str__(indented GraphQL representation).
-        #
-        # A convenience is the `__add__()` (the symbol `+`) to apply the operation to a resulting JSON data,
-        # interpreting the results and producing convenient objects
-        subgraph_status = (operation_definition + subgraph_statuses_json).indexing_status_for_current_version
+    # When the whole query fails there is no data to interpret
+    if not response_json.get('data'):
+        raise StatusEndpointUnavailableException(thegraph_status_url)
+
+    return response_json['data']
+
+
+def _request_status_endpoint(thegraph_status_url: str, query: str, variables: dict, deadline: float = None) -> dict:
+    """
+    Send a Graphql query to the status endpoint. Failed requests are retried with backoff, and the endpoint
+    is not requested while its circuit breaker is open
+    :param thegraph_status_url: str. Thegraph status endpoint
+    :param query: str. Graphql query
+    :param variables: dict. Graphql variables
+    :param deadline: float. `time.monotonic()` time after which the request is not retried
+    :return: dict. `data` of the JSON response
+    """
+
+    circuit_breaker = CircuitBreakerProvider().get(thegraph_status_url)
+
+    def request_status_endpoint():
+        # Retries are also limited by the global request budget
+        if not RequestBudgetProvider().acquire(get_remaining_time(deadline)):
+            raise DeadlineExceededException()
+
+        return circuit_breaker.call(_post_status_endpoint_query, thegraph_status_url, query, variables, deadline)
+
+    try:
+        return call_with_retries(request_status_endpoint,
+                                 retry_exceptions=(StatusEndpointUnavailableException,),
+                                 deadline=deadline)
+    except (StatusEndpointUnavailableException, CircuitOpenException):
+        MetricsProvider().inc_counter('subgraph_monitor_status_endpoint_unavailable_total',
+                                      index_node=thegraph_status_url)
+        raise StatusEndpointUnavailableException(thegraph_status_url)
+
+
+def is_index_node_available(thegraph_status_url: str = THEGRAPH_STATUS_URL) -> bool:
+    """
+    Check if a status endpoint can be requested (its circuit breaker is not open)
+    :param thegraph_status_url: str. Thegraph status endpoint
+    :return: bool
+    """
+
+    return CircuitBreakerProvider().get(thegraph_status_url).is_available()
+
+
+def fetch_subgraphs_statuses_batch(subgraph_names: list, thegraph_status_url: str = THEGRAPH_STATUS_URL,
+                                   versions: tuple = ('current', 'pending'), deadline: float = None) -> dict:
+    """
+    Get CURRENT and PENDING statuses of several subgraphs using only one request
+    :param subgraph_names: list. Names of the subgraphs
+    :param thegraph_status_url: str. Thegraph status endpoint
+    :param versions: tuple. Subgraph versions requested (`current` and/or `pending`)
+    :param deadline: float. `time.monotonic()` time after which the request is not retried
+    :return: dict. {subgraph_name: {'current': SubgraphStatus, 'pending': SubgraphStatus}}
+    """
+
+    with TracingProvider().span('query_build', subgraphs=len(subgraph_names)):
+        query = _build_subgraphs_statuses_query(len(subgraph_names), versions)
+        variables = {f'subgraph{index}': subgraph_name for index, subgraph_name in enumerate(subgraph_names)}
+
+    subgraph_statuses_json = _request_status_endpoint(thegraph_status_url, query, variables, deadline)
+
+    # Results are split by subgraph
+    with TracingProvider().span('status_interpret', subgraphs=len(subgraph_names)):
+        return {
+            subgraph_name: {
+                version: SubgraphStatus.from_json(subgraph_statuses_json.get(f'{version}{index}'))
+                for version in versions
+            }
+            for index, subgraph_name in enumerate(subgraph_names)
+        }
+
+
+# Query of the deployments indexed by an index node
+DEPLOYMENTS_QUERY = 'query Deployments { indexingStatuses { subgraph } }'
+
+# Query of the statuses of several deployments
+DEPLOYMENTS_STATUSES_QUERY = '''
+query DeploymentsStatuses($deployments: [String!]) {
+  indexingStatuses(subgraphs: $deployments) {
+    ...SubgraphStatus
+  }
+}
+''' + SUBGRAPH_STATUS_FRAGMENT
+
+
+def fetch_deployments(thegraph_status_url: str = THEGRAPH_STATUS_URL) -> list:
+    """
+    Get all deployments indexed by an index node (unfiltered `indexingStatuses`)
+    :param thegraph_status_url: str. Thegraph status endpoint
+    :return: list. Deployment IDs
+    """
+
+    deployments_json = _request_status_endpoint(thegraph_status_url, DEPLOYMENTS_QUERY, {})
+
+    return [deployment_json['subgraph'] for deployment_json in deployments_json['indexingStatuses']]
+
+
+def fetch_deployments_statuses_batch(deployments: list, thegraph_status_url: str = THEGRAPH_STATUS_URL,
+                                     deadline: float = None) -> dict:
+    """
+    Get statuses of several deployments using only one request.
+    Deployments are monitored by their ID, so they do not have a PENDING version
+    :param deployments: list. Deployment IDs
+    :param thegraph_status_url: str. Thegraph status endpoint
+    :param deadline: float. `time.monotonic()` time after which the request is not retried
+    :return: dict. {deployment: {'current': SubgraphStatus, 'pending': None}}
+    """
+
+    deployments_statuses_json = _request_status_endpoint(thegraph_status_url, DEPLOYMENTS_STATUSES_QUERY,
+                                                         {'deployments': deployments}, deadline)
+
+    with TracingProvider().span('status_interpret', subgraphs=len(deployments)):
+        subgraph_statuses = {subgraph_status.deployment: subgraph_status for subgraph_status in
+                             map(SubgraphStatus, deployments_statuses_json['indexingStatuses'])}
 
-        return subgraph_status
+    return {
+        deployment: {'current': subgraph_statuses.get(deployment), 'pending': None}
+        for deployment in deployments
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def _build_proofs_of_indexing_query(batch_size: int) -> str:
+    """
+    Build the Graphql query to get `batch_size` proofs of indexing (`$subgraph0`, `$blockHash0`...)
+    :param batch_size: int
+    :return: str
+    """
+
+    variables = ', '.join(f'$subgraph{index}: String!, $blockHash{index}: Bytes!' for index in range(batch_size))
+    fields = ' '.join(f'poi{index}: proofOfIndexing(subgraph: $subgraph{index}, blockHash: $blockHash{index})'
+                      for index in range(batch_size))
 
-    def fetch_pending_subgraph_status(self):
-        """
-        Get PENDING subgraph status
-        :return: bool
-        """
+    return f'query ProofsOfIndexing({variables}) {{ {fields} }}'
+
+
+def fetch_proofs_of_indexing_batch(deployment_blocks: list, thegraph_status_url: str = THEGRAPH_STATUS_URL,
+                                   deadline: float = None) -> list:
+    """
+    Get proofs of indexing of several deployments using only one request.
+    The `indexer` argument is not used, so proofs of different index nodes can be compared
+    :param deployment_blocks: list. [(deployment, block hash)]
+    :param thegraph_status_url: str. Thegraph status endpoint
+    :param deadline: float. `time.monotonic()` time after which the request is not retried
+    :return: list. Proof of indexing of each deployment block (None when the index node can not compute it)
+    """
+
+    query = _build_proofs_of_indexing_query(len(deployment_blocks))
+    variables = {}
+    for index, (deployment, block_hash) in enumerate(deployment_blocks):
+        variables[f'subgraph{index}'] = deployment
+        variables[f'blockHash{index}'] = block_hash
 
-        # Operation module helps to create complex queries and interpret the JSON returned into native Python objects
-        operation_definition = Operation(subgraph_status_schema.Query)
+    proofs_of_indexing_json = _request_status_endpoint(thegraph_status_url, query, variables, deadline)
 
-        operation_definition.indexing_status_for_pending_version(subgraph_name=self.subgraph_name)
+    return [proofs_of_indexing_json.get(f'poi{index}') for index in range(len(deployment_blocks))]
 
-        # Important: we must select explicity which fields we want to request in our Graphql Query
-        # In this case we select all possible fields
-        operation_definition.indexing_status_for_pending_version.__fields__('health', 'synced', 'fatal_error', 'chains')
 
-        # Call the endpoint:
-        headers = {}
-        endpoint = HTTPEndpoint(self.thegraph_status_url, headers)
+def get_status_endpoint_queries() -> list:
+    """
+    Get all the queries sent to the status endpoint (with one subgraph each). `tools/graphql_schema_generator.py`
+    only generates the types and fields they select
+    :return: list. Graphql queries
+    """
 
-        try:
-            subgraph_statuses_json = endpoint(operation_definition)
-        except Exception:
-            raise StatusEndpointUnavailableException()
+    return [_build_subgraphs_statuses_query(1), DEPLOYMENTS_QUERY, DEPLOYMENTS_STATUSES_QUERY,
+            _build_proofs_of_indexing_query(1)]
+
+
+def split_in_batches(subgraph_names: list, batch_size: int = STATUS_BATCH_SIZE) -> list:
+    """
+    Split subgraph names in batches that can be requested in the same query
+    :param subgraph_names: list
+    :param batch_size: int. Max number of subgraphs requested in the same query
+    :return: list of lists
+    """
+
+    return [subgraph_names[batch_start:batch_start + batch_size]
+            for batch_start in range(0, len(subgraph_names), batch_size)]
+
+
+def fetch_subgraphs_statuses(subgraph_names: list, thegraph_status_url: str = THEGRAPH_STATUS_URL,
+                             batch_size: int = STATUS_BATCH_SIZE) -> dict:
+    """
+    Get CURRENT and PENDING statuses of several subgraphs using a few batched requests,
+    so only one request is done for each `batch_size` subgraphs instead of two requests per subgraph
+    :param subgraph_names: list. Names of the subgraphs
+    :param thegraph_status_url: str. Thegraph status endpoint
+    :param batch_size: int. Max number of subgraphs requested in the same query
+    :return: dict. {subgraph_name: {'current': SubgraphStatus, 'pending': SubgraphStatus}}
+    """
+
+    subgraphs_statuses = {}
+
+    for batch_subgraph_names in split_in_batches(subgraph_names, batch_size):
+        subgraphs_statuses.update(fetch_subgraphs_statuses_batch(batch_subgraph_names, thegraph_status_url))
+
+    return subgraphs_statuses
+
+
+class ThegraphService:
+    def __init__(self, subgraph_name: str, thegraph_status_url: str = THEGRAPH_STATUS_URL,
+                 subgraph_statuses: dict = None):
+        """
+        :param subgraph_name: str
+        :param thegraph_status_url: str. Thegraph status endpoint
+        :param subgraph_statuses: dict. Statuses already fetched with `fetch_subgraphs_statuses`, optionally with the
+        `sync_evaluation` of their batch (see `evaluate_subgraphs_sync`).
+        If they are not provided, they are requested to the status endpoint
+        """
+        self.subgraph_name = subgraph_name
+        self.thegraph_status_url = thegraph_status_url
+        # Synced status of current version. None until it is checked or if Infura was unavailable
+        self.is_current_synced = None
+
+        # Get subgraph statuses
+        if subgraph_statuses is not None:
+            self.current_subgraph_status = subgraph_statuses['current']
+            self.pending_subgraph_status = subgraph_statuses['pending']
+            self.sync_evaluation = subgraph_statuses.get('sync_evaluation')
+        else:
+            self.current_subgraph_status = self.fetch_current_subgraph_status()
+            self.pending_subgraph_status = self.fetch_pending_subgraph_status()
+            self.sync_evaluation = None
 
-        # INTERPRET RESULTS INTO NATIVE PYTHON OBJECTS
-        # Since we don’t want to cobbler GraphQL fields, we cannot provide nicely named methods.
-        # Then we use overloaded methods such as __iadd__, __add__ (`+` symbol), __bytes__(compressed GraphQL
-        # representation) and __str__(indented GraphQL representation).
-        #
-        # A convenience is the `__add__()` (the symbol `+`) to apply the operation to a resulting JSON data,
-        # interpreting the results and producing convenient objects
-        subgraph_status = (operation_definition + subgraph_statuses_json).indexing_status_for_pending_version
+    def fetch_current_subgraph_status(self):
+        """
+        Get CURRENT subgraph status
+        :return: SubgraphStatus
+        """
+
+        return fetch_subgraphs_statuses_batch([self.subgraph_name], self.thegraph_status_url,
+                                              versions=('current',))[self.subgraph_name]['current']
+
+    def fetch_pending_subgraph_status(self):
+        """
+        Get PENDING subgraph status
+        :return: SubgraphStatus or None if there is not a pending version
+        """
 
-        return subgraph_status
+        return fetch_subgraphs_statuses_batch([self.subgraph_name], self.thegraph_status_url,
+                                              versions=('pending',))[self.subgraph_name]['pending']
 
     def is_current_subgraph_version_ok(self) -> bool:
         """
@@ -120,13 +433,15 @@ class ThegraphService:
 
         subgraph_status = self.current_subgraph_status
 
-        is_healthy = self._is_subgraph_healthy(subgraph_status)
+        is_healthy = self.is_subgraph_healthy(subgraph_status)
 
         try:
             is_synced = self.is_current_subgraph_version_synced()
+            self.is_current_synced = is_synced
 
             is_subgraph_ok = is_healthy and is_synced
         except InfuraEndpointUnavailableException:
+            MetricsProvider().inc_counter('subgraph_monitor_infura_fallbacks_total', reason='infura_unavailable')
             logging.error('Infura endpoint to check `synced` status is unavailable (Now only checking healthy status)'
                           'Please, check this! Possible causes: Infura token has reached the limit, Endpoint is down...')
 
@@ -145,55 +460,109 @@ class ThegraphService:
 
         # When there is not a pending subgraph version, status is always ok
         if subgraph_status:
-            is_healthy = self._is_subgraph_healthy(subgraph_status)
+            is_healthy = self.is_subgraph_healthy(subgraph_status)
 
             # Here we do not check if the subgraph is synced because a `pending` subgraph will be always syncing. And when a `pending` subgraphs is synced it changes to `current`
             return is_healthy
         else:
             return True
 
+    def get_sync_evaluation(self):
+        """
+        Sync status of all chains of both versions. It is evaluated here when it was not evaluated with the
+        statuses of the whole batch
+        :return: SyncEvaluation
+        """
+
+        if self.sync_evaluation is None:
+            self.sync_evaluation = evaluate_subgraphs_sync({self.subgraph_name: {
+                'current': self.current_subgraph_status,
+                'pending': self.pending_subgraph_status,
+            }})
+
+        return self.sync_evaluation
+
+    def get_current_subgraph_chains(self) -> list:
+        """
+        Return sync status of each chain of the current subgraph version
+        :return: list. ChainSyncStatus
+        """
+
+        return self.get_sync_evaluation().get_chains(self.subgraph_name, 'current')
+
+    def get_pending_subgraph_chains(self) -> list:
+        """
+        Return sync status of each chain of the pending subgraph version (against the chain heads of the status
+        endpoint)
+        :return: list. ChainSyncStatus (empty if there is not a pending version)
+        """
+
+        return self.get_sync_evaluation().get_chains(self.subgraph_name, 'pending')
+
+    def get_current_subgraph_lagging_chain(self):
+        """
+        Return the chain of the current subgraph version that is most behind its chain head (chains whose chain head
+        is unknown go last)
+        :return: ChainSyncStatus or None if the version has no chains
+        """
+
+        chains = self.get_current_subgraph_chains()
+
+        return max(chains, key=lambda chain: (chain.block_lag is not None, chain.block_lag or 0), default=None)
+
     def get_current_subgraph_last_block_number(self) -> int:
         """
-        Return current subgraph last block number
-        :return: int
+        Return current subgraph last block number (of the chain that is most behind if it indexes several chains)
+        :return: int or None if the version has no chains
         """
 
-        subgraph_status = self.current_subgraph_status
-        # Convert to string so that it can be used later
-        # chains[0] is used because Thegraph has said that right now it only has 1 element. Maybe in the future it has more...
-        subgraph_latest_block_number = int(subgraph_status.chains[0].latest_block.number)
+        chain = self.get_current_subgraph_lagging_chain()
 
-        return subgraph_latest_block_number
+        return chain.latest_block_number if chain else None
 
     def get_current_subgraph_network(self) -> str:
         """
-        Return current subgraph network
-        :return: str
+        Return current subgraph network (of the chain that is most behind if it indexes several chains)
+        :return: str or None if the version has no chains
         """
 
-        subgraph_status = self.current_subgraph_status
-        subgraph_network = subgraph_status.chains[0].network.lower()
+        chain = self.get_current_subgraph_lagging_chain()
 
-        return subgraph_network
+        return chain.network if chain else None
+
+    def get_current_subgraph_block_lag(self):
+        """
+        :return: int. Block lag of the chain that is most behind or None if no chain head is known
+        """
+
+        return self.get_sync_evaluation().get_block_lag(self.subgraph_name, 'current')
+
+    def get_pending_subgraph_block_lag(self):
+        """
+        :return: int. Block lag of the chain that is most behind or None if no chain head is known
+        """
+
+        return self.get_sync_evaluation().get_block_lag(self.subgraph_name, 'pending')
 
     def is_current_subgraph_version_synced(self) -> bool:
         """
-        Check if current subgraph version is synced against Infura
+        Check if all chains of current subgraph version are synced against their chain heads
         Because "synced" property of subgraphs is not useful as it only indicates that a subgraph was synced at some point
+        In `status` mode the chain head block returned by the status endpoint is used, and Infura is only requested
+        when it is missing or the lag is bigger than `CHAIN_HEAD_DISAGREEMENT_THRESHOLD`
+        Each network has its own out of sync threshold (see `NETWORKS_BLOCKS_TO_CONSIDER_OUT_OF_SYNC`)
         :return: bool
         """
 
-        BLOCKS_TO_CONSIDER_OUT_OF_SYNC = 15
-
-        subgraph_latest_block_number = self.get_current_subgraph_last_block_number()
-        subgraph_network = self.get_current_subgraph_network()
+        is_synced = self.get_sync_evaluation().is_synced(self.subgraph_name, 'current')
 
-        infura_service = self.infura_service
-        infura_latest_block_number = infura_service.get_latest_block_number_of_network(subgraph_network)
+        # Chain heads of some chains are unknown and the other chains are synced
+        if is_synced is None:
+            raise InfuraEndpointUnavailableException()
 
-        return (infura_latest_block_number - subgraph_latest_block_number) < BLOCKS_TO_CONSIDER_OUT_OF_SYNC
+        return is_synced
 
-    def _is_subgraph_healthy(self, subgraph_status) -> bool:
+    def is_subgraph_healthy(self, subgraph_status) -> bool:
         """
         Check if a subgraph status is healthy
         """
@@ -0,0 +1,288 @@
+import collections
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+from .http_service import HttpProvider
+
+# Log a structured JSON line with the duration of each stage of the checks (by default `false`)
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+
+# OpenTelemetry collector where spans are exported with OTLP/HTTP JSON, e.g. `http://localhost:4318/v1/traces`
+# (by default disabled). Spans are exported even if `TRACING_ENABLED` is false
+OTLP_ENDPOINT = os.environ.get('OTLP_ENDPOINT', '')
+
+# Service name of the exported spans (by default `thegraph-subgraphs-monitor`)
+OTLP_SERVICE_NAME = os.environ.get('OTLP_SERVICE_NAME', 'thegraph-subgraphs-monitor')
+
+# Seconds between exports to the collector (by default 5)
+OTLP_EXPORT_INTERVAL = float(os.environ.get('OTLP_EXPORT_INTERVAL', 5))
+
+# Max number of spans waiting to be exported. The oldest ones are dropped (by default 10000)
+OTLP_QUEUE_SIZE = int(os.environ.get('OTLP_QUEUE_SIZE', 10000))
+
+# Span of the current thread, parent of the spans started in it
+current_span = contextvars.ContextVar('current_span', default=None)
+
+# Logger of the spans, so that they can be filtered from the other logs
+span_logger = logging.getLogger('tracing')
+
+
+class NoopSpan:
+    """
+    Span returned when tracing is disabled. It is shared, so disabled spans do not create any object
+    """
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    # Slots avoid a dict per object, as there are several spans per subgraph
+    __slots__ = ('tracing_service', 'name', 'trace_id', 'span_id', 'parent_span_id', 'attributes', 'start_time',
+                 'start', 'duration', 'error', 'token')
+
+    def __init__(self, tracing_service, name: str, attributes: dict):
+        """
+        Duration of a stage. Spans started while another span is active in the same thread (or in a function
+        wrapped by `TracingService.propagate`) are its children and have the same trace ID
+        :param tracing_service: TracingService. Span is ended there
+        :param name: str. Stage
+        :param attributes: dict. {name: str, int, float or bool}
+        """
+
+        parent_span = current_span.get()
+
+        self.tracing_service = tracing_service
+        self.name = name
+        self.trace_id = parent_span.trace_id if parent_span else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span.span_id if parent_span else None
+        self.attributes = attributes
+        self.start_time = None
+        self.start = None
+        self.duration = None
+        self.error = None
+        self.token = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.token = current_span.set(self)
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.duration = time.perf_counter() - self.start
+        if exception_type is not None:
+            self.error = f'{exception_type.__name__}: {exception}'
+
+        current_span.reset(self.token)
+        self.tracing_service.end_span(self)
+        return False
+
+    def to_log_json(self) -> dict:
+        return {
+            'span': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_span_id,
+            'start': self.start_time,
+            'duration_ms': round(self.duration * 1000, 3),
+            'status': 'error' if self.error else 'ok',
+            **({'error': self.error} if self.error else {}),
+            **self.attributes,
+        }
+
+    def to_otlp_json(self) -> dict:
+        start_time_nano = int(self.start_time * 1e9)
+
+        otlp_span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            # Internal
+            'kind': 1,
+            'startTimeUnixNano': str(start_time_nano),
+            'endTimeUnixNano': str(start_time_nano + int(self.duration * 1e9)),
+            'attributes': [{'key': key, 'value': get_otlp_value(value)} for key, value in self.attributes.items()],
+            # Status codes: 1 ok, 2 error
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_span_id:
+            otlp_span['parentSpanId'] = self.parent_span_id
+
+        return otlp_span
+
+
+def get_otlp_value(value) -> dict:
+    """
+    :return: dict. OTLP `AnyValue` of an attribute
+    """
+
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # 64 bits integers are strings in OTLP JSON
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+
+    return {'stringValue': str(value)}
+
+
+class TracingService:
+    def __init__(self, log_enabled: bool = TRACING_ENABLED, otlp_endpoint: str = OTLP_ENDPOINT,
+                 service_name: str = OTLP_SERVICE_NAME, export_interval: float = OTLP_EXPORT_INTERVAL,
+                 queue_size: int = OTLP_QUEUE_SIZE):
+        """
+        Spans of the stages of the checks (query building, status endpoint requests, JSON interpretation, chain head
+        requests, evaluation and Slack delivery). Ended spans are logged as JSON lines and/or exported to an
+        OpenTelemetry collector from a background thread.
+        When both are disabled, `span` returns a shared no-op span, so instrumentation only costs a function call
+        :param log_enabled: bool. Log a JSON line per span
+        :param otlp_endpoint: str. OTLP/HTTP traces endpoint (empty disables the export)
+        :param service_name: str. `service.name` of the exported spans
+        :param export_interval: float. Seconds between exports
+        :param queue_size: int. Max number of spans waiting to be exported
+        """
+
+        self.log_enabled = log_enabled
+        self.otlp_endpoint = otlp_endpoint
+        self.service_name = service_name
+        self.export_interval = export_interval
+        self.enabled = bool(log_enabled or otlp_endpoint)
+
+        # Ended spans waiting to be exported. The oldest ones are dropped when it is full
+        self.queue = collections.deque(maxlen=queue_size)
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.exporter = None
+        if otlp_endpoint:
+            self.exporter = threading.Thread(target=self._export_periodically, name='otlp-exporter', daemon=True)
+            self.exporter.start()
+
+    def span(self, name: str, **attributes):
+        """
+        Measure a stage: `with TracingProvider().span('status_fetch', index_node=url): ...`
+        :param name: str
+        :param attributes: str, int, float or bool
+        :return: Span or NoopSpan if tracing is disabled
+        """
+
+        if not self.enabled:
+            return NOOP_SPAN
+
+        return Span(self, name, attributes)
+
+    def propagate(self, function):
+        """
+        Wrap a function that is run in another thread so that its spans are children of the current span
+        :param function: function
+        :return: function
+        """
+
+        if not self.enabled:
+            return function
+
+        context = contextvars.copy_context()
+
+        def run_in_context(*args, **kwargs):
+            return context.run(function, *args, **kwargs)
+
+        return run_in_context
+
+    def end_span(self, span: Span):
+        if self.log_enabled:
+            span_logger.info(json.dumps(span.to_log_json(), default=str))
+
+        if self.otlp_endpoint:
+            with self.condition:
+                self.queue.append(span)
+
+    def _export_periodically(self):
+        while True:
+            with self.condition:
+                if self.stopped:
+                    return
+                self.condition.wait(self.export_interval)
+
+            self._export()
+
+    def _export(self):
+        """
+        Send queued spans to the collector in one request. Spans ended meanwhile are queued for the next export
+        """
+
+        with self.condition:
+            spans = list(self.queue)
+            self.queue.clear()
+
+        if not spans:
+            return
+
+        body = {
+            'resourceSpans': [{
+                'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+                'scopeSpans': [{
+                    'scope': {'name': 'thegraph-subgraphs-monitor'},
+                    'spans': [span.to_otlp_json() for span in spans],
+                }],
+            }],
+        }
+
+        try:
+            response = HttpProvider().post(url=self.otlp_endpoint, json=body, timeout=5)
+            if response.status_code >= 300:
+                logging.error(f'Spans could not be exported. Collector responded with status code '
+                              f'{response.status_code}')
+        except Exception as exception:
+            logging.error(f'Spans could not be exported. Exception: {exception}')
+
+    def flush(self):
+        """
+        Export queued spans now (before exiting)
+        """
+
+        if self.otlp_endpoint:
+            self._export()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.flush()
+
+
+class TracingProvider:
+    # Several threads can request the singleton at the same time
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = TracingService()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            cls.instance.stop()
+            del cls.instance
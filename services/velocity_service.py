@@ -0,0 +1,228 @@
+import array
+import math
+import os
+import threading
+
+# Number of samples (check time, latest block, chain head) kept for each subgraph version (by default 32)
+VELOCITY_SAMPLES = int(os.environ.get('VELOCITY_SAMPLES', 32))
+
+# Min seconds between the oldest and the newest sample to compute velocities (by default 300)
+VELOCITY_MIN_WINDOW = float(os.environ.get('VELOCITY_MIN_WINDOW', 300))
+
+# Seconds without new indexed blocks after which a subgraph version that is behind the chain head
+# is considered stalled (by default 600)
+STALL_TIMEOUT = float(os.environ.get('STALL_TIMEOUT', 600))
+
+# Seconds ahead in which the lag of CURRENT versions is predicted. If the predicted lag reaches the out of sync
+# threshold, the version is notified as falling behind before it is out of sync (by default 600)
+LAG_PREDICTION_HORIZON = float(os.environ.get('LAG_PREDICTION_HORIZON', 600))
+
+# Fields of each sample
+SAMPLE_SIZE = 3
+
+
+class SyncVelocityTracker:
+    # Slots avoid a dict per object, as there are thousands of them
+    __slots__ = ('deployment', 'samples', 'size', 'count', 'next_index')
+
+    def __init__(self, deployment: str, size: int = VELOCITY_SAMPLES):
+        """
+        Fixed-size ring buffer of (check time, latest block, chain head) samples of a subgraph version.
+        Samples are stored in one array of doubles (24 bytes per sample) instead of tuples
+        :param deployment: str. Samples are only comparable while the deployment of the version does not change
+        :param size: int. Max number of samples
+        """
+
+        self.deployment = deployment
+        self.samples = array.array('d', bytes(8 * SAMPLE_SIZE * size))
+        self.size = size
+        self.count = 0
+        self.next_index = 0
+
+    def add_sample(self, timestamp: float, latest_block_number: int, chain_head_block_number):
+        """
+        :param timestamp: float. Seconds
+        :param latest_block_number: int
+        :param chain_head_block_number: int or None if it is unknown
+        """
+
+        offset = self.next_index * SAMPLE_SIZE
+        self.samples[offset] = timestamp
+        self.samples[offset + 1] = latest_block_number
+        self.samples[offset + 2] = math.nan if chain_head_block_number is None else chain_head_block_number
+
+        self.next_index = (self.next_index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def _get_sample(self, age: int) -> tuple:
+        """
+        :param age: int. 0 is the newest sample
+        :return: tuple. (timestamp, latest block, chain head)
+        """
+
+        offset = ((self.next_index - 1 - age) % self.size) * SAMPLE_SIZE
+        return self.samples[offset], self.samples[offset + 1], self.samples[offset + 2]
+
+    def get_window(self) -> float:
+        """
+        :return: float. Seconds between the oldest and the newest sample
+        """
+
+        if self.count < 2:
+            return 0.0
+
+        return self._get_sample(0)[0] - self._get_sample(self.count - 1)[0]
+
+    def get_lag(self):
+        """
+        :return: float. Blocks between the chain head and the latest block of the newest sample, or None
+        """
+
+        if not self.count:
+            return None
+
+        _, latest_block_number, chain_head_block_number = self._get_sample(0)
+        return None if math.isnan(chain_head_block_number) else max(0.0, chain_head_block_number - latest_block_number)
+
+    def get_velocities(self, min_window: float = VELOCITY_MIN_WINDOW) -> tuple:
+        """
+        Get indexing velocity and chain growth between the oldest and the newest samples
+        :param min_window: float. Min seconds between samples
+        :return: tuple. (indexed blocks per second, chain blocks per second), None if they can not be computed
+        """
+
+        window = self.get_window()
+        if window <= 0 or window < min_window:
+            return None, None
+
+        _, newest_latest_block_number, newest_chain_head_block_number = self._get_sample(0)
+        _, oldest_latest_block_number, oldest_chain_head_block_number = self._get_sample(self.count - 1)
+
+        indexing_velocity = (newest_latest_block_number - oldest_latest_block_number) / window
+        chain_velocity = (newest_chain_head_block_number - oldest_chain_head_block_number) / window
+
+        return indexing_velocity, None if math.isnan(chain_velocity) else chain_velocity
+
+    def get_catch_up_eta(self, min_window: float = VELOCITY_MIN_WINDOW):
+        """
+        Estimate seconds until the latest block reaches the chain head
+        :return: float. 0 if it is not behind, None if it is not catching up or it can not be estimated
+        """
+
+        lag = self.get_lag()
+        indexing_velocity, chain_velocity = self.get_velocities(min_window)
+
+        if lag is None or indexing_velocity is None or chain_velocity is None:
+            return None
+        if lag == 0:
+            return 0.0
+        if indexing_velocity <= chain_velocity:
+            return None
+
+        return lag / (indexing_velocity - chain_velocity)
+
+    def get_predicted_lag(self, horizon: float = LAG_PREDICTION_HORIZON, min_window: float = VELOCITY_MIN_WINDOW):
+        """
+        Predict the lag after `horizon` seconds if velocities do not change
+        :return: float or None if it can not be predicted
+        """
+
+        lag = self.get_lag()
+        indexing_velocity, chain_velocity = self.get_velocities(min_window)
+
+        if lag is None or indexing_velocity is None or chain_velocity is None:
+            return None
+
+        return max(0.0, lag + (chain_velocity - indexing_velocity) * horizon)
+
+    def is_stalled(self, stall_timeout: float = STALL_TIMEOUT) -> bool:
+        """
+        Check if the latest block has not changed for `stall_timeout` seconds while the version is behind
+        :return: bool
+        """
+
+        if not self.count or not self.get_lag():
+            return False
+
+        newest_timestamp, newest_latest_block_number, _ = self._get_sample(0)
+
+        # Oldest sample with the same latest block
+        for age in range(1, self.count):
+            timestamp, latest_block_number, _ = self._get_sample(age)
+            if latest_block_number != newest_latest_block_number:
+                break
+            if newest_timestamp - timestamp >= stall_timeout:
+                return True
+
+        return False
+
+
+class SyncVelocityService:
+    def __init__(self, size: int = VELOCITY_SAMPLES):
+        """
+        Sync velocity trackers of all subgraph versions
+        :param size: int. Max number of samples of each subgraph version
+        """
+
+        self.size = size
+        # {(subgraph name, version): {network: SyncVelocityTracker}}
+        self.trackers = {}
+        self.lock = threading.Lock()
+
+    def add_samples(self, subgraph_name: str, version: str, subgraph_status, timestamp: float, chains: list) -> dict:
+        """
+        Add a sample of each chain of a subgraph version. Samples of previous deployments of the version and of
+        chains that the version does not use anymore are discarded
+        :param subgraph_name: str
+        :param version: str. `current` or `pending`
+        :param subgraph_status: SubgraphStatus or None if the version does not exist
+        :param timestamp: float. Seconds
+        :param chains: list. ChainSyncStatus of each chain of the version (chain heads used to check it)
+        :return: dict. {network: SyncVelocityTracker} of the chains that have indexed some block
+        """
+
+        key = (subgraph_name, version)
+        chains = [chain for chain in chains if chain.latest_block_number is not None]
+
+        if not subgraph_status or not chains:
+            with self.lock:
+                self.trackers.pop(key, None)
+            return {}
+
+        with self.lock:
+            previous_trackers = self.trackers.get(key, {})
+            trackers = {}
+            for chain in chains:
+                tracker = previous_trackers.get(chain.network)
+                if tracker is None or tracker.deployment != subgraph_status.deployment:
+                    tracker = SyncVelocityTracker(subgraph_status.deployment, self.size)
+                trackers[chain.network] = tracker
+            self.trackers[key] = trackers
+
+        for chain in chains:
+            trackers[chain.network].add_sample(timestamp, chain.latest_block_number, chain.chain_head_block_number)
+
+        return trackers
+
+    def get_trackers(self, subgraph_name: str, version: str) -> dict:
+        """
+        :return: dict. {network: SyncVelocityTracker} (empty if the version has no samples)
+        """
+
+        return self.trackers.get((subgraph_name, version), {})
+
+
+class SyncVelocityProvider:
+    # Several threads can request the singleton at the same time
+    lock = threading.Lock()
+
+    def __new__(cls):
+        with cls.lock:
+            if not hasattr(cls, 'instance'):
+                cls.instance = SyncVelocityService()
+        return cls.instance
+
+    @classmethod
+    def del_singleton(cls):
+        if hasattr(cls, "instance"):
+            del cls.instance
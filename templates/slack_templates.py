@@ -86,3 +86,164 @@ def get_slack_pending_subgraph_notification_message(subgraph_name: str):
     }
 
     return message
+
+
+def get_slack_subgraph_recovered_notification_message(subgraph_name: str, subgraph_version: str, reason: str = None):
+    """
+    Get slack message template with defined values
+    :param subgraph_name:
+    :param subgraph_version:
+    :param reason: check that is OK again (e.g. `sync velocity`), or None if it is the status of the version
+    :return:
+    """
+
+    main_title = f":white_check_mark: `Subgraph {reason or 'status'} is OK again`"
+
+    message = {
+        'text': f'Subgraph is OK {reason or "status"} again',
+        'blocks': [
+            {
+                'type': 'section',
+                'text': {
+                    'type': 'mrkdwn',
+                    'text': main_title
+                }
+            },
+            {
+                'type': 'section',
+                'fields': [
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Subgraph name:*\n {subgraph_name}'
+                    },
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Version (current|pending):*\n `{subgraph_version}`'
+                    }
+                ]
+            }
+        ]
+    }
+
+    return message
+
+
+def get_slack_poi_mismatch_notification_message(subgraph_name: str, deployment: str, block_number: int,
+                                                proofs_of_indexing: dict):
+    """
+    Get slack message template with defined values
+    :param subgraph_name:
+    :param deployment:
+    :param block_number:
+    :param proofs_of_indexing: {index node: proof of indexing}
+    :return:
+    """
+
+    main_title = ":rotating_light: `Subgraph proofs of indexing do NOT match`"
+
+    message = {
+        'text': 'Subgraph proofs of indexing do NOT match',
+        'blocks': [
+            {
+                'type': 'section',
+                'text': {
+                    'type': 'mrkdwn',
+                    'text': main_title
+                }
+            },
+            {
+                'type': 'section',
+                'fields': [
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Subgraph name:*\n {subgraph_name}'
+                    },
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Deployment:*\n `{deployment}`'
+                    },
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Block:*\n {block_number}'
+                    }
+                ]
+            },
+            {
+                'type': 'section',
+                'text': {
+                    'type': 'mrkdwn',
+                    'text': '\n'.join(f'*{index_node}:*\n `{proof_of_indexing}`'
+                                      for index_node, proof_of_indexing in proofs_of_indexing.items())
+                }
+            }
+        ]
+    }
+
+    return message
+
+
+def get_slack_subgraph_sync_velocity_notification_message(subgraph_name: str, subgraph_version: str,
+                                                          subgraph_network: str, reason: str, lag, indexing_velocity,
+                                                          chain_velocity, catch_up_eta):
+    """
+    Get slack message template with defined values
+    :param subgraph_name:
+    :param subgraph_version:
+    :param subgraph_network: network of the chain whose sync velocity is notified
+    :param reason: `stalled`, `falling behind` or `not catching up`
+    :param lag: blocks behind the chain head
+    :param indexing_velocity: indexed blocks per second
+    :param chain_velocity: chain blocks per second
+    :param catch_up_eta: seconds until it reaches the chain head
+    :return:
+    """
+
+    main_title = f":hourglass: `Subgraph sync is {reason.upper()}`"
+
+    def format_number(number, unit=''):
+        return 'unknown' if number is None else f'{number:.2f}{unit}'
+
+    message = {
+        'text': f'Subgraph sync is {reason}',
+        'blocks': [
+            {
+                'type': 'section',
+                'text': {
+                    'type': 'mrkdwn',
+                    'text': main_title
+                }
+            },
+            {
+                'type': 'section',
+                'fields': [
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Subgraph name:*\n {subgraph_name}'
+                    },
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Version (current|pending):*\n `{subgraph_version}`'
+                    },
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Network:*\n {subgraph_network}'
+                    },
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Blocks behind:*\n {format_number(lag)}'
+                    },
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Indexing / chain velocity:*\n {format_number(indexing_velocity)} / '
+                                f'{format_number(chain_velocity)} blocks/s'
+                    },
+                    {
+                        'type': 'mrkdwn',
+                        'text': f'*Catch up ETA:*\n {format_number(catch_up_eta, " s")}'
+                    }
+                ]
+            }
+        ]
+    }
+
+    return message
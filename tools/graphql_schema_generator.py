@@ -1,41 +1,354 @@
-import os
-
+import argparse
+import hashlib
+import json
+import keyword
 import logging
+import os
+import re
+import sys
 
 # Configure logs format
 logging.basicConfig(
     format='%(asctime)s [%(levelname)s] %(message)s',
     level=logging.INFO)
 
+# Scalars defined by sgqlc
+BUILTIN_SCALARS = ('Int', 'Float', 'String', 'Boolean', 'ID')
+
+# Line of the generated module with the hash of its schema
+SCHEMA_HASH_PREFIX = '# Schema hash: '
+
+CAMEL_CASE_WORDS = re.compile('([^A-Z]+|[A-Z]+[^A-Z]*)')
+
+
+def fetch_introspection(graphql_endpoint: str) -> dict:
+    """
+    Run the introspection query in the Graphql endpoint (without descriptions and deprecated fields)
+    :param graphql_endpoint: str
+    :return: dict. `__schema` of the response
+    """
+
+    from sgqlc.endpoint.http import HTTPEndpoint
+    from sgqlc.introspection import query, variables
+
+    response = HTTPEndpoint(graphql_endpoint)(query, variables(include_description=False, include_deprecated=False))
+    if response.get('errors') or not response.get('data'):
+        raise RuntimeError(f'Introspection query failed. Errors: {response.get("errors")}')
+
+    return response['data']['__schema']
+
+
+def load_introspection(introspection_file: str) -> dict:
+    """
+    :param introspection_file: str. JSON response of the introspection query
+    :return: dict. `__schema` of the response
+    """
+
+    with open(introspection_file) as file:
+        introspection = json.load(file)
+
+    return introspection.get('data', introspection)['__schema']
+
+
+def get_monitor_queries() -> list:
+    """
+    :return: list. Queries that the monitor sends to the status endpoint
+    """
+
+    from services.thegraph_service import get_status_endpoint_queries
+
+    return get_status_endpoint_queries()
+
+
+def get_named_type(type_ref: dict) -> str:
+    while type_ref['kind'] in ('NON_NULL', 'LIST'):
+        type_ref = type_ref['ofType']
+    return type_ref['name']
+
+
+def get_selected_fields(schema: dict, queries: list) -> dict:
+    """
+    Get the fields of each type that are selected by the queries. Queries are parsed with graphql-core (installed
+    with sgqlc) and their fields are resolved against the introspected schema
+    :param schema: dict. `__schema` of the introspection
+    :param queries: list. Graphql documents
+    :return: dict. {type name: set of field names}
+    :raises ValueError: if a query selects a field that does not exist in the schema
+    """
+
+    from graphql import TypeInfo, TypeInfoVisitor, Visitor, build_client_schema, parse, visit
+
+    type_info = TypeInfo(build_client_schema({'__schema': schema}))
+    selected_fields = {}
+    missing_fields = set()
+
+    class SelectedFieldsVisitor(Visitor):
+        def enter_field(self, node, *_args):
+            field_name = node.name.value
+            parent_type = type_info.get_parent_type()
+            if field_name == '__typename' or parent_type is None:
+                return
+
+            if type_info.get_field_def() is None:
+                missing_fields.add(f'{parent_type.name}.{field_name}')
+            else:
+                selected_fields.setdefault(parent_type.name, set()).add(field_name)
+
+    for query in queries:
+        visit(parse(query), TypeInfoVisitor(type_info, SelectedFieldsVisitor()))
+
+    if missing_fields:
+        raise ValueError('Fields selected by the monitor do not exist in the schema: '
+                         f'{", ".join(sorted(missing_fields))}')
+
+    return selected_fields
+
+
+def trim_schema(schema: dict, selected_fields: dict) -> list:
+    """
+    Keep only the selected fields and the types they use (field types, argument types and implementations of
+    selected interfaces)
+    :param schema: dict. `__schema` of the introspection
+    :param selected_fields: dict. {type name: set of field names}
+    :return: list. Introspection types sorted by name
+    """
+
+    types = {schema_type['name']: schema_type for schema_type in schema['types']}
+    trimmed_types = {}
+
+    def keep_type(type_name: str):
+        if type_name in trimmed_types:
+            return
+
+        schema_type = types[type_name]
+        if schema_type['kind'] == 'INPUT_OBJECT':
+            trimmed_types[type_name] = schema_type
+            for input_field in schema_type['inputFields']:
+                keep_type(get_named_type(input_field['type']))
+        elif schema_type['kind'] in ('SCALAR', 'ENUM'):
+            trimmed_types[type_name] = schema_type
+
+    for type_name, field_names in selected_fields.items():
+        schema_type = types[type_name]
+        fields = [field for field in schema_type['fields'] if field['name'] in field_names]
+        trimmed_types[type_name] = dict(schema_type, fields=fields)
+
+        for field in fields:
+            keep_type(get_named_type(field['type']))
+            for argument in field['args']:
+                keep_type(get_named_type(argument['type']))
 
-def generate_schema(schema_info):
+    # Implementations of selected interfaces, so that their results can be interpreted
+    for type_name in list(trimmed_types):
+        if trimmed_types[type_name]['kind'] == 'INTERFACE':
+            for possible_type in trimmed_types[type_name]['possibleTypes'] or ():
+                if possible_type['name'] not in trimmed_types:
+                    trimmed_types[possible_type['name']] = dict(types[possible_type['name']], fields=[])
+
+    # Only selected interfaces are kept
+    for type_name, schema_type in trimmed_types.items():
+        if schema_type['kind'] == 'OBJECT':
+            trimmed_types[type_name] = dict(schema_type, interfaces=[
+                interface for interface in schema_type['interfaces'] or () if interface['name'] in trimmed_types])
+        elif schema_type['kind'] == 'INTERFACE':
+            trimmed_types[type_name] = dict(schema_type, possibleTypes=[
+                possible_type for possible_type in schema_type['possibleTypes'] or ()
+                if possible_type['name'] in trimmed_types])
+
+    return sorted(trimmed_types.values(), key=lambda schema_type: schema_type['name'])
+
+
+def get_schema_hash(query_type: str, types: list) -> str:
+    """
+    :return: str. SHA-256 of the trimmed schema. It does not depend on the order of the introspection
+    """
+
+    return hashlib.sha256(json.dumps({'query_type': query_type, 'types': types}, sort_keys=True).encode()).hexdigest()
+
+
+def read_schema_hash(schema_file: str):
+    """
+    :return: str. Hash of the schema of a generated module or None if it does not exist
+    """
+
+    try:
+        with open(schema_file) as file:
+            for line in file:
+                if line.startswith(SCHEMA_HASH_PREFIX):
+                    return line[len(SCHEMA_HASH_PREFIX):].strip()
+    except OSError:
+        pass
+
+    return None
+
+
+def graphql_to_python(name: str) -> str:
+    """
+    Convert camel case names to snake case, as `sgqlc-codegen` does
+    """
+
+    python_name = '_'.join(word.lower() for word in CAMEL_CASE_WORDS.findall(name))
+    return f'{python_name}_' if keyword.iskeyword(python_name) else python_name
+
+
+def generate_module(schema_name: str, query_type: str, types: list, schema_hash: str) -> str:
+    """
+    Generate the sgqlc module of a trimmed schema, with the same layout as `sgqlc-codegen`
+    :param schema_name: str. Name of the module and of its `sgqlc.types.Schema`
+    :param query_type: str
+    :param types: list. Trimmed introspection types
+    :param schema_hash: str
+    :return: str. Python code
+    """
+
+    types_by_name = {schema_type['name']: schema_type for schema_type in types}
+    written_types = set()
+    lines = []
+
+    def write_banner(text: str):
+        lines.extend(['', '#' * 72, f'# {text}', '#' * 72])
+
+    def get_type_ref(type_ref: dict, siblings: set) -> str:
+        if type_ref['kind'] == 'NON_NULL':
+            return f'sgqlc.types.non_null({get_type_ref(type_ref["ofType"], siblings)})'
+        if type_ref['kind'] == 'LIST':
+            return f'sgqlc.types.list_of({get_type_ref(type_ref["ofType"], siblings)})'
+
+        # Types that are not written yet are referenced by name
+        name = type_ref['name']
+        return name if name in written_types and name not in siblings else repr(name)
+
+    def get_default_value(default_value):
+        if default_value is None:
+            return None
+        if default_value.startswith('$'):
+            return f'sgqlc.types.Variable({default_value[1:]!r})'
+        try:
+            return repr(json.loads(default_value))
+        except ValueError:
+            # Enum values
+            return repr(default_value)
+
+    def write_container(schema_type: dict, bases: list, fields: list, is_input: bool = False):
+        siblings = {field['name'] for field in fields}
+        lines.append(f'class {schema_type["name"]}({", ".join(bases)}):')
+        lines.append(f'    __schema__ = {schema_name}')
+        lines.append(f'    __field_names__ = {tuple(graphql_to_python(field["name"]) for field in fields)!r}')
+
+        for field in fields:
+            field_code = f'    {graphql_to_python(field["name"])} = sgqlc.types.Field(' \
+                         f'{get_type_ref(field["type"], siblings)}, graphql_name={field["name"]!r}'
+            if is_input or not field['args']:
+                lines.append(f'{field_code})')
+                continue
+
+            lines.append(f'{field_code}, args=sgqlc.types.ArgDict((')
+            for argument in field['args']:
+                lines.append(f'        ({graphql_to_python(argument["name"])!r}, sgqlc.types.Arg('
+                             f'{get_type_ref(argument["type"], siblings)}, graphql_name={argument["name"]!r}, '
+                             f'default={get_default_value(argument["defaultValue"])})),')
+            lines.append('))')
+            lines.append('    )')
+
+        lines.extend(['', ''])
+        written_types.add(schema_type['name'])
+
+    lines.append('# Generated by `python tools/graphql_schema_generator.py` with only the types and fields '
+                 'selected by the monitor. Do not edit')
+    lines.append(f'{SCHEMA_HASH_PREFIX}{schema_hash}')
+    lines.append('import sgqlc.types')
+    lines.extend(['', '', f'{schema_name} = sgqlc.types.Schema()', '', ''])
+
+    write_banner('Scalars and Enumerations')
+    for schema_type in types:
+        name = schema_type['name']
+        if schema_type['kind'] == 'SCALAR':
+            if name in BUILTIN_SCALARS:
+                lines.extend([f'{name} = sgqlc.types.{name}', ''])
+            else:
+                lines.extend([f'class {name}(sgqlc.types.Scalar):', f'    __schema__ = {schema_name}', '', ''])
+            written_types.add(name)
+        elif schema_type['kind'] == 'ENUM':
+            choices = tuple(enum_value['name'] for enum_value in schema_type['enumValues'])
+            lines.extend([f'class {name}(sgqlc.types.Enum):', f'    __schema__ = {schema_name}',
+                          f'    __choices__ = {choices!r}', '', ''])
+            written_types.add(name)
+
+    write_banner('Input Objects')
+    for schema_type in types:
+        if schema_type['kind'] == 'INPUT_OBJECT':
+            write_container(schema_type, ['sgqlc.types.Input'], schema_type['inputFields'], is_input=True)
+
+    write_banner('Output Objects and Interfaces')
+    for schema_type in types:
+        if schema_type['kind'] == 'INTERFACE':
+            write_container(schema_type, ['sgqlc.types.Interface'], schema_type['fields'])
+
+    for schema_type in types:
+        if schema_type['kind'] == 'OBJECT':
+            interfaces = [interface['name'] for interface in schema_type['interfaces'] or ()]
+            inherited_fields = {field['name'] for interface in interfaces
+                                for field in types_by_name[interface]['fields']}
+            write_container(schema_type, ['sgqlc.types.Type'] + interfaces,
+                            [field for field in schema_type['fields'] if field['name'] not in inherited_fields])
+
+    write_banner('Unions')
+    for schema_type in types:
+        if schema_type['kind'] == 'UNION':
+            possible_types = tuple(possible_type['name'] for possible_type in schema_type['possibleTypes'])
+            lines.extend([f'class {schema_type["name"]}(sgqlc.types.Union):', f'    __schema__ = {schema_name}',
+                          f'    __types__ = ({", ".join(possible_types)}{"," if len(possible_types) == 1 else ""})',
+                          '', ''])
+
+    write_banner('Schema Entry Points')
+    lines.append(f'{schema_name}.query_type = {query_type}')
+    lines.append(f'{schema_name}.mutation_type = None')
+    lines.append(f'{schema_name}.subscription_type = None')
+
+    return '\n'.join(lines) + '\n'
+
+
+def generate_schema(schema_info: dict, force: bool = False, introspection_file: str = None) -> bool:
     """
     Generate a Graphql schema from a Graphql endpoint.
-    That would be use later as a Python module to request Graphql data
+    That would be use later as a Python module to request Graphql data.
+    Introspection runs in-process and only the types and fields selected by the monitor queries are generated.
+    The module is not written again if the hash of its schema has not changed
 
     More information https://pypi.org/project/sgqlc/
+    :param schema_info: dict. `schema_name`, `graphql_endpoint` and `schemas_dir`
+    :param force: bool. Write the module even if the schema has not changed
+    :param introspection_file: str. Introspection JSON used instead of requesting the endpoint
+    :return: bool. True if the module was written
     """
 
+    schema_file = os.path.join(schema_info['schemas_dir'], f'{schema_info["schema_name"]}.py')
 
     # 1. Get Graphql JSON schema
-    introspection_command = f"python -m sgqlc.introspection \
-                             --exclude-deprecated \
-                             --exclude-description \
-                             {schema_info['graphql_endpoint']} \
-                             {schema_info['schema_name']}.json"
-    os.system(introspection_command)
+    if introspection_file:
+        schema = load_introspection(introspection_file)
+    else:
+        schema = fetch_introspection(schema_info['graphql_endpoint'])
 
-    # 2. Generate Graphql Python schema from the JSON schema
-    graphql_schema_generator_command = f"sgqlc-codegen {schema_info['schema_name']}.json {schema_info['schema_name']}.py"
-    os.system(graphql_schema_generator_command)
+    # 2. Keep only the types that the monitor uses
+    query_type = schema['queryType']['name']
+    types = trim_schema(schema, get_selected_fields(schema, get_monitor_queries()))
 
-    # 3. Move Graphql Python schema to schemas folder
-    move_py_schema_cmd = f"mv {schema_info['schema_name']}.py {schema_info['schemas_dir']}"
-    os.system(move_py_schema_cmd)
+    schema_hash = get_schema_hash(query_type, types)
+    if not force and read_schema_hash(schema_file) == schema_hash:
+        logging.info(f'Schema {schema_info["schema_name"]} has not changed (hash {schema_hash})')
+        return False
 
-    # 4. Remove temporal files
-    remove_json_schema_cmd = f"rm {schema_info['schema_name']}.json"
-    os.system(remove_json_schema_cmd)
+    # 3. Generate Graphql Python schema. It is replaced atomically, so it is never left half written
+    code = generate_module(schema_info['schema_name'], query_type, types, schema_hash)
+    compile(code, schema_file, 'exec')
+
+    temporary_schema_file = f'{schema_file}.tmp'
+    with open(temporary_schema_file, 'w') as file:
+        file.write(code)
+    os.replace(temporary_schema_file, schema_file)
+
+    return True
 
 
 if __name__ == '__main__':
@@ -45,14 +358,23 @@ if __name__ == '__main__':
     project_dir = os.path.abspath(os.path.join(file_dir, os.pardir))
     schemas_dir = os.path.join(project_dir, 'graphql_schemas')
 
+    # Monitor queries are read from `services`
+    sys.path.insert(0, project_dir)
+
+    parser = argparse.ArgumentParser(description='Generate the schema of Thegraph status endpoint')
+    parser.add_argument('--endpoint', default='https://api.thegraph.com/index-node/graphql',
+                        help='Graphql endpoint (by default Thegraph status endpoint)')
+    parser.add_argument('--introspection-file', help='Introspection JSON used instead of requesting the endpoint')
+    parser.add_argument('--force', action='store_true', help='Generate the schema even if it has not changed')
+    args = parser.parse_args()
+
     # Info to download the Thegraph schema
     schema_info = {
         'schema_name': 'subgraph_status_schema',
-        'graphql_endpoint': 'https://api.thegraph.com/index-node/graphql',
+        'graphql_endpoint': args.endpoint,
         'schemas_dir': schemas_dir
     }
 
     # Generate Thegraph status endpoint schema
-    generate_schema(schema_info=schema_info)
-
-    logging.info(f"Schema {schema_info['schema_name']} generated")
+    if generate_schema(schema_info=schema_info, force=args.force, introspection_file=args.introspection_file):
+        logging.info(f"Schema {schema_info['schema_name']} generated")